@@ -1,6 +1,7 @@
-from flask import Flask, render_template, request, jsonify, session, send_file, g
-import requests
-from google import genai
+from flask import (
+    Flask, Blueprint, current_app, render_template, request, jsonify, session, send_file, g, stream_with_context,
+    has_app_context, make_response, url_for, copy_current_request_context
+)
 import os
 import re
 import logging
@@ -8,86 +9,106 @@ from dotenv import load_dotenv
 
 load_dotenv()
 import json
+import html
+import sqlite3
 import uuid
+import threading
+import mimetypes
+import signal
+import time
+import functools
+import hmac
+import urllib.parse
 from datetime import datetime
-import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Response
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-import textwrap
-from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from response_cache import ResponseCache, replay_chunks
+from scheduler import RateLimitScheduler, QueueStatus, estimate_tokens
+from pdf_export import PDFCache
+from cover_cache import CoverCache, HttpCoverFetcher, StubCoverFetcher
+from fake_gemini import FakeGeminiClient
+from sse import SSEPolicy, ThreadedSource, iter_frames
+from single_flight import SingleFlight
+from model_router import ModelRouter, StreamCancelled
+from metrics import (
+    REGISTRY, timed_stream, GEMINI_CACHE_HITS, RATE_LIMIT_WAIT, RATE_LIMIT_EVENTS,
+    DB_QUERY_SECONDS, HTTP_SECONDS
+)
+from database import (
+    ConnectionPool, init_db, pending_migrations, insert_story, update_user_stats, rebuild_user_stats,
+    get_feed_version, read_story_body, recompress_stories, rebuild_search_index, unindex_story, STORY_CODEC
+)
+from story_codec import StoryCodec, train_dictionary
+from feed_cache import FeedCache
+from story_writer import StoryWriter
+from batch_generation import BatchRunner
+from story_memory import StoryMemory
+from stream_buffer import StreamBuffer, StreamNotFound
+from static_assets import AssetManifest, build_assets
+from job_queue import JobQueue, JobWorker, JobNotFound
+import atexit
+import base64
+import click
+import statistics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
-
-# Initialize database
-def init_db():
-    """Initialize the SQLite database"""
-    with sqlite3.connect('stories.db') as conn:
-        c = conn.cursor()
-    
-    # Users table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Stories table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS stories (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            title TEXT,
-            prompt TEXT NOT NULL,
-            story TEXT NOT NULL,
-            genre TEXT,
-            word_count INTEGER,
-            rating INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_public BOOLEAN DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Story collections/favorites
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS favorites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            story_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (story_id) REFERENCES stories (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Routes and CLI commands live on a blueprint; create_app() builds the Flask app around it
+bp = Blueprint('storygen', __name__, cli_group=None)
+
+def genai_types():
+    """google.genai.types, imported on first use since the SDK takes most of a second to load"""
+    from google.genai import types
+    return types
 
 class StoryGenerator:
-    def __init__(self):
-        self.model_name = "gemini-3.1-flash-lite"
+    def __init__(self, client=None):
+        # Ordered fallback chain (GEMINI_MODELS); the first model names cache entries
+        self.router = ModelRouter.from_env(os.environ, "gemini-3.1-flash-lite")
+        self.model_name = self.router.primary
         
-        # Configure Gemini API
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if api_key:
-            self.client = genai.Client(api_key=api_key)
+        # Configure Gemini API (GEMINI_BACKEND=fake swaps in the offline stand-in)
+        self.backend = os.environ.get('GEMINI_BACKEND', 'genai')
+        self.api_key = None
+        self._client = None
+        self._client_lock = threading.Lock()
+        if client is not None:
+            self._client = client
+        elif self.backend == 'fake':
+            self._client = FakeGeminiClient.from_env()
+        elif os.environ.get("GEMINI_API_KEY"):
+            self.api_key = os.environ.get("GEMINI_API_KEY")
         else:
             logger.warning("GEMINI_API_KEY environment variable not set!")
-            self.client = None
+        
+        # Bounded pool shared by all fan-out calls (e.g. multiple endings)
+        self.max_workers = int(os.environ.get('GEMINI_MAX_WORKERS', 8))
+        self.ending_timeout = float(os.environ.get('ENDING_TIMEOUT', 45))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gemini')
+        
+        # Response cache keyed on prompt, model and sampling parameters
+        self.cache_enabled = os.environ.get('RESPONSE_CACHE_ENABLED', '1') != '0'
+        self.cache = ResponseCache(
+            max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 256)),
+            ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+            db_path=os.environ.get('RESPONSE_CACHE_DB') or None,
+            db_max_entries=int(os.environ.get('RESPONSE_CACHE_DB_SIZE', 5000))
+        )
+        
+        # Client-side request/token budget with per-user fair queuing
+        self.scheduler = RateLimitScheduler(
+            rpm=int(os.environ.get('GEMINI_RPM', 15)),
+            tpm=int(os.environ.get('GEMINI_TPM', 250000)),
+            db_path=os.environ.get('RATE_LIMIT_DB') or None,
+            max_wait=float(os.environ.get('RATE_LIMIT_MAX_WAIT', 120))
+        )
+        self.rate_limit_retries = int(os.environ.get('RATE_LIMIT_RETRIES', 2))
+        
+        # Identical concurrent streams share one upstream call (opt-in)
+        self.single_flight = SingleFlight() if os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1' else None
             
         self.genres = {
             'fantasy': "In a magical realm where",
@@ -99,97 +120,396 @@ class StoryGenerator:
             'comedy': "It was supposed to be a normal Tuesday, but nothing about this day would be"
         }
     
+    @property
+    def client(self):
+        """The Gemini client, created on first use so workers don't import the SDK at startup"""
+        if self._client is None and self.api_key:
+            with self._client_lock:
+                if self._client is None:
+                    from google import genai
+                    self._client = genai.Client(api_key=self.api_key)
+        return self._client
+    
+    @property
+    def configured(self):
+        """Whether a client is available, without creating it"""
+        return self._client is not None or self.api_key is not None
+    
     def get_model_info(self):
         """Get information about the loaded model"""
         return {
             'model_name': self.model_name,
-            'local_path': "Google Cloud API",
-            'model_exists': bool(os.environ.get("GEMINI_API_KEY")),
+            'fallback_models': [route.name for route in self.router.routes[1:]],
+            'local_path': "Local fake backend" if self.backend == 'fake' else "Google Cloud API",
+            'model_exists': self.configured,
             'model_size_mb': "Cloud"
         }
     
     def get_model_size(self):
         return 0
     
-    def _call_gemini(self, prompt, temperature, top_p):
+    def rate_limit_message(self):
+        """User-facing message for a RATE_LIMIT error, quoting the configured request budget"""
+        budget = f" Gemini calls are limited to {self.scheduler.rpm} requests per minute." if self.scheduler.rpm else ""
+        return f"⏳ You are generating stories too fast!{budget} Please wait about 60 seconds and try again."
+    
+    @staticmethod
+    def _is_rate_limit(error):
+        error_msg = str(error).lower()
+        return "429" in error_msg or "quota" in error_msg or "exhausted" in error_msg
+    
+    def _call_gemini(self, prompt, temperature, top_p, timeout=None, use_cache=True, user_key=None, expected_tokens=512, endpoint='other'):
         """Helper to call Gemini API"""
-        if not os.environ.get("GEMINI_API_KEY") or not self.client:
+        use_cache = use_cache and self.cache_enabled
+        if use_cache:
+            cache_key = self.cache.make_key(prompt, self.model_name, temperature, top_p)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                GEMINI_CACHE_HITS.inc(endpoint=endpoint)
+                return cached
+        
+        if not self.client:
             raise ValueError("GEMINI_API_KEY environment variable is not set. Please set it to use the AI generator.")
-            
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=genai.types.GenerateContentConfig(
-                    temperature=temperature,
-                    top_p=top_p,
+        
+        tokens = estimate_tokens(prompt) + expected_tokens
+        attempt = 0
+        while True:
+            with RATE_LIMIT_WAIT.time(endpoint=endpoint):
+                self.scheduler.acquire(user_key, tokens)
+            try:
+                text = self.router.call(
+                    functools.partial(self._send_prompt, prompt, temperature, top_p, timeout), endpoint,
+                    self._is_rate_limit
                 )
+                self.scheduler.report_success()
+                if use_cache and text:
+                    self.cache.set(cache_key, text)
+                return text
+            except Exception as e:
+                error_msg = str(e)
+                if self._is_rate_limit(e):
+                    self.scheduler.report_rate_limit()
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='upstream_429')
+                    if attempt < self.rate_limit_retries:
+                        attempt += 1
+                        RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='retry')
+                        continue
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='failed')
+                    logger.error(f"Rate limit hit: {error_msg}")
+                    raise Exception("RATE_LIMIT")
+                logger.error(f"Gemini API error: {error_msg}")
+                raise e
+    
+    @staticmethod
+    def _request_config(temperature, top_p, timeout):
+        """Sampling parameters plus the SDK's HTTP deadline for one model attempt"""
+        return genai_types().GenerateContentConfig(
+            temperature=temperature,
+            top_p=top_p,
+            http_options=genai_types().HttpOptions(timeout=int(timeout * 1000)),
+        )
+    
+    def _send_prompt(self, prompt, temperature, top_p, timeout, model, model_timeout):
+        """One non-streaming request to model, bounded by the tighter of the two timeouts"""
+        timeout = min(timeout, model_timeout) if timeout else model_timeout
+        response = self.client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=self._request_config(temperature, top_p, timeout)
+        )
+        return response.text
+    
+    def _stream_opener(self, prompt, temperature, top_p):
+        """open_stream(model, timeout) for the router, yielding one model's text chunks"""
+        def open_stream(model, timeout):
+            config = self._request_config(temperature, top_p, timeout)
+            response = self.client.models.generate_content_stream(model=model, contents=prompt, config=config)
+            try:
+                for chunk in response:
+                    yield chunk.text
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        return open_stream
+    
+    def _astream_opener(self, prompt, temperature, top_p):
+        """Async counterpart of _stream_opener"""
+        async def texts(response):
+            try:
+                async for chunk in response:
+                    yield chunk.text
+            finally:
+                if hasattr(response, 'aclose'):
+                    await response.aclose()
+        
+        async def open_stream(model, timeout):
+            config = self._request_config(temperature, top_p, timeout)
+            return texts(await self.client.aio.models.generate_content_stream(model=model, contents=prompt, config=config))
+        return open_stream
+    
+    def _call_gemini_stream(self, prompt, temperature, top_p, use_cache=True, user_key=None, expected_tokens=512, report_queue=False, endpoint='other', shared=True, cancelled=None):
+        """Helper to call Gemini API and stream the response
+        
+        With report_queue=True, QueueStatus items are yielded while the call
+        waits for a rate limit slot, before any text chunks. With single-flight
+        enabled, identical in-flight requests (same prompt, sampling parameters
+        and use_cache) share one upstream stream. Setting the cancelled event
+        stops the call, or this request's share of it, even while Gemini is silent.
+        """
+        if shared and self.single_flight is not None:
+            # Requests that asked for a fresh answer never join one that may be replayed from the cache
+            key = (self.cache.make_key(prompt, self.model_name, temperature, top_p), use_cache)
+            upstream = functools.partial(
+                self._call_gemini_stream, prompt, temperature, top_p, use_cache=use_cache, user_key=user_key,
+                expected_tokens=expected_tokens, report_queue=True, endpoint=endpoint, shared=False
             )
-            return response.text
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "quota" in error_msg.lower() or "exhausted" in error_msg.lower():
-                logger.error(f"Rate limit hit: {error_msg}")
-                raise Exception("RATE_LIMIT")
-            logger.error(f"Gemini API error: {error_msg}")
-            raise e
-            
-    def _call_gemini_stream(self, prompt, temperature, top_p):
-        """Helper to call Gemini API and stream the response"""
-        if not os.environ.get("GEMINI_API_KEY") or not self.client:
+            for item in self.single_flight.join(key, upstream, cancelled):
+                if report_queue or not isinstance(item, QueueStatus):
+                    yield item
+            if cancelled is not None and cancelled.is_set():
+                raise StreamCancelled("The caller stopped waiting for this stream")
+            return
+        
+        use_cache = use_cache and self.cache_enabled
+        if use_cache:
+            cache_key = self.cache.make_key(prompt, self.model_name, temperature, top_p)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                GEMINI_CACHE_HITS.inc(endpoint=endpoint)
+                yield from replay_chunks(cached)
+                return
+        
+        if not self.client:
             raise ValueError("GEMINI_API_KEY environment variable is not set.")
+        
+        tokens = estimate_tokens(prompt) + expected_tokens
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            for status in self.scheduler.wait(user_key, tokens):
+                if report_queue:
+                    yield status
+            RATE_LIMIT_WAIT.observe(time.perf_counter() - queued_at, endpoint=endpoint)
             
-        try:
-            response = self.client.models.generate_content_stream(
-                model=self.model_name,
-                contents=prompt,
-                config=genai.types.GenerateContentConfig(
-                    temperature=temperature,
-                    top_p=top_p,
+            started = False
+            try:
+                parts = []
+                stream = self.router.stream(
+                    self._stream_opener(prompt, temperature, top_p), endpoint, self._is_rate_limit,
+                    can_hedge=lambda: self.scheduler.try_acquire(tokens), cancelled=cancelled
                 )
+                for text in stream:
+                    started = True
+                    if use_cache:
+                        parts.append(text)
+                    yield text
+                self.scheduler.report_success()
+                # Only complete streams are cached; an abandoned stream never gets here
+                if use_cache and parts:
+                    self.cache.set(cache_key, ''.join(parts))
+                return
+            except StreamCancelled:
+                raise
+            except Exception as e:
+                error_msg = str(e)
+                if self._is_rate_limit(e):
+                    self.scheduler.report_rate_limit()
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='upstream_429')
+                    # Retrying is only safe before the client has seen any text
+                    if not started and attempt < self.rate_limit_retries:
+                        attempt += 1
+                        RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='retry')
+                        continue
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='failed')
+                    logger.error(f"Rate limit hit: {error_msg}")
+                    raise Exception("RATE_LIMIT")
+                logger.error(f"Gemini API error: {error_msg}")
+                raise e
+            
+    async def _call_gemini_stream_async(self, prompt, temperature, top_p, use_cache=True, user_key=None, expected_tokens=512, report_queue=False, endpoint='other'):
+        """Async counterpart of _call_gemini_stream for the ASGI server
+        
+        Cancelling the consuming task closes the upstream stream. Shared
+        streams run on the single-flight driver thread and are closed once
+        their last subscriber leaves.
+        """
+        if self.single_flight is not None:
+            key = (self.cache.make_key(prompt, self.model_name, temperature, top_p), use_cache)
+            upstream = functools.partial(
+                self._call_gemini_stream, prompt, temperature, top_p, use_cache=use_cache, user_key=user_key,
+                expected_tokens=expected_tokens, report_queue=True, endpoint=endpoint, shared=False
             )
-            for chunk in response:
-                yield chunk.text
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "quota" in error_msg.lower() or "exhausted" in error_msg.lower():
-                logger.error(f"Rate limit hit: {error_msg}")
-                raise Exception("RATE_LIMIT")
-            logger.error(f"Gemini API error: {error_msg}")
-            raise e
+            async for item in self.single_flight.join_async(key, upstream):
+                if report_queue or not isinstance(item, QueueStatus):
+                    yield item
+            return
+        
+        use_cache = use_cache and self.cache_enabled
+        if use_cache:
+            cache_key = self.cache.make_key(prompt, self.model_name, temperature, top_p)
+            cached = await self.cache.get_async(cache_key)
+            if cached is not None:
+                GEMINI_CACHE_HITS.inc(endpoint=endpoint)
+                for piece in replay_chunks(cached):
+                    yield piece
+                return
+        
+        if not self.client:
+            raise ValueError("GEMINI_API_KEY environment variable is not set.")
+        
+        tokens = estimate_tokens(prompt) + expected_tokens
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            async for status in self.scheduler.wait_async(user_key, tokens):
+                if report_queue:
+                    yield status
+            RATE_LIMIT_WAIT.observe(time.perf_counter() - queued_at, endpoint=endpoint)
             
-    def generate_story(self, prompt, max_length=300, temperature=0.8, top_p=0.9, genre=None):
+            started = False
+            try:
+                parts = []
+                stream = self.router.astream(
+                    self._astream_opener(prompt, temperature, top_p), endpoint, self._is_rate_limit,
+                    can_hedge=lambda: self.scheduler.try_acquire_async(tokens)
+                )
+                try:
+                    async for text in stream:
+                        started = True
+                        if use_cache:
+                            parts.append(text)
+                        yield text
+                finally:
+                    await stream.aclose()
+                self.scheduler.report_success()
+                if use_cache and parts:
+                    await self.cache.set_async(cache_key, ''.join(parts))
+                return
+            except Exception as e:
+                error_msg = str(e)
+                if self._is_rate_limit(e):
+                    await self.scheduler.report_rate_limit_async()
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='upstream_429')
+                    if not started and attempt < self.rate_limit_retries:
+                        attempt += 1
+                        RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='retry')
+                        continue
+                    RATE_LIMIT_EVENTS.inc(endpoint=endpoint, event='failed')
+                    logger.error(f"Rate limit hit: {error_msg}")
+                    raise Exception("RATE_LIMIT")
+                logger.error(f"Gemini API error: {error_msg}")
+                raise e
+    
+    def build_story_prompt(self, prompt, max_length=300, genre=None):
+        """Return the cleaned prompt and the instruction sent to Gemini"""
+        if genre and genre in self.genres:
+            genre_prompt = self.genres[genre]
+            prompt = f"{genre_prompt} {prompt}"
+        
+        prompt = self.clean_prompt(prompt)
+        instruct_prompt = f"Write a creative story starting exactly with the following prompt. Do not include any meta-commentary, titles, or intro, just write the story. Make the story roughly {max_length} words.\n\nPrompt: {prompt}"
+        return prompt, instruct_prompt
+    
+    def generate_story(self, prompt, max_length=300, temperature=0.8, top_p=0.9, genre=None, use_cache=True, user_key=None, endpoint='generate'):
         """Generate a story based on the given prompt"""
         try:
-            if genre and genre in self.genres:
-                genre_prompt = self.genres[genre]
-                prompt = f"{genre_prompt} {prompt}"
-            
-            prompt = self.clean_prompt(prompt)
-            instruct_prompt = f"Write a creative story starting exactly with the following prompt. Do not include any meta-commentary, titles, or intro, just write the story. Make the story roughly {max_length} words.\n\nPrompt: {prompt}"
+            prompt, instruct_prompt = self.build_story_prompt(prompt, max_length, genre)
             
-            story_text = self._call_gemini(instruct_prompt, temperature, top_p)
+            story_text = self._call_gemini(instruct_prompt, temperature, top_p, use_cache=use_cache,
+                                           user_key=user_key, expected_tokens=int(max_length * 1.5),
+                                           endpoint=endpoint)
             
             return self.post_process_story(story_text, prompt)
             
         except Exception as e:
             if str(e) == "RATE_LIMIT":
-                return "⏳ You are generating stories too fast! Google's Free Tier limits you to 5 requests per minute. Please wait about 60 seconds and try again."
+                return self.rate_limit_message()
             logger.error(f"Error generating story: {str(e)}")
             return f"Sorry, there was an error generating your story. Did you set your GEMINI_API_KEY? Error: {str(e)}"
     
-    def generate_multiple_endings(self, story_beginning, num_endings=3):
-        """Generate multiple different endings for a story"""
-        endings = []
+    def generate_story_stream(self, prompt, max_length=300, temperature=0.8, top_p=0.9, genre=None, use_cache=True, user_key=None, endpoint='generate'):
+        """Stream a story for the given prompt, yielding QueueStatus while waiting for a slot
+        
+        Unlike generate_story, errors propagate to the caller and the prompt is not re-prepended.
+        """
+        prompt, instruct_prompt = self.build_story_prompt(prompt, max_length, genre)
+        return self._call_gemini_stream(instruct_prompt, temperature, top_p, use_cache=use_cache, user_key=user_key,
+                                        expected_tokens=int(max_length * 1.5), report_queue=True, endpoint=endpoint)
+    
+    def build_continue_prompt(self, summary, recent, max_length=150):
+        """Return the instruction for continuing a story from its summary and latest passage"""
+        context = f"Summary of the story so far: {summary}\n\n" if summary else ""
+        return f"Continue the following story with roughly {max_length} words that pick up exactly where the most recent passage ends, keeping the characters, plot and tone consistent. Use Markdown formatting like the story does. Do not repeat earlier text and do not include any meta-commentary.\n\n{context}Most recent passage:\n{recent}"
+    
+    def summarize_passage(self, summary, passage, max_words, user_key=None):
+        """Fold a passage into a story's running summary"""
+        prompt = f"You keep a running summary of a story for a writer who will continue it. Update the summary with the new passage, keeping named characters, their goals and relationships, unresolved plot threads, setting and tone. Reply with the updated summary only, in at most {max_words} words.\n\nCurrent summary: {summary or '(none yet)'}\n\nNew passage:\n{passage}"
+        return self._call_gemini(prompt, 0.2, 0.9, user_key=user_key, expected_tokens=int(max_words * 1.5),
+                                 endpoint='summarize')
+    
+    def write_continuation(self, summary, recent, max_length=150, temperature=0.8, use_cache=True, user_key=None):
+        """Generate the next passage of a story, raising on errors (RATE_LIMIT included)"""
+        text = self._call_gemini(self.build_continue_prompt(summary, recent, max_length), temperature, 0.9,
+                                 use_cache=use_cache, user_key=user_key,
+                                 expected_tokens=int(max_length * 1.5), endpoint='continue')
+        text = re.sub(r'\n+', '\n\n', text).strip()
+        if text.startswith(recent.strip()):
+            text = text[len(recent.strip()):].strip()
+        return text
+    
+    def continue_story(self, summary, recent, max_length=150, temperature=0.8, use_cache=True, user_key=None):
+        """Generate the next passage of a story, without the story itself"""
+        try:
+            return self.write_continuation(summary, recent, max_length, temperature, use_cache, user_key)
+            
+        except Exception as e:
+            if str(e) == "RATE_LIMIT":
+                return self.rate_limit_message()
+            logger.error(f"Error continuing story: {str(e)}")
+            return f"Sorry, there was an error continuing your story. Did you set your GEMINI_API_KEY? Error: {str(e)}"
+    
+    def iter_multiple_endings(self, story_beginning, num_endings=3, timeout=None, use_cache=True, user_key=None):
+        """Generate endings concurrently, yielding each one as soon as it finishes.
+        
+        Yields dicts with ``index`` and either ``ending`` or ``error``. A failed or
+        timed out ending does not affect the others.
+        """
+        timeout = timeout or self.ending_timeout
+        prompt = f"Provide a single possible short ending for the following story. Do not provide commentary, just the ending text.\n\nStory: {story_beginning}"
+        
+        futures = {}
         for i in range(num_endings):
             temp = 0.7 + (i * 0.1)
-            prompt = f"Provide a single possible short ending for the following story. Do not provide commentary, just the ending text.\n\nStory: {story_beginning}"
-            ending = self._call_gemini(prompt, temp, 0.9)
-            endings.append(ending)
-        return endings
+            future = self.executor.submit(self._call_gemini, prompt, temp, 0.9, timeout, use_cache, user_key,
+                                          endpoint='multiple-endings')
+            futures[future] = i
+        
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                index = futures[future]
+                try:
+                    yield {'index': index, 'ending': future.result()}
+                except Exception as e:
+                    logger.error(f"Ending {index + 1} failed: {str(e)}")
+                    yield {'index': index, 'error': str(e)}
+        except FuturesTimeoutError:
+            for future in pending:
+                future.cancel()
+                yield {'index': futures[future], 'error': 'TIMEOUT'}
+        finally:
+            # Client went away mid-stream; don't start endings nobody will read
+            for future in pending:
+                future.cancel()
     
-    def enhance_story(self, story, enhancement_type="detail"):
-        """Enhance an existing story with more details, dialogue, or descriptions"""
+    def generate_multiple_endings(self, story_beginning, num_endings=3, timeout=None, use_cache=True, user_key=None):
+        """Generate multiple different endings for a story"""
+        results = sorted(self.iter_multiple_endings(story_beginning, num_endings, timeout, use_cache, user_key), key=lambda r: r['index'])
+        return [r['ending'] for r in results if 'ending' in r]
+    
+    def build_enhance_prompt(self, story, enhancement_type="detail"):
+        """Build the rewrite instruction for an enhancement type"""
         enhancement_prompts = {
             "detail": "Rewrite and expand this story with more vivid details and descriptions:\n\n",
             "dialogue": "Rewrite this story adding more character dialogue:\n\n",
@@ -198,11 +518,23 @@ class StoryGenerator:
         }
         
         instruction = enhancement_prompts.get(enhancement_type, enhancement_prompts["detail"])
-        prompt = f"{instruction}{story}\n\nJust provide the rewritten story without any introductory text."
+        return f"{instruction}{story}\n\nJust provide the rewritten story without any introductory text."
+    
+    def enhance_story(self, story, enhancement_type="detail", use_cache=True, user_key=None):
+        """Enhance an existing story with more details, dialogue, or descriptions"""
+        prompt = self.build_enhance_prompt(story, enhancement_type)
         
-        enhanced = self._call_gemini(prompt, 0.7, 0.9)
+        enhanced = self._call_gemini(prompt, 0.7, 0.9, use_cache=use_cache, user_key=user_key,
+                                     expected_tokens=int(estimate_tokens(story) * 1.5), endpoint='enhance')
         return enhanced
     
+    def enhance_story_stream(self, story, enhancement_type="detail", use_cache=True, user_key=None):
+        """Stream an enhanced story, yielding QueueStatus while waiting for a slot"""
+        prompt = self.build_enhance_prompt(story, enhancement_type)
+        return self._call_gemini_stream(prompt, 0.7, 0.9, use_cache=use_cache, user_key=user_key,
+                                        expected_tokens=int(estimate_tokens(story) * 1.5), report_queue=True,
+                                        endpoint='enhance')
+    
     def clean_prompt(self, prompt):
         """Clean and format the input prompt"""
         prompt = prompt.strip()
@@ -222,202 +554,924 @@ class StoryGenerator:
         return story.strip()
 
 # Database helper functions
+db_pool = ConnectionPool(size=int(os.environ.get('DB_POOL_SIZE', 8)))
+
+# Rendered PDFs on disk; the cache scans its directory, so create_app() builds it
+pdf_cache = None
+
+# Cover images are fetched once through /cover/<key> instead of hotlinked on every view
+COVER_PROXY_ENABLED = os.environ.get('COVER_PROXY_ENABLED', '1') == '1'
+cover_cache = None
+_registered_covers = set()
+COVER_WAIT = 90
+COVER_MAX_AGE = 365 * 24 * 3600
+
+# Fingerprinted, precompressed copies of static/ made by `flask build-assets`, served from /assets/
+STATIC_DIR = os.path.join(bp.root_path, 'static')
+asset_manifest = AssetManifest(os.environ.get('ASSET_DIR') or os.path.join(STATIC_DIR, 'dist'))
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Serialized /public-stories pages, refreshed when the feed version in SQLite changes
+public_feed = FeedCache(
+    ttl=float(os.environ.get('PUBLIC_FEED_TTL', 1)),
+    max_pages=int(os.environ.get('PUBLIC_FEED_MAX_PAGES', 64))
+)
+
+def invalidate_public_feed(batch):
+    if any(write.story_data.get('is_public') for write in batch):
+        public_feed.invalidate()
+
+# Optional write-behind queue that commits saved stories in batches on its own thread (started by create_app)
+story_writer = None
+
+# Longest a read of a just-saved story waits for the writer to commit it
+STORY_WRITE_WAIT = 10
+
 def get_db():
     """Get database connection"""
     if 'db' not in g:
-        g.db = sqlite3.connect('stories.db')
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.acquire()
     return g.db
 
-@app.teardown_appcontext
 def close_db(error):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
-def save_story(user_id, story_data):
-    """Save a story to the database"""
-    conn = get_db()
+def timed_db_helper(func):
+    """Record a database helper's duration per helper and towards the request's db time"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.observe(elapsed, helper=func.__name__)
+            if has_app_context():
+                g.db_time = g.get('db_time', 0.0) + elapsed
+    return wrapper
+
+@timed_db_helper
+def save_story(user_id, story_data, durable=False):
+    """Save a story to the database
+    
+    With write-behind enabled the id is assigned now and the row is committed
+    by the writer thread; durable=True waits for that commit.
+    """
     story_id = str(uuid.uuid4())
+    if story_writer is not None:
+        pending = story_writer.submit(story_id, user_id, story_data)
+        if durable:
+            pending.wait()
+    else:
+        conn = get_db()
+        insert_story(conn, story_id, user_id, story_data)
+        conn.commit()
+        if story_data.get('is_public'):
+            public_feed.invalidate()
     
-    conn.execute('''
-        INSERT INTO stories (id, user_id, title, prompt, story, genre, word_count, is_public)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        story_id,
-        user_id,
-        story_data.get('title', 'Untitled Story'),
-        story_data['prompt'],
-        story_data['story'],
-        story_data.get('genre'),
-        len(story_data['story'].split()),
-        story_data.get('is_public', False)
-    ))
+    pdf_cache.prerender(story_data.get('title', 'Untitled Story'), story_data['story'])
+    return story_id
+
+def cover_image_url(source_url):
+    """Register a cover's source and return the URL clients should load it from
+    
+    The download starts right away so the image is usually cached by the time
+    the browser asks for it.
+    """
+    if not COVER_PROXY_ENABLED:
+        return source_url
+    key = CoverCache.make_key(source_url)
+    if key not in _registered_covers:
+        conn = db_pool.acquire()
+        try:
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO covers (key, url) VALUES (?, ?)', (key, source_url))
+        finally:
+            db_pool.release(conn)
+        if len(_registered_covers) > 10000:
+            _registered_covers.clear()
+        _registered_covers.add(key)
+    cover_cache.prefetch(key, source_url)
+    return f'/cover/{key}'
+
+def ensure_persisted(story_id):
+    """Wait for a just-saved story that is still in the write-behind queue"""
+    if story_writer is not None:
+        story_writer.wait(story_id, timeout=STORY_WRITE_WAIT)
+
+@timed_db_helper
+def delete_story(user_id, story_id):
+    """Delete one of a user's stories; returns False if it wasn't theirs"""
+    ensure_persisted(story_id)
+    conn = get_db()
+    story = conn.execute('''
+        SELECT rowid, title, prompt, story, story_format, story_dict, genre, word_count
+        FROM stories WHERE id = ? AND user_id = ?
+    ''', (story_id, user_id)).fetchone()
+    if not story:
+        return False
     
+    conn.execute('DELETE FROM favorites WHERE story_id = ?', (story_id,))
+    unindex_story(conn, story)
+    conn.execute('DELETE FROM stories WHERE id = ?', (story_id,))
+    story_memory.forget(conn, story_id)
+    update_user_stats(conn, user_id, story['genre'], story['word_count'], sign=-1)
     conn.commit()
-    return story_id
+    public_feed.invalidate()
+    return True
+
+# Columns returned by list endpoints; the full body is fetched via /story/<id>
+LIST_COLUMNS = 's.id, s.title, s.excerpt, s.genre, s.word_count, s.created_at, s.is_public'
 
-def get_user_stories(user_id):
-    """Get all stories for a user"""
+def encode_cursor(created_at, row_id):
+    """Encode a keyset position as an opaque cursor"""
+    raw = json.dumps([created_at, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, raising ValueError if malformed"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+def _paginate(rows, limit, created_key='created_at', id_key='id'):
+    """Trim the look-ahead row and build the next cursor"""
+    stories = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[created_key], last[id_key])
+    return stories, next_cursor
+
+@timed_db_helper
+def get_user_stories(user_id, limit=20, cursor=None):
+    """Get a page of a user's stories, newest first"""
     conn = get_db()
-    stories = conn.execute('''
-        SELECT * FROM stories WHERE user_id = ? ORDER BY created_at DESC
-    ''', (user_id,)).fetchall()
-    return [dict(story) for story in stories]
+    if cursor:
+        created_at, story_id = decode_cursor(cursor)
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS} FROM stories s
+            WHERE s.user_id = ? AND (s.created_at, s.id) < (?, ?)
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?
+        ''', (user_id, created_at, story_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS} FROM stories s
+            WHERE s.user_id = ?
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?
+        ''', (user_id, limit + 1)).fetchall()
+    return _paginate(rows, limit)
 
-def get_public_stories(limit=20):
-    """Get public stories"""
+@timed_db_helper
+def get_public_stories(limit=20, cursor=None):
+    """Get a page of public stories, newest first"""
     conn = get_db()
-    stories = conn.execute('''
-        SELECT s.*, u.username FROM stories s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.is_public = 1
-        ORDER BY s.created_at DESC
+    if cursor:
+        created_at, story_id = decode_cursor(cursor)
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS}, u.username FROM stories s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.is_public = 1 AND (s.created_at, s.id) < (?, ?)
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?
+        ''', (created_at, story_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS}, u.username FROM stories s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.is_public = 1
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?
+        ''', (limit + 1,)).fetchall()
+    return _paginate(rows, limit)
+
+@timed_db_helper
+def get_favorite_stories(user_id, limit=20, cursor=None):
+    """Get a page of a user's favorites, most recently favorited first"""
+    conn = get_db()
+    if cursor:
+        created_at, favorite_id = decode_cursor(cursor)
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS}, u.username, f.id AS favorite_id, f.created_at AS favorited_at FROM favorites f
+            JOIN stories s ON f.story_id = s.id
+            JOIN users u ON s.user_id = u.id
+            WHERE f.user_id = ? AND (f.created_at, f.id) < (?, ?)
+            ORDER BY f.created_at DESC, f.id DESC
+            LIMIT ?
+        ''', (user_id, created_at, favorite_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT {LIST_COLUMNS}, u.username, f.id AS favorite_id, f.created_at AS favorited_at FROM favorites f
+            JOIN stories s ON f.story_id = s.id
+            JOIN users u ON s.user_id = u.id
+            WHERE f.user_id = ?
+            ORDER BY f.created_at DESC, f.id DESC
+            LIMIT ?
+        ''', (user_id, limit + 1)).fetchall()
+    return _paginate(rows, limit, 'favorited_at', 'favorite_id')
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, a trailing * matches a prefix"""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    if not terms:
+        raise ValueError('Please provide a search query')
+    return ' '.join(terms)
+
+def highlight_snippet(snippet):
+    """HTML-escape a snippet, then turn its \x02/\x03 markers into <mark> tags"""
+    return html.escape(snippet or '').replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+@timed_db_helper
+def search_stories(viewer_id, text, genre=None, owner=None, visibility='all', limit=20, cursor=None):
+    """Get a page of stories matching text, best match first
+    
+    Only public stories and the viewer's own are searched. owner is a
+    username (or 'me'); visibility is 'public', 'private' or 'all'.
+    """
+    match = build_match_query(text)
+    conditions = ['stories_fts MATCH ?', '(s.is_public = 1 OR s.user_id = ?)']
+    params = [match, viewer_id]
+    if genre:
+        conditions.append('s.genre = ?')
+        params.append(genre)
+    if owner == 'me':
+        if viewer_id is None:
+            raise ValueError("Log in to search your own stories")
+        conditions.append('s.user_id = ?')
+        params.append(viewer_id)
+    elif owner:
+        conditions.append('u.username = ?')
+        params.append(owner)
+    if visibility == 'public':
+        conditions.append('s.is_public = 1')
+    elif visibility == 'private':
+        conditions.append('s.is_public = 0')
+    elif visibility != 'all':
+        raise ValueError("visibility must be 'public', 'private' or 'all'")
+    
+    page_filter = ''
+    if cursor:
+        score, story_rowid = decode_cursor(cursor)
+        page_filter = 'WHERE (score, story_rowid) > (?, ?)'
+        params += [score, story_rowid]
+    
+    conn = get_db()
+    rows = conn.execute(f'''
+        SELECT * FROM (
+            SELECT {LIST_COLUMNS}, u.username, s.rowid AS story_rowid, stories_fts.rank AS score
+            FROM stories_fts
+            JOIN stories s ON s.rowid = stories_fts.rowid
+            LEFT JOIN users u ON s.user_id = u.id
+            WHERE {' AND '.join(conditions)}
+        ) {page_filter}
+        ORDER BY score, story_rowid
         LIMIT ?
-    ''', (limit,)).fetchall()
-    return [dict(story) for story in stories]
+    ''', params + [limit + 1]).fetchall()
+    stories, next_cursor = _paginate(rows, limit, 'score', 'story_rowid')
+    
+    # Snippets decode the story body, so only build them for the rows on this page
+    if stories:
+        rowids = [story['story_rowid'] for story in stories]
+        snippets = dict(conn.execute(f'''
+            SELECT rowid, snippet(stories_fts, -1, char(2), char(3), '…', 24) FROM stories_fts
+            WHERE stories_fts MATCH ? AND rowid IN ({', '.join('?' * len(rowids))})
+        ''', [match] + rowids).fetchall())
+        for story in stories:
+            story['snippet'] = highlight_snippet(snippets.get(story.pop('story_rowid')))
+            story['score'] = round(-story['score'], 4)
+    return stories, next_cursor
+
+def get_page_args():
+    """Read limit/cursor query parameters for list endpoints"""
+    limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    return limit, request.args.get('cursor') or None
+
+def sse_response(endpoint, events):
+    """Stream event dicts as coalesced (and, if the client accepts it, gzipped) SSE frames"""
+    compress = SSE_POLICY.accepts_gzip(request.headers.get('Accept-Encoding'))
+    if SSE_POLICY.heartbeat > 0 and not hasattr(events, 'get'):
+        # Plain generators can't wake the writer while the model is silent, so they run on a helper thread
+        events = ThreadedSource(events, wrap=copy_current_request_context)
+    frames = iter_frames(events, SSE_POLICY, compress)
+    response = Response(stream_with_context(timed_stream(endpoint, frames)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def stream_error_message(e, action="generating story"):
+    """User-facing message for an error raised mid-stream"""
+    if str(e) == "RATE_LIMIT":
+        return story_gen.rate_limit_message()
+    return f"Error {action}: {str(e)}"
+
+class PrefixStripper:
+    """Drop prefix from the start of a text stream if the model echoes it back"""
+    
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.buffer = ""
+    
+    def feed(self, chunk):
+        """Return the text that can be emitted for this chunk"""
+        if self.buffer is None:
+            return chunk
+        self.buffer += chunk
+        stripped = self.buffer.lstrip()
+        if len(stripped) < len(self.prefix) and self.prefix.startswith(stripped):
+            return ""
+        if stripped.startswith(self.prefix):
+            stripped = stripped[len(self.prefix):].lstrip()
+        self.buffer = None
+        return stripped
+    
+    def flush(self):
+        """Return anything still held back once the stream ends"""
+        remaining, self.buffer = self.buffer, None
+        return remaining or ""
+
+def strip_echoed_prefix(chunks, prefix):
+    """Apply PrefixStripper to a chunk stream, passing QueueStatus items through"""
+    stripper = PrefixStripper(prefix)
+    for chunk in chunks:
+        if isinstance(chunk, QueueStatus):
+            yield chunk
+        else:
+            yield stripper.feed(chunk)
+    yield stripper.flush()
+
+def get_client_key():
+    """Identify the caller for per-user fair queuing"""
+    return session.get('user_id') or request.remote_addr
 
-# Initialize the story generator and database
-story_gen = StoryGenerator()
-init_db()
+# Gemini generator and the /continue summary memory that calls it; built by create_app(),
+# since the response cache and rate limiter may open SQLite databases
+story_gen = None
+story_memory = None
 
-@app.route('/')
+# Keeps /generate streams running through dropped connections and replays them on reconnect
+stream_buffer = StreamBuffer(
+    db_pool,
+    ttl=float(os.environ.get('STREAM_BUFFER_TTL', 120)),
+    detach_grace=float(os.environ.get('STREAM_DETACH_GRACE', 60)),
+    retention=float(os.environ.get('STREAM_RETENTION', 3600)),
+    purge_interval=float(os.environ.get('STREAM_PURGE_INTERVAL', 300))
+)
+
+def get_last_event_id():
+    """Number of the last event a reconnecting client saw (0 for a fresh read)"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '0'
+    if not value.isdigit():
+        raise ValueError("Invalid Last-Event-ID")
+    return int(value)
+
+# Chunk coalescing, heartbeats and compression for every SSE endpoint
+SSE_POLICY = SSEPolicy.from_env()
+
+# Adds a Server-Timing header (db and total time to headers) to every response
+TIMING_HEADER = os.environ.get('METRICS_TIMING_HEADER', '0') == '1'
+
+# Bearer token for /metrics and the *-stats endpoints; they are not served at all while it is unset
+OPS_TOKEN = os.environ.get('OPS_TOKEN', '')
+
+def ops_only(func):
+    """Serve an operational endpoint only to requests that send OPS_TOKEN"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not OPS_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {OPS_TOKEN}'.encode('utf-8')):
+            return jsonify({'error': 'A valid ops token is required'}), 401
+        return func(*args, **kwargs)
+    return wrapper
+
+def endpoint_label():
+    """Metric label for the current request, without the blueprint prefix"""
+    return (request.endpoint or 'unmatched').rpartition('.')[2]
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@bp.after_app_request
+def record_request_timing(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    HTTP_SECONDS.observe(elapsed, endpoint=endpoint_label(), method=request.method,
+                         status=response.status_code)
+    if TIMING_HEADER:
+        db_ms = g.get('db_time', 0.0) * 1000
+        response.headers['Server-Timing'] = f"db;dur={db_ms:.1f}, app;dur={elapsed * 1000:.1f}"
+    return response
+
+def collect_component_stats():
+    """Export the counters the response cache, scheduler, PDF cache and pool already keep"""
+    cache = story_gen.cache.stats()
+    scheduler = story_gen.scheduler.stats()
+    pdf = pdf_cache.stats()
+    feed = public_feed.stats()
+    covers = cover_cache.stats()
+    jobs = job_queue.stats()
+    families = []
+    if story_writer is not None:
+        families.append(('storygen_story_writes_queued', 'gauge', 'Saved stories waiting for the write-behind commit',
+                         [({}, story_writer.stats()['queued'])]))
+    if story_gen.single_flight is not None:
+        flights = story_gen.single_flight.stats()
+        families += [
+            ('storygen_single_flight_requests_total', 'counter', 'Streams that started an upstream call or joined one',
+             [({'role': 'leader'}, flights['leaders']), ({'role': 'follower'}, flights['followers'])]),
+            ('storygen_single_flight_in_flight', 'gauge', 'Shared upstream streams currently running',
+             [({}, flights['in_flight'])]),
+        ]
+    routing = story_gen.router.stats()
+    families += [
+        ('storygen_gemini_breaker_open', 'gauge', 'Whether each model\'s circuit breaker is skipping it (1) or not (0)',
+         [({'model': model['model']}, int(model['breaker'] == 'open')) for model in routing['models']]),
+        ('storygen_gemini_routing_total', 'counter', 'Hedged requests started and won, and fallbacks to another model',
+         [({'event': event}, routing[event]) for event in ('hedges', 'hedges_won', 'fallbacks')]),
+    ]
+    return families + [
+        ('storygen_response_cache_events_total', 'counter', 'Response cache lookups and evictions',
+         [({'event': event}, cache[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('storygen_rate_limit_scheduler_total', 'counter', 'Client-side scheduler grants, rejections and upstream 429s',
+         [({'event': event}, scheduler[event]) for event in ('granted', 'rejected', 'rate_limited')]),
+        ('storygen_rate_limit_queued', 'gauge', 'Calls currently waiting for a rate limit slot',
+         [({}, scheduler['queued'])]),
+        ('storygen_public_feed_events_total', 'counter', 'Public feed snapshot hits and rebuilds',
+         [({'event': event}, feed[event]) for event in ('hits', 'misses')]),
+        ('storygen_pdf_cache_events_total', 'counter', 'PDF cache lookups and evictions',
+         [({'event': event}, pdf[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('storygen_pdf_cache_bytes', 'gauge', 'Bytes of rendered PDFs on disk',
+         [({}, pdf['size_bytes'])]),
+        ('storygen_cover_cache_events_total', 'counter', 'Cover image cache lookups, evictions and failed fetches',
+         [({'event': event}, covers[event]) for event in ('hits', 'misses', 'evictions', 'errors')]),
+        ('storygen_streams_buffered', 'gauge', 'Generation streams held in memory for reconnects',
+         [({}, stream_buffer.stats()['buffered'])]),
+        ('storygen_jobs', 'gauge', 'Background jobs by status',
+         [({'status': status}, jobs[status]) for status in ('queued', 'running', 'done', 'failed')]),
+        ('storygen_job_queue_age_seconds', 'gauge', 'How long the oldest ready job has been waiting',
+         [({}, jobs['oldest_queued_seconds'])]),
+        ('storygen_db_connections_created_total', 'counter', 'SQLite connections opened by the pool',
+         [({}, db_pool.created)]),
+    ]
+
+REGISTRY.add_collector(collect_component_stats)
+
+@bp.app_template_global()
+def asset_url(path):
+    """URL of a static file: its fingerprinted build if there is one, else the plain file"""
+    built = asset_manifest.lookup(path)
+    if built is None:
+        return url_for('static', filename=path)
+    return url_for('storygen.asset', filename=built)
+
+@bp.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    response = make_response(render_template('index.html'))
+    # Revalidated on every visit so a new build's asset names are picked up
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted static file, precompressed when the client accepts it"""
+    selected = asset_manifest.select(filename, lambda encoding: request.accept_encodings[encoding] > 0)
+    if selected is None:
+        return jsonify({'error': 'Asset not found'}), 404
+    path, encoding = selected
+    
+    # The name changes whenever the content does, so browsers never need to revalidate
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
 
-@app.route('/model-info')
+@bp.route('/model-info')
 def model_info():
     """Get model information"""
     return jsonify(story_gen.get_model_info())
 
-@app.route('/generate', methods=['POST'])
+def json_body(data):
+    """Check that a request body is a JSON object; raises ValueError if not"""
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
+def text_field(data, name, default=''):
+    """A string field of a JSON body (null means default); raises ValueError for other types"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f"'{name}' must be a string")
+    return value
+
+def number_field(data, name, default, cast=float):
+    """A numeric field of a JSON body (null means default); raises ValueError for anything else"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' must be a number")
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number")
+
+def parse_generate_request(data):
+    """Validate a /generate body and build everything the stream needs
+    
+    Shared by the Flask route and the ASGI server. Raises ValueError for bad input.
+    """
+    data = json_body(data)
+    prompt = text_field(data, 'prompt')
+    
+    char_name = text_field(data, 'character_name').strip()
+    char_traits = text_field(data, 'character_traits').strip()
+    
+    if char_name or char_traits:
+        char_info = f"The main character is {char_name if char_name else 'someone'}."
+        if char_traits:
+            char_info += f" They are {char_traits}."
+        prompt = f"{char_info} {prompt}"
+    
+    if not prompt:
+        raise ValueError('Please provide a story prompt')
+    
+    # Get generation parameters
+    max_length = min(number_field(data, 'max_length', 300, int), 1000)
+    genre = text_field(data, 'genre', None)
+    
+    final_prompt = prompt
+    if genre and genre in story_gen.genres:
+        final_prompt = f"{story_gen.genres[genre]} {final_prompt}"
+    final_prompt = story_gen.clean_prompt(final_prompt)
+    
+    # Pollinations.ai image URL; callers that show the cover pass it to cover_image_url()
+    encoded_prompt = urllib.parse.quote(prompt[:200])
+    
+    return {
+        'prompt': prompt,
+        'instruct_prompt': f"Write a creative story starting exactly with the following prompt. You MUST use Markdown formatting (like **bold**, *italics*, and headers) to make the story visually engaging. Do not include any meta-commentary, titles, or intro, just write the story. Make the story roughly {max_length} words.\n\nPrompt: {final_prompt}",
+        'max_length': max_length,
+        'temperature': number_field(data, 'temperature', 0.8),
+        'top_p': number_field(data, 'top_p', 0.9),
+        'genre': genre,
+        # Generation is meant to be creative, so identical prompts get fresh stories unless the client opts in
+        'use_cache': bool(data.get('use_cache', False)),
+        'title': text_field(data, 'title', 'Generated Story'),
+        'is_public': bool(data.get('is_public', False)),
+        'durable': bool(data.get('durable', False)),
+        'cover_source': f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=1024&height=512&nologo=true"
+    }
+
+@bp.route('/generate', methods=['POST'])
 def generate():
     """Generate story endpoint"""
     try:
-        data = request.get_json()
-        prompt = data.get('prompt', '')
-        
-        char_name = data.get('character_name', '').strip()
-        char_traits = data.get('character_traits', '').strip()
-        
-        if char_name or char_traits:
-            char_info = f"The main character is {char_name if char_name else 'someone'}."
-            if char_traits:
-                char_info += f" They are {char_traits}."
-            prompt = f"{char_info} {prompt}"
-            
-        
-        if not prompt:
-            return jsonify({'error': 'Please provide a story prompt'}), 400
+        try:
+            params = parse_generate_request(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Get generation parameters
-        max_length = min(int(data.get('max_length', 300)), 1000)
-        temperature = float(data.get('temperature', 0.8))
-        top_p = float(data.get('top_p', 0.9))
-        genre = data.get('genre')
-                # Extract variables before starting stream generator
+        # Extract variables before starting stream generator
         user_id = session.get('user_id')
-        story_title = data.get('title', 'Generated Story')
-        is_public = data.get('is_public', False)
-        
-        # Pollinations.ai image URL
-        import urllib.parse
-        encoded_prompt = urllib.parse.quote(prompt[:200])
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=1024&height=512&nologo=true"
+        client_key = get_client_key()
+        image_url = cover_image_url(params['cover_source'])
+        buffered = stream_buffer.create(user_id)
         
         def generate_stream():
             try:
                 # Send initial setup with cover image
-                yield f"data: {json.dumps({'type': 'init', 'image': image_url})}\n\n"
+                yield {'type': 'init', 'image': image_url, 'stream_id': buffered.id}
                 
-                final_prompt = prompt
-                if genre and genre in story_gen.genres:
-                    final_prompt = f"{story_gen.genres[genre]} {final_prompt}"
-                
-                final_prompt = story_gen.clean_prompt(final_prompt)
-                instruct_prompt = f"Write a creative story starting exactly with the following prompt. You MUST use Markdown formatting (like **bold**, *italics*, and headers) to make the story visually engaging. Do not include any meta-commentary, titles, or intro, just write the story. Make the story roughly {max_length} words.\n\nPrompt: {final_prompt}"
-                
-                full_story = ""
-                for chunk in story_gen._call_gemini_stream(instruct_prompt, temperature, top_p):
-                    if chunk:
-                        full_story += chunk
-                        yield f"data: {json.dumps({'type': 'chunk', 'text': chunk})}\n\n"
+                parts = []
+                stream = story_gen._call_gemini_stream(
+                    params['instruct_prompt'], params['temperature'], params['top_p'],
+                    use_cache=params['use_cache'], user_key=client_key,
+                    expected_tokens=int(params['max_length'] * 1.5), report_queue=True,
+                    endpoint='generate', cancelled=buffered.cancelled
+                )
+                for chunk in stream:
+                    if isinstance(chunk, QueueStatus):
+                        yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+                    elif chunk:
+                        parts.append(chunk)
+                        yield {'type': 'chunk', 'text': chunk}
+                full_story = ''.join(parts)
                 
                 # Save story if user is logged in
                 story_id = None
                 if user_id:
                     story_data = {
-                        'title': story_title,
-                        'prompt': prompt,
+                        'title': params['title'],
+                        'prompt': params['prompt'],
                         'story': full_story,
-                        'genre': genre,
-                        'is_public': is_public
+                        'genre': params['genre'],
+                        'is_public': params['is_public']
                     }
-                    story_id = save_story(user_id, story_data)
+                    story_id = save_story(user_id, story_data, durable=params['durable'])
                 
                 word_count = len(full_story.split())
-                yield f"data: {json.dumps({'type': 'done', 'story_id': story_id, 'word_count': word_count})}\n\n"
+                yield {'type': 'done', 'story_id': story_id, 'word_count': word_count}
                 
             except Exception as e:
-                if str(e) == "RATE_LIMIT":
-                    err = "⏳ You are generating stories too fast! Google's Free Tier limits you to 15 requests per minute. Please wait about 60 seconds and try again."
-                else:
-                    err = f"Error generating story: {str(e)}"
-                yield f"data: {json.dumps({'type': 'error', 'error': err})}\n\n"
+                yield {'type': 'error', 'error': stream_error_message(e)}
 
-        return Response(generate_stream(), mimetype='text/event-stream')
+        # The upstream call runs on its own thread so a dropped connection doesn't stop it
+        reader = buffered.replay()
+        stream_buffer.run(buffered, generate_stream(), current_app.app_context())
+        response = sse_response('generate', reader)
+        response.headers['X-Stream-Id'] = buffered.id
+        return response
         
     except Exception as e:
         logger.error(f"Error in generate endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/enhance', methods=['POST'])
+@bp.route('/generate/<stream_id>')
+def resume_generate(stream_id):
+    """Replay a /generate stream after Last-Event-ID, then follow it until it ends"""
+    try:
+        stream = stream_buffer.get(stream_id, session.get('user_id'))
+        last_event_id = get_last_event_id()
+    except StreamNotFound:
+        return jsonify({'error': 'Stream not found or expired'}), 404
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = sse_response('generate', stream.replay(last_event_id))
+    response.headers['X-Stream-Id'] = stream.id
+    return response
+
+def generate_batch_item(spec, user_id):
+    """Generate one /generate-batch item and return its story_data"""
+    params = parse_generate_request(spec)
+    story = story_gen._call_gemini(
+        params['instruct_prompt'], params['temperature'], params['top_p'],
+        use_cache=params['use_cache'], user_key=user_id,
+        expected_tokens=int(params['max_length'] * 1.5), endpoint='batch'
+    )
+    return {
+        'title': params['title'],
+        'prompt': params['prompt'],
+        'story': story,
+        'genre': params['genre'],
+        'is_public': params['is_public']
+    }
+
+def invalidate_feed_for_stories(stories):
+    if any(story_data.get('is_public') for story_data in stories):
+        public_feed.invalidate()
+
+batch_runner = BatchRunner(
+    db_pool, generate_batch_item,
+    max_concurrency=int(os.environ.get('BATCH_MAX_CONCURRENCY', 4)),
+    max_items=int(os.environ.get('BATCH_MAX_ITEMS', 500)),
+    on_insert=invalidate_feed_for_stories
+)
+
+def start_batch(batch_id, user_id, specs, concurrency):
+    """Create or resume a batch and return its result iterator, already past the header line
+
+    Raises ValueError for bad input, PermissionError for someone else's batch
+    and RuntimeError if the batch is already running.
+    """
+    if not (batch_id and batch_runner.exists(batch_id, user_id)):
+        batch_id = batch_runner.create(user_id, specs, batch_id)
+    results = batch_runner.run(batch_id, user_id, concurrency)
+    header = next(results)
+    return header, results
+
+@bp.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """Generate many stories, streaming one NDJSON line per item in completion order"""
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Please log in to generate a batch'}), 401
+        
+        try:
+            data = json_body(request.get_json())
+            header, results = start_batch(data.get('batch_id'), user_id, data.get('items'), data.get('concurrency'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        
+        def generate_lines():
+            yield json.dumps(header) + '\n'
+            try:
+                for result in results:
+                    yield json.dumps(result) + '\n'
+            finally:
+                results.close()
+        
+        response = Response(generate_lines(), mimetype='application/x-ndjson')
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.headers['X-Batch-Id'] = header['batch_id']
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error in generate-batch endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def parse_enhance_request(data):
+    """Validate an /enhance body; raises ValueError for bad input
+    
+    Shared by the Flask route, the ASGI server and background jobs.
+    """
+    data = json_body(data)
+    story = text_field(data, 'story')
+    if not story:
+        raise ValueError('Please provide a story to enhance')
+    return {
+        'story': story,
+        'enhancement_type': text_field(data, 'type', 'detail'),
+        'use_cache': bool(data.get('use_cache', False))
+    }
+
+def parse_endings_request(data):
+    """Validate a /multiple-endings body; raises ValueError for bad input"""
+    data = json_body(data)
+    story = text_field(data, 'story')
+    if not story:
+        raise ValueError('Please provide a story beginning')
+    return {
+        'story': story,
+        'num_endings': max(1, min(number_field(data, 'num_endings', 3, int), 5)),
+        'use_cache': bool(data.get('use_cache', False))
+    }
+
+def parse_continue_request(data):
+    """Validate a /continue body; raises ValueError for bad input
+    
+    Shared by the Flask route, the ASGI server and background jobs.
+    """
+    data = json_body(data)
+    story = text_field(data, 'story')
+    if not story:
+        raise ValueError('Please provide a story to continue')
+    return {
+        'story': story,
+        'story_id': text_field(data, 'story_id', None),
+        'temperature': number_field(data, 'temperature', 0.8),
+        'use_cache': bool(data.get('use_cache', False)),
+        'max_length': min(number_field(data, 'max_length', 150, int), 1000)
+    }
+
+def ending_error_message(error):
+    if error == "RATE_LIMIT":
+        return "⏳ Rate limit reached while generating this ending. Please wait about 60 seconds and try again."
+    if error == "TIMEOUT":
+        return "This ending took too long to generate."
+    return f"Error generating ending: {error}"
+
+# Non-streaming bodies of /enhance, /multiple-endings and /continue, also run by background job workers.
+# Each raises Exception("RATE_LIMIT") when the rate limit is why it failed, so the job is retried later.
+
+def run_enhance_job(params, client_key):
+    enhanced_story = story_gen.enhance_story(params['story'], params['enhancement_type'],
+                                             use_cache=params['use_cache'], user_key=client_key)
+    return {
+        'enhanced_story': enhanced_story,
+        'enhancement_type': params['enhancement_type'],
+        'word_count': len(enhanced_story.split())
+    }
+
+def run_endings_job(params, client_key):
+    results = sorted(story_gen.iter_multiple_endings(params['story'], params['num_endings'],
+                                                     use_cache=params['use_cache'], user_key=client_key),
+                     key=lambda r: r['index'])
+    endings = [r['ending'] for r in results if 'ending' in r]
+    errors = [r['error'] for r in results if 'error' in r]
+    if not endings:
+        # Retry only when nothing came back; partial results are worth keeping
+        if 'RATE_LIMIT' in errors:
+            raise Exception("RATE_LIMIT")
+        raise RuntimeError(ending_error_message(errors[0]) if errors else 'No endings were generated')
+    return {
+        'endings': endings,
+        'num_endings': len(endings),
+        'failed': len(errors),
+        'errors': [ending_error_message(error) for error in errors]
+    }
+
+def run_continue_job(params, client_key):
+    memory_key = StoryMemory.memory_key(params['story_id'], params['story'])
+    summary, recent = story_memory.build_context(memory_key, params['story'], client_key)
+    continuation = story_gen.write_continuation(summary, recent, max_length=params['max_length'],
+                                                temperature=params['temperature'],
+                                                use_cache=params['use_cache'], user_key=client_key)
+    return {'continuation': continuation}
+
+@bp.route('/enhance', methods=['POST'])
 def enhance():
     """Enhance an existing story"""
     try:
         data = request.get_json()
-        story = data.get('story', '')
-        enhancement_type = data.get('type', 'detail')
-        
-        if not story:
-            return jsonify({'error': 'Please provide a story to enhance'}), 400
+        try:
+            params = parse_enhance_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        story = params['story']
+        enhancement_type = params['enhancement_type']
+        use_cache = params['use_cache']
         
-        enhanced_story = story_gen.enhance_story(story, enhancement_type)
+        if data.get('stream'):
+            client_key = get_client_key()
+            
+            def enhance_stream():
+                try:
+                    yield {'type': 'init', 'enhancement_type': enhancement_type}
+                    
+                    parts = []
+                    for chunk in story_gen.enhance_story_stream(story, enhancement_type, use_cache=use_cache, user_key=client_key):
+                        if isinstance(chunk, QueueStatus):
+                            yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+                        elif chunk:
+                            parts.append(chunk)
+                            yield {'type': 'chunk', 'text': chunk}
+                    
+                    yield {'type': 'done', 'word_count': len(''.join(parts).split())}
+                    
+                except Exception as e:
+                    yield {'type': 'error', 'error': stream_error_message(e, "enhancing story")}
+            
+            return sse_response('enhance', enhance_stream())
         
-        return jsonify({
-            'enhanced_story': enhanced_story,
-            'enhancement_type': enhancement_type,
-            'word_count': len(enhanced_story.split())
-        })
+        return jsonify(run_enhance_job(params, get_client_key()))
         
     except Exception as e:
         logger.error(f"Error in enhance endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/multiple-endings', methods=['POST'])
+@bp.route('/multiple-endings', methods=['POST'])
 def multiple_endings():
     """Generate multiple endings for a story"""
     try:
-        data = request.get_json()
-        story_beginning = data.get('story', '')
-        num_endings = min(int(data.get('num_endings', 3)), 5)
+        try:
+            params = parse_endings_request(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        story_beginning = params['story']
+        num_endings = params['num_endings']
+        use_cache = params['use_cache']
         
-        if not story_beginning:
-            return jsonify({'error': 'Please provide a story beginning'}), 400
+        client_key = get_client_key()
         
-        endings = story_gen.generate_multiple_endings(story_beginning, num_endings)
+        if not request.get_json().get('stream'):
+            endings = story_gen.generate_multiple_endings(story_beginning, num_endings, use_cache=use_cache, user_key=client_key)
+            return jsonify({
+                'endings': endings,
+                'num_endings': len(endings)
+            })
         
-        return jsonify({
-            'endings': endings,
-            'num_endings': len(endings)
-        })
+        def endings_stream():
+            yield {'type': 'init', 'num_endings': num_endings}
+            
+            completed = 0
+            for result in story_gen.iter_multiple_endings(story_beginning, num_endings, use_cache=use_cache, user_key=client_key):
+                if 'ending' in result:
+                    completed += 1
+                    yield {'type': 'ending', 'index': result['index'], 'text': result['ending']}
+                else:
+                    yield {'type': 'ending_error', 'index': result['index'], 'error': ending_error_message(result['error'])}
+            
+            yield {'type': 'done', 'num_endings': completed, 'failed': num_endings - completed}
+        
+        return sse_response('multiple-endings', endings_stream())
         
     except Exception as e:
         logger.error(f"Error in multiple-endings endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/random-prompt')
+@bp.route('/random-prompt')
 def random_prompt():
     """Generate a random story prompt"""
     prompts = [
@@ -436,12 +1490,16 @@ def random_prompt():
     import random
     return jsonify({'prompt': random.choice(prompts)})
 
-@app.route('/export-pdf/<story_id>')
+@bp.route('/export-pdf/<story_id>')
 def export_pdf(story_id):
     """Export a story as PDF"""
     try:
+        ensure_persisted(story_id)
         conn = get_db()
-        story = conn.execute('SELECT * FROM stories WHERE id = ?', (story_id,)).fetchone()
+        story = conn.execute(
+            'SELECT title, story, story_format, story_dict, user_id, is_public FROM stories WHERE id = ?',
+            (story_id,)
+        ).fetchone()
         
         if not story:
             return jsonify({'error': 'Story not found'}), 404
@@ -449,79 +1507,196 @@ def export_pdf(story_id):
         if not story['is_public'] and story['user_id'] != session.get('user_id'):
             return jsonify({'error': 'Unauthorized to access this story'}), 403
         
-        # Create PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story_elements = []
-        
-        # Title
-        safe_title = escape(story['title'])
-        title = Paragraph(f"<b>{safe_title}</b>", styles['Title'])
-        story_elements.append(title)
-        story_elements.append(Spacer(1, 12))
-        
-        # Story content
-        story_text = story['story']
-        paragraphs = story_text.split('\n\n')
-        
-        for para in paragraphs:
-            if para.strip():
-                safe_para = escape(para)
-                p = Paragraph(safe_para, styles['Normal'])
-                story_elements.append(p)
-                story_elements.append(Spacer(1, 6))
-        
-        doc.build(story_elements)
-        buffer.seek(0)
-        
-        return send_file(
-            io.BytesIO(buffer.read()),
+        key, path = pdf_cache.get_or_render(story['title'], read_story_body(conn, story))
+        
+        response = send_file(
+            path,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"{story['title']}.pdf"
+            download_name=f"{story['title']}.pdf",
+            etag=key,
+            conditional=True,
+            max_age=0
         )
+        # Private stories must not end up in shared caches
+        response.cache_control.public = bool(story['is_public'])
+        response.cache_control.private = not story['is_public']
+        response.cache_control.no_cache = True
+        return response
         
     except Exception as e:
         logger.error(f"Error exporting PDF: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/my-stories')
+@bp.route('/cover/<key>')
+def cover(key):
+    """Serve a cached cover image, fetching it from its source on first use"""
+    try:
+        if not re.fullmatch(r'[0-9a-f]{40}', key):
+            return jsonify({'error': 'Cover not found'}), 404
+        
+        def load_source():
+            row = get_db().execute('SELECT url FROM covers WHERE key = ?', (key,)).fetchone()
+            return row['url'] if row else None
+        
+        cached = cover_cache.get_or_fetch(key, load_source, timeout=COVER_WAIT)
+        if cached is None:
+            return jsonify({'error': 'Cover not found'}), 404
+        path, content_type = cached
+        
+        # The key names one source URL and the cached bytes never change, so browsers can keep them
+        response = send_file(path, mimetype=content_type, etag=key, conditional=True, max_age=COVER_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error serving cover image: {str(e)}")
+        return jsonify({'error': 'Cover image is unavailable right now'}), 502
+
+@bp.route('/my-stories')
 def my_stories():
     """Get user's stories"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please log in'}), 401
     
-    stories = get_user_stories(session['user_id'])
-    return jsonify({'stories': stories})
+    try:
+        limit, cursor = get_page_args()
+        stories, next_cursor = get_user_stories(session['user_id'], limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'stories': stories, 'next_cursor': next_cursor})
 
-@app.route('/public-stories')
+@bp.route('/public-stories')
 def public_stories():
     """Get public stories"""
-    stories = get_public_stories()
-    return jsonify({'stories': stories})
+    try:
+        limit, cursor = get_page_args()
+        
+        def build_page():
+            stories, next_cursor = get_public_stories(limit, cursor)
+            return current_app.json.dumps({'stories': stories, 'next_cursor': next_cursor}).encode('utf-8')
+        
+        body, etag = public_feed.get((limit, cursor), lambda: get_feed_version(get_db()), build_page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Clients and proxies may keep a copy but must revalidate; unchanged pages cost a 304
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/search')
+def search():
+    """Full-text search over public stories and the current user's own"""
+    try:
+        limit, cursor = get_page_args()
+        stories, next_cursor = search_stories(
+            session.get('user_id'), request.args.get('q', ''),
+            genre=request.args.get('genre') or None,
+            owner=request.args.get('owner') or None,
+            visibility=request.args.get('visibility', 'all'),
+            limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.OperationalError as e:
+        logger.error(f"Error searching stories: {str(e)}")
+        return jsonify({'error': 'Invalid search query'}), 400
+    response = jsonify({'stories': stories, 'next_cursor': next_cursor})
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/story/<story_id>', methods=['DELETE'])
+def remove_story(story_id):
+    """Delete one of the current user's stories"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please log in'}), 401
+    
+    try:
+        if not delete_story(session['user_id'], story_id):
+            return jsonify({'error': 'Story not found'}), 404
+        return jsonify({'deleted': story_id})
+        
+    except Exception as e:
+        logger.error(f"Error deleting story: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/story/<story_id>')
+def get_story(story_id):
+    """Get a single story including its full text"""
+    ensure_persisted(story_id)
+    conn = get_db()
+    story = conn.execute('''
+        SELECT s.*, u.username FROM stories s
+        LEFT JOIN users u ON s.user_id = u.id
+        WHERE s.id = ?
+    ''', (story_id,)).fetchone()
+    
+    if not story:
+        return jsonify({'error': 'Story not found'}), 404
+        
+    if not story['is_public'] and story['user_id'] != session.get('user_id'):
+        return jsonify({'error': 'Unauthorized to access this story'}), 403
+    
+    result = dict(story)
+    result['story'] = read_story_body(conn, story)
+    del result['story_format'], result['story_dict']
+    return jsonify({'story': result})
 
-@app.route('/continue', methods=['POST'])
+@bp.route('/continue', methods=['POST'])
 def continue_story():
     """Continue story endpoint"""
     try:
         data = request.get_json()
-        story_text = data.get('story', '')
+        try:
+            params = parse_continue_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        story_text = params['story']
+        temperature = params['temperature']
+        use_cache = params['use_cache']
+        max_length = params['max_length']
+        client_key = get_client_key()
+        memory_key = StoryMemory.memory_key(params['story_id'], story_text)
         
-        if not story_text:
-            return jsonify({'error': 'Please provide a story to continue'}), 400
+        if data.get('stream'):
+            def continue_stream():
+                try:
+                    yield {'type': 'init'}
+                    
+                    summary, recent = story_memory.build_context(memory_key, story_text, client_key)
+                    chunks = story_gen._call_gemini_stream(
+                        story_gen.build_continue_prompt(summary, recent, max_length), temperature, 0.9,
+                        use_cache=use_cache, user_key=client_key, expected_tokens=int(max_length * 1.5),
+                        report_queue=True, endpoint='continue'
+                    )
+                    parts = []
+                    for chunk in strip_echoed_prefix(chunks, recent.strip()):
+                        if isinstance(chunk, QueueStatus):
+                            yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+                        elif chunk:
+                            parts.append(chunk)
+                            yield {'type': 'chunk', 'text': chunk}
+                    
+                    yield {'type': 'done', 'word_count': len(''.join(parts).split())}
+                    
+                except Exception as e:
+                    yield {'type': 'error', 'error': stream_error_message(e, "continuing story")}
             
-        temperature = float(data.get('temperature', 0.8))
-        prompt = story_text[-500:] if len(story_text) > 500 else story_text
+            return sse_response('continue', continue_stream())
         
-        continuation = story_gen.generate_story(
-            prompt=prompt,
-            max_length=min(len(prompt.split()) + 150, 1000),
-            temperature=temperature
+        summary, recent = story_memory.build_context(memory_key, story_text, client_key)
+        continuation = story_gen.continue_story(
+            summary, recent,
+            max_length=max_length,
+            temperature=temperature,
+            use_cache=use_cache,
+            user_key=client_key
         )
-        
-        if continuation.startswith(prompt):
-            continuation = continuation[len(prompt):].strip()
             
         return jsonify({'continuation': continuation})
         
@@ -529,13 +1704,136 @@ def continue_story():
         logger.error(f"Error in continue endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/favorite/<story_id>', methods=['POST'])
+# Job type -> (request parser, handler) for POST /jobs and `flask --app app worker`
+JOB_TYPES = {
+    'enhance': (parse_enhance_request, run_enhance_job),
+    'multiple-endings': (parse_endings_request, run_endings_job),
+    'continue': (parse_continue_request, run_continue_job),
+}
+
+# Highest priority a submitter may ask for; lower numbers down to -JOB_MAX_PRIORITY run later
+JOB_MAX_PRIORITY = 10
+
+job_queue = JobQueue(
+    db_pool,
+    visibility_timeout=float(os.environ.get('JOB_VISIBILITY_TIMEOUT', 300)),
+    result_ttl=float(os.environ.get('JOB_RESULT_TTL', 3600)),
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 5)),
+    backoff=float(os.environ.get('JOB_BACKOFF_SECONDS', 5)),
+    max_backoff=float(os.environ.get('JOB_BACKOFF_MAX_SECONDS', 300)),
+    max_pending=int(os.environ.get('JOB_MAX_PENDING', 20))
+)
+
+def describe_job(job):
+    """Public view of a job row"""
+    info = {
+        'job_id': job['id'],
+        'type': job['kind'],
+        'status': job['status'],
+        'priority': job['priority'],
+        'attempts': job['attempts'],
+        'created_at': datetime.fromtimestamp(job['created_at']).isoformat(timespec='seconds')
+    }
+    if job['status'] == 'queued' and job['error'] == 'RATE_LIMIT':
+        info['retry_in'] = round(max(0.0, job['run_at'] - time.time()), 1)
+    if job['status'] == 'failed':
+        error = job['error']
+        if error == 'RATE_LIMIT':
+            error = f"⏳ Still rate limited after {job['attempts']} attempts. Please try again in a few minutes."
+        info['error'] = error
+    if job['finished_at']:
+        info['finished_at'] = datetime.fromtimestamp(job['finished_at']).isoformat(timespec='seconds')
+    if job['status'] == 'done':
+        info['result_url'] = url_for('storygen.job_result', job_id=job['id'])
+    return info
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an /enhance, /multiple-endings or /continue request for a background worker"""
+    try:
+        try:
+            data = json_body(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        kind = data.get('type')
+        if kind not in JOB_TYPES:
+            return jsonify({'error': f"Job type must be one of: {', '.join(sorted(JOB_TYPES))}"}), 400
+        parse, _ = JOB_TYPES[kind]
+        try:
+            params = parse(data.get('params') or {})
+            priority = max(-JOB_MAX_PRIORITY, min(number_field(data, 'priority', 0, int), JOB_MAX_PRIORITY))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            job_id = job_queue.submit(kind, params, session.get('user_id'), str(get_client_key()), priority)
+        except OverflowError as e:
+            return jsonify({'error': str(e)}), 429
+        
+        response = jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('storygen.job_status', job_id=job_id),
+            'result_url': url_for('storygen.job_result', job_id=job_id)
+        })
+        response.headers['Location'] = url_for('storygen.job_status', job_id=job_id)
+        return response, 202
+        
+    except Exception as e:
+        logger.error(f"Error in submit job endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def load_job(job_id):
+    """Return (job, None) or (None, error response)"""
+    try:
+        return job_queue.get(job_id, session.get('user_id')), None
+    except JobNotFound:
+        return None, (jsonify({'error': 'Job not found or its result has expired'}), 404)
+    except PermissionError as e:
+        return None, (jsonify({'error': str(e)}), 403)
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Get a background job's status"""
+    try:
+        job, error = load_job(job_id)
+        if error:
+            return error
+        return jsonify(describe_job(job))
+        
+    except Exception as e:
+        logger.error(f"Error in job status endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Get a finished job's result: 200 when done, 202 while it is queued or running"""
+    try:
+        job, error = load_job(job_id)
+        if error:
+            return error
+        if job['status'] == 'done':
+            return jsonify(job['result'])
+        
+        response = jsonify(describe_job(job))
+        if job['status'] == 'failed':
+            return response, 500
+        wait = job['run_at'] - time.time() if job['status'] == 'queued' else 0
+        response.headers['Retry-After'] = str(max(1, int(wait + 0.999)))
+        return response, 202
+        
+    except Exception as e:
+        logger.error(f"Error in job result endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/favorite/<story_id>', methods=['POST'])
 def toggle_favorite(story_id):
     """Toggle a story as favorite"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please log in'}), 401
         
     try:
+        ensure_persisted(story_id)
         conn = get_db()
         existing = conn.execute(
             'SELECT id FROM favorites WHERE user_id = ? AND story_id = ?',
@@ -559,29 +1857,24 @@ def toggle_favorite(story_id):
         logger.error(f"Error toggling favorite: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/favorites')
+@bp.route('/favorites')
 def get_favorites():
     """Get user's favorite stories"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please log in'}), 401
         
     try:
-        conn = get_db()
-        stories = conn.execute('''
-            SELECT s.*, u.username FROM favorites f
-            JOIN stories s ON f.story_id = s.id
-            JOIN users u ON s.user_id = u.id
-            WHERE f.user_id = ?
-            ORDER BY f.created_at DESC
-        ''', (session['user_id'],)).fetchall()
-        
-        return jsonify({'stories': [dict(story) for story in stories]})
+        limit, cursor = get_page_args()
+        stories, next_cursor = get_favorite_stories(session['user_id'], limit, cursor)
+        return jsonify({'stories': stories, 'next_cursor': next_cursor})
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting favorites: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     """User registration"""
     try:
@@ -623,7 +1916,7 @@ def register():
         logger.error(f"Error in register endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     """User login"""
     try:
@@ -651,54 +1944,347 @@ def login():
         logger.error(f"Error in login endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 def logout():
     """User logout"""
     session.clear()
     return jsonify({'message': 'Logged out successfully'})
 
-@app.route('/story-stats')
+@bp.route('/story-stats')
 def story_stats():
     """Get story statistics"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please log in'}), 401
     
     conn = get_db()
-    stats = conn.execute('''
-        SELECT 
-            COUNT(*) as total_stories,
-            SUM(word_count) as total_words,
-            AVG(word_count) as avg_words,
-            genre,
-            COUNT(*) as genre_count
-        FROM stories 
-        WHERE user_id = ?
-        GROUP BY genre
-    ''', (session['user_id'],)).fetchall()
-    
-    total_stats = conn.execute('''
-        SELECT 
-            COUNT(*) as total_stories,
-            SUM(word_count) as total_words,
-            AVG(word_count) as avg_words
-        FROM stories 
-        WHERE user_id = ?
-    ''', (session['user_id'],)).fetchone()
+    total = conn.execute(
+        'SELECT total_stories, total_words FROM user_stats WHERE user_id = ?',
+        (session['user_id'],)
+    ).fetchone()
+    genres = conn.execute(
+        'SELECT genre, story_count, total_words FROM user_genre_stats WHERE user_id = ? AND story_count > 0',
+        (session['user_id'],)
+    ).fetchall()
+    
+    total_stories = total['total_stories'] if total else 0
+    total_words = total['total_words'] if total else 0
     
     return jsonify({
-        'total_stats': dict(total_stats) if total_stats else {},
-        'genre_stats': [dict(stat) for stat in stats]
+        'total_stats': {
+            'total_stories': total_stories,
+            'total_words': total_words,
+            'avg_words': total_words / total_stories if total_stories else None
+        },
+        'genre_stats': [{
+            'genre': row['genre'] or None,
+            'genre_count': row['story_count'],
+            'total_words': row['total_words'],
+            'avg_words': row['total_words'] / row['story_count']
+        } for row in genres]
     })
 
-@app.route('/health')
+@bp.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute per-user statistics from the stories table"""
+    conn = db_pool.acquire()
+    try:
+        with conn:
+            rebuild_user_stats(conn)
+        count = conn.execute('SELECT COUNT(*) FROM user_stats').fetchone()[0]
+        click.echo(f"Rebuilt statistics for {count} users")
+    finally:
+        db_pool.release(conn)
+
+@bp.cli.command('generate-batch')
+@click.argument('specs_file', type=click.File('r'), required=False)
+@click.option('--user', 'username', required=True, help='Owner of the generated stories')
+@click.option('--batch-id', default=None, help='Resume this batch, or give the new batch this id')
+@click.option('--concurrency', type=int, default=None, help='Items generated at once (capped by BATCH_MAX_CONCURRENCY)')
+def generate_batch_command(specs_file, username, batch_id, concurrency):
+    """Generate stories from a JSON list or NDJSON file of /generate bodies, printing NDJSON results"""
+    specs = None
+    if specs_file is not None:
+        text = specs_file.read()
+        try:
+            specs = json.loads(text)
+        except ValueError:
+            specs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    
+    conn = db_pool.acquire()
+    try:
+        user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    finally:
+        db_pool.release(conn)
+    if user is None:
+        raise click.ClickException(f"Unknown user {username}")
+    
+    try:
+        header, results = start_batch(batch_id, user['id'], specs, concurrency)
+    except (ValueError, PermissionError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(header))
+    for result in results:
+        click.echo(json.dumps(result))
+
+@bp.cli.command('worker')
+@click.option('--threads', type=int, default=4, show_default=True, help='Jobs this process runs at once')
+@click.option('--type', 'kinds', multiple=True, type=click.Choice(sorted(JOB_TYPES)),
+              help='Only run jobs of this type (repeatable; default all)')
+@click.option('--poll-interval', type=float, default=0.5, show_default=True,
+              help='Seconds an idle thread waits before checking the queue again')
+def worker_command(threads, kinds, poll_interval):
+    """Run queued background jobs until stopped with SIGINT or SIGTERM; start as many processes as needed"""
+    handlers = {kind: run for kind, (_, run) in JOB_TYPES.items() if not kinds or kind in kinds}
+    worker = JobWorker(job_queue, handlers, threads=threads, poll_interval=poll_interval)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    
+    click.echo(f"Worker {worker.worker_id} running {', '.join(sorted(handlers))} jobs on {threads} thread(s)")
+    worker.run(stop)
+    click.echo(f"Stopped: {worker.completed} completed, {worker.failed} failed, {worker.retried} retried")
+
+@bp.cli.command('build-assets')
+@click.option('--prune', is_flag=True, help='Delete files of earlier builds')
+def build_assets_command(prune):
+    """Fingerprint and precompress the files in static/ for /assets/"""
+    start = time.perf_counter()
+    build_assets(STATIC_DIR, asset_manifest.directory, prune=prune)
+    stats = asset_manifest.stats()
+    sizes = ', '.join(f"{encoding} {size / 1024:.1f} KB" for encoding, size in stats['compressed_bytes'].items())
+    click.echo(f"Built {stats['assets']} assets in {time.perf_counter() - start:.1f}s: "
+               f"{stats['bytes'] / 1024:.1f} KB ({sizes})")
+
+@bp.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Re-index every story for /search"""
+    conn = db_pool.acquire()
+    try:
+        start = time.perf_counter()
+        with conn:
+            rebuild_search_index(conn)
+        count = conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+        click.echo(f"Indexed {count} stories in {time.perf_counter() - start:.1f}s")
+    finally:
+        db_pool.release(conn)
+
+def measure_story_storage(conn, sample_ids):
+    """Database size, stored body bytes and read+decode latency over sample_ids"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    body_bytes = conn.execute('SELECT COALESCE(SUM(length(CAST(story AS BLOB))), 0) FROM stories').fetchone()[0]
+    timings = []
+    for story_id in sample_ids:
+        start = time.perf_counter()
+        row = conn.execute('SELECT story, story_format, story_dict FROM stories WHERE id = ?', (story_id,)).fetchone()
+        read_story_body(conn, row)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'file_bytes': page_size * page_count,
+        'used_bytes': page_size * (page_count - free_pages),
+        'body_bytes': body_bytes,
+        'read_p50_ms': statistics.median(timings) if timings else 0.0,
+        'read_max_ms': max(timings) if timings else 0.0
+    }
+
+@bp.cli.command('compress-stories')
+@click.option('--algorithm', type=click.Choice(['none', 'zlib', 'zstd']), default=None,
+              help='Target encoding; defaults to STORY_COMPRESSION, or zlib if that is none')
+@click.option('--train/--no-train', default=True, help='Train a new shared dictionary from existing stories first')
+@click.option('--samples', default=2000, help='Stories sampled to train the dictionary')
+@click.option('--batch', default=500, help='Rows re-encoded per transaction')
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards to return freed pages to the filesystem')
+def compress_stories_command(algorithm, train, samples, batch, vacuum):
+    """Re-encode stored story bodies and report size and read latency before and after"""
+    if algorithm is None:
+        algorithm = STORY_CODEC.algorithm if STORY_CODEC.algorithm != 'none' else 'zlib'
+    codec = StoryCodec(algorithm, level=STORY_CODEC.level)
+    conn = db_pool.acquire()
+    try:
+        sample_ids = [row[0] for row in conn.execute('SELECT id FROM stories ORDER BY random() LIMIT 200')]
+        before = measure_story_storage(conn, sample_ids)
+
+        if train and algorithm != 'none':
+            rows = conn.execute(
+                'SELECT story, story_format, story_dict FROM stories ORDER BY random() LIMIT ?', (samples,)
+            ).fetchall()
+            texts = [read_story_body(conn, row) for row in rows]
+            if texts:
+                dictionary = train_dictionary(algorithm, texts)
+                with conn:
+                    conn.execute(
+                        'INSERT INTO compression_dicts (algorithm, data) VALUES (?, ?)', (algorithm, dictionary)
+                    )
+                click.echo(f"Trained a {len(dictionary)} byte {algorithm} dictionary from {len(texts)} stories")
+
+        start = time.perf_counter()
+        rewritten = recompress_stories(conn, codec, batch_size=batch)
+        elapsed = time.perf_counter() - start
+        if vacuum:
+            conn.execute('VACUUM')
+        after = measure_story_storage(conn, sample_ids)
+    finally:
+        db_pool.release(conn)
+
+    click.echo(f"Re-encoded {rewritten} stories as {algorithm} in {elapsed:.1f}s")
+    for label, key in (('Database file', 'file_bytes'), ('Pages in use', 'used_bytes'), ('Story bodies', 'body_bytes')):
+        click.echo(f"{label:<14} {before[key]:>14,} -> {after[key]:>14,} bytes")
+    click.echo(f"{'Read p50':<14} {before['read_p50_ms']:>14.3f} -> {after['read_p50_ms']:>14.3f} ms")
+    click.echo(f"{'Read max':<14} {before['read_max_ms']:>14.3f} -> {after['read_max_ms']:>14.3f} ms")
+    if STORY_CODEC.algorithm != algorithm:
+        click.echo(f"Set STORY_COMPRESSION={algorithm} so new stories are stored the same way")
+
+@bp.route('/cache-stats')
+@ops_only
+def cache_stats():
+    """Get response cache counters"""
+    stats = story_gen.cache.stats()
+    stats['enabled'] = story_gen.cache_enabled
+    stats['public_feed'] = public_feed.stats()
+    if story_gen.single_flight is not None:
+        stats['single_flight'] = story_gen.single_flight.stats()
+    stats['story_memory'] = story_memory.stats()
+    stats['streams'] = stream_buffer.stats()
+    return jsonify(stats)
+
+@bp.route('/job-stats')
+@ops_only
+def job_stats():
+    """Get background job queue depth"""
+    return jsonify(job_queue.stats())
+
+@bp.route('/rate-limit-stats')
+@ops_only
+def rate_limit_stats():
+    """Get client-side rate limiter state"""
+    return jsonify(story_gen.scheduler.stats())
+
+@bp.route('/metrics')
+@ops_only
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/health')
 def health():
     """Health check endpoint"""
+    database_connected = True
+    database_error = None
+    start = time.perf_counter()
+    try:
+        get_db().execute('SELECT 1').fetchone()
+    except Exception as e:
+        database_connected = False
+        database_error = str(e)
+    database_ms = round((time.perf_counter() - start) * 1000, 2)
+    
+    model_loaded = story_gen.configured
+    if not database_connected:
+        status = 'unhealthy'
+    elif not model_loaded:
+        status = 'degraded'
+    else:
+        status = 'healthy'
+    
     return jsonify({
-        'status': 'healthy', 
-        'model_loaded': story_gen.model is not None,
-        'database_connected': True,
+        'status': status,
+        'model_loaded': model_loaded,
+        'backend': story_gen.backend,
+        'database_connected': database_connected,
+        'database_error': database_error,
+        'database_latency_ms': database_ms,
+        'rate_limit': story_gen.scheduler.stats(),
+        'models': story_gen.router.stats(),
+        'pdf_cache': pdf_cache.stats(),
+        'cover_cache': cover_cache.stats(),
+        'story_writer': story_writer.stats() if story_writer is not None else None,
         'model_info': story_gen.get_model_info()
-    })
+    }), 503 if status == 'unhealthy' else 200
+
+# Migrations are a deploy step (`flask --app app migrate`), not something every worker races to do
+MIGRATE_ON_START = os.environ.get('MIGRATE_ON_START', '0') == '1'
+
+_app = None
+_app_lock = threading.Lock()
+
+def create_app():
+    """Build the Flask app and its helpers, check the schema and start background writers
+
+    Called once per process; later calls return the same app. Importing this
+    module creates no files, threads or database connections.
+    """
+    global _app, story_writer, story_gen, story_memory, pdf_cache, cover_cache
+    with _app_lock:
+        if _app is not None:
+            return _app
+        
+        # The Gemini client itself is only created with the first call
+        story_gen = StoryGenerator()
+        # Rolling summary plus recent window that bounds the prompt /continue sends
+        story_memory = StoryMemory(
+            db_pool, story_gen.summarize_passage,
+            budget_tokens=int(os.environ.get('CONTINUE_CONTEXT_TOKENS', 1500)),
+            chunk_tokens=int(os.environ.get('CONTINUE_SUMMARY_CHUNK_TOKENS', 4000))
+        )
+        pdf_cache = PDFCache(
+            directory=os.environ.get('PDF_CACHE_DIR', 'pdf_cache'),
+            max_bytes=int(os.environ.get('PDF_CACHE_MAX_MB', 200)) * 1024 * 1024,
+            workers=int(os.environ.get('PDF_RENDER_WORKERS', 2))
+        )
+        cover_cache = CoverCache(
+            StubCoverFetcher() if os.environ.get('COVER_FETCHER', 'http') == 'stub'
+            else HttpCoverFetcher(
+                timeout=float(os.environ.get('COVER_FETCH_TIMEOUT', 60)),
+                max_bytes=int(os.environ.get('COVER_FETCH_MAX_MB', 10)) * 1024 * 1024
+            ),
+            directory=os.environ.get('COVER_CACHE_DIR', 'cover_cache'),
+            max_bytes=int(os.environ.get('COVER_CACHE_MAX_MB', 500)) * 1024 * 1024,
+            workers=int(os.environ.get('COVER_FETCH_WORKERS', 4))
+        )
+        
+        app = Flask(__name__)
+        app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
+        app.register_blueprint(bp)
+        app.teardown_appcontext(close_db)
+        
+        if MIGRATE_ON_START:
+            init_db()
+        else:
+            pending = pending_migrations()
+            if pending:
+                logger.error(f"Database schema is {pending} migration(s) behind; run `flask --app app migrate`")
+        
+        if os.environ.get('STORY_WRITE_BEHIND', '0') == '1':
+            story_writer = StoryWriter(
+                batch_size=int(os.environ.get('STORY_WRITE_BATCH_SIZE', 100)),
+                interval=float(os.environ.get('STORY_WRITE_INTERVAL_MS', 50)) / 1000.0,
+                on_commit=invalidate_public_feed
+            )
+            atexit.register(story_writer.close)
+        
+        _app = app
+        return app
+
+def __getattr__(name):
+    # `gunicorn app:app` and `flask --app app run` look for a module-level app; build it on first access
+    if name == 'app':
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def shutdown():
+    """Flush queued story writes, for servers that stop without running atexit hooks"""
+    if story_writer is not None:
+        story_writer.close()
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations (run once per deployment)"""
+    start = time.perf_counter()
+    applied = init_db()
+    click.echo(f"Applied {applied} migration(s) in {time.perf_counter() - start:.1f}s; schema is current")
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The development server has no separate deploy step, so it migrates before serving
+    init_db()
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""ASGI entry point with async streaming for the generation endpoints.
+
+/generate and the streaming modes of /enhance and /continue run on the event
+loop using the async Gemini client, so an open stream costs a coroutine
+instead of a worker thread. Reconnects to a /generate stream
+(GET /generate/<stream_id>) are served here too. Every other request is
+handed to the Flask app unchanged.
+
+    uvicorn asgi:application --workers 4
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as storygen
+from app import (
+    create_app, shutdown, save_story, parse_generate_request, parse_enhance_request,
+    parse_continue_request, cover_image_url, stream_error_message,
+    PrefixStripper, QueueStatus, estimate_tokens, SSE_POLICY, StoryMemory,
+    stream_buffer, StreamNotFound
+)
+from metrics import STREAM_SECONDS, STREAM_WRITE_SECONDS
+from sse import aiter_frames
+
+logger = logging.getLogger(__name__)
+
+STREAM_ROUTES = ('/generate', '/enhance', '/continue')
+
+# Open streams allowed per worker before new ones are turned away with 503
+MAX_STREAMS = int(os.environ.get('ASGI_MAX_STREAMS', 5000))
+
+# Also builds the helpers (storygen.story_gen etc.), which is why they are read off the module
+flask_app = create_app()
+wsgi_application = WsgiToAsgi(flask_app)
+_open_streams = 0
+
+
+def load_session(scope):
+    """Read the signed Flask session cookie from the request headers"""
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return serializer.loads(morsel.value, max_age=max_age)
+    except Exception:
+        return {}
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def replay_body(body, receive):
+    """Build a receive callable that hands an already-read body to another app"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+    return replay
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def save_story_async(user_id, story_data, durable=False):
+    """Run save_story on a worker thread inside a Flask app context"""
+    def save():
+        with flask_app.app_context():
+            return save_story(user_id, story_data, durable)
+    return await asyncio.to_thread(save)
+
+
+async def generate_events(params, image_url, user_id, client_key, stream_id):
+    try:
+        yield {'type': 'init', 'image': image_url, 'stream_id': stream_id}
+
+        parts = []
+        stream = storygen.story_gen._call_gemini_stream_async(
+            params['instruct_prompt'], params['temperature'], params['top_p'],
+            use_cache=params['use_cache'], user_key=client_key,
+            expected_tokens=int(params['max_length'] * 1.5), report_queue=True,
+            endpoint='generate'
+        )
+        async for chunk in stream:
+            if isinstance(chunk, QueueStatus):
+                yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+            elif chunk:
+                parts.append(chunk)
+                yield {'type': 'chunk', 'text': chunk}
+
+        full_story = ''.join(parts)
+        story_id = None
+        if user_id:
+            story_id = await save_story_async(user_id, {
+                'title': params['title'],
+                'prompt': params['prompt'],
+                'story': full_story,
+                'genre': params['genre'],
+                'is_public': params['is_public']
+            }, params['durable'])
+
+        yield {'type': 'done', 'story_id': story_id, 'word_count': len(full_story.split())}
+
+    except Exception as e:
+        yield {'type': 'error', 'error': stream_error_message(e)}
+
+
+async def enhance_events(params, client_key):
+    story = params['story']
+    enhancement_type = params['enhancement_type']
+    try:
+        yield {'type': 'init', 'enhancement_type': enhancement_type}
+
+        parts = []
+        stream = storygen.story_gen._call_gemini_stream_async(
+            storygen.story_gen.build_enhance_prompt(story, enhancement_type), 0.7, 0.9,
+            use_cache=params['use_cache'], user_key=client_key,
+            expected_tokens=int(estimate_tokens(story) * 1.5), report_queue=True,
+            endpoint='enhance'
+        )
+        async for chunk in stream:
+            if isinstance(chunk, QueueStatus):
+                yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+            elif chunk:
+                parts.append(chunk)
+                yield {'type': 'chunk', 'text': chunk}
+
+        yield {'type': 'done', 'word_count': len(''.join(parts).split())}
+
+    except Exception as e:
+        yield {'type': 'error', 'error': stream_error_message(e, "enhancing story")}
+
+
+async def continue_events(params, client_key):
+    story_text = params['story']
+    max_length = params['max_length']
+    try:
+        yield {'type': 'init'}
+
+        # Reads SQLite and may call Gemini to fold older text into the summary
+        summary, recent = await asyncio.to_thread(
+            storygen.story_memory.build_context, StoryMemory.memory_key(params['story_id'], story_text),
+            story_text, client_key
+        )
+        stripper = PrefixStripper(recent.strip())
+        parts = []
+        stream = storygen.story_gen._call_gemini_stream_async(
+            storygen.story_gen.build_continue_prompt(summary, recent, max_length), params['temperature'], 0.9,
+            use_cache=params['use_cache'], user_key=client_key,
+            expected_tokens=int(max_length * 1.5), report_queue=True,
+            endpoint='continue'
+        )
+        async for chunk in stream:
+            if isinstance(chunk, QueueStatus):
+                yield {'type': 'queue', 'position': chunk.position, 'eta': chunk.eta}
+                continue
+            text = stripper.feed(chunk or '')
+            if text:
+                parts.append(text)
+                yield {'type': 'chunk', 'text': text}
+        text = stripper.flush()
+        if text:
+            parts.append(text)
+            yield {'type': 'chunk', 'text': text}
+
+        yield {'type': 'done', 'word_count': len(''.join(parts).split())}
+
+    except Exception as e:
+        yield {'type': 'error', 'error': stream_error_message(e, "continuing story")}
+
+
+def get_header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def stream_response(scope, receive, send, events, endpoint, stream_id=None):
+    """Send SSE frames until the generator finishes or the client disconnects.
+
+    Awaiting send() applies the server's flow control, so a slow reader
+    pauses the upstream stream instead of buffering it in memory. Buffered
+    /generate streams are the exception: their upstream runs as its own
+    task and only this reader stops when the client goes away.
+    """
+    global _open_streams
+    _open_streams += 1
+    compress = SSE_POLICY.accepts_gzip(get_header(scope, b'accept-encoding'))
+    headers = [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no')
+    ]
+    if stream_id:
+        headers.append((b'x-stream-id', stream_id.encode('ascii')))
+    if compress:
+        headers += [(b'content-encoding', b'gzip'), (b'vary', b'Accept-Encoding')]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    frames = aiter_frames(events, SSE_POLICY, compress)
+
+    started = time.perf_counter()
+    writing = 0.0
+
+    async def pump():
+        nonlocal writing
+        async for frame in frames:
+            sent_at = time.perf_counter()
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+            writing += time.perf_counter() - sent_at
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def wait_for_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    producer = asyncio.ensure_future(pump())
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({producer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not producer.done():
+            logger.info("Client disconnected, closing stream")
+            producer.cancel()
+        watcher.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await frames.aclose()
+    finally:
+        _open_streams -= 1
+        STREAM_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        STREAM_WRITE_SECONDS.observe(writing, endpoint=endpoint)
+
+
+async def handle_stream(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+    path = scope['path']
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        data = None
+
+    # Non-streaming /enhance and /continue requests stay on Flask
+    if not isinstance(data, dict) or (path != '/generate' and not data.get('stream')):
+        return await wsgi_application(scope, replay_body(body, receive), send)
+
+    if _open_streams >= MAX_STREAMS:
+        return await send_json(send, 503, {'error': 'Server is busy, please try again shortly'})
+
+    session = load_session(scope)
+    user_id = session.get('user_id')
+    client_key = user_id or (scope.get('client') or ('unknown',))[0]
+
+    if path == '/generate':
+        try:
+            params = parse_generate_request(data)
+        except ValueError as e:
+            return await send_json(send, 400, {'error': str(e)})
+        # Registering the cover image writes to SQLite, so keep it off the event loop
+        image_url = await asyncio.to_thread(cover_image_url, params['cover_source'])
+        stream = stream_buffer.create(user_id)
+        stream_buffer.arun(stream, generate_events(params, image_url, user_id, client_key, stream.id))
+        return await stream_response(scope, receive, send, stream.areplay(), 'generate', stream.id)
+
+    # Same validation as the Flask routes
+    try:
+        if path == '/enhance':
+            events = enhance_events(parse_enhance_request(data), client_key)
+        else:
+            events = continue_events(parse_continue_request(data), client_key)
+    except ValueError as e:
+        return await send_json(send, 400, {'error': str(e)})
+
+    await stream_response(scope, receive, send, events, path.lstrip('/'))
+
+
+async def handle_resume(scope, receive, send):
+    """Replay a /generate stream after Last-Event-ID, then follow its live tail"""
+    stream_id = scope['path'][len('/generate/'):]
+    user_id = load_session(scope).get('user_id')
+    last_event_id = get_header(scope, b'last-event-id')
+    if last_event_id is None:
+        last_event_id = parse_qs(scope['query_string'].decode('latin-1')).get('last_event_id', ['0'])[0]
+    last_event_id = last_event_id or '0'
+    if not last_event_id.isdigit():
+        return await send_json(send, 400, {'error': 'Invalid Last-Event-ID'})
+    try:
+        # A stream that is no longer in memory is loaded from SQLite
+        stream = await asyncio.to_thread(stream_buffer.get, stream_id, user_id)
+    except StreamNotFound:
+        return await send_json(send, 404, {'error': 'Stream not found or expired'})
+    except PermissionError as e:
+        return await send_json(send, 403, {'error': str(e)})
+    await stream_response(scope, receive, send, stream.areplay(int(last_event_id)), 'generate', stream.id)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in STREAM_ROUTES:
+        return await handle_stream(scope, receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'].startswith('/generate/'):
+        return await handle_resume(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
@@ -0,0 +1,181 @@
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from database import insert_story
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner:
+    """Generates a list of story specs with bounded concurrency.
+
+    Each finished item is recorded in batch_items as soon as it completes, so
+    a batch that is interrupted can be resumed by id and only the unfinished
+    items are generated again. The stories themselves are inserted together
+    in one transaction when the run ends. Upstream rate limits still apply
+    per call, because every item goes through the generator's scheduler.
+    """
+
+    def __init__(self, pool, generate, max_concurrency=4, max_items=500, on_insert=None):
+        self.pool = pool
+        # generate(spec, user_id) -> story_data dict; raises ValueError for a bad spec
+        self.generate = generate
+        self.max_concurrency = max_concurrency
+        self.max_items = max_items
+        # Called with the list of inserted story_data dicts after each bulk insert
+        self.on_insert = on_insert
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def create(self, user_id, specs, batch_id=None):
+        """Record a new batch and return its id"""
+        if not isinstance(specs, list) or not specs:
+            raise ValueError('Please provide a non-empty list of items')
+        if len(specs) > self.max_items:
+            raise ValueError(f'A batch can hold at most {self.max_items} items')
+        if not all(isinstance(spec, dict) for spec in specs):
+            raise ValueError('Each item must be an object')
+        batch_id = batch_id or str(uuid.uuid4())
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute('INSERT INTO batches (id, user_id, total) VALUES (?, ?, ?)',
+                             (batch_id, user_id, len(specs)))
+                conn.executemany(
+                    'INSERT INTO batch_items (batch_id, item_index, spec, story_id) VALUES (?, ?, ?, ?)',
+                    [(batch_id, index, json.dumps(spec), str(uuid.uuid4())) for index, spec in enumerate(specs)]
+                )
+        finally:
+            self.pool.release(conn)
+        return batch_id
+
+    def exists(self, batch_id, user_id):
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute('SELECT user_id FROM batches WHERE id = ?', (batch_id,)).fetchone()
+        finally:
+            self.pool.release(conn)
+        if row is None:
+            return False
+        if row['user_id'] != user_id:
+            raise PermissionError('Unauthorized to access this batch')
+        return True
+
+    def run(self, batch_id, user_id, concurrency=None):
+        """Generate the unfinished items of a batch, yielding one result dict per item as it completes"""
+        with self._lock:
+            if batch_id in self._running:
+                raise RuntimeError(f'Batch {batch_id} is already running')
+            self._running.add(batch_id)
+        try:
+            yield from self._run(batch_id, user_id, concurrency)
+        finally:
+            with self._lock:
+                self._running.discard(batch_id)
+
+    def _run(self, batch_id, user_id, concurrency):
+        conn = self.pool.acquire()
+        try:
+            items = conn.execute('''
+                SELECT item_index, spec, story_id, status, word_count FROM batch_items
+                WHERE batch_id = ? ORDER BY item_index
+            ''', (batch_id,)).fetchall()
+        finally:
+            self.pool.release(conn)
+
+        finished = [item for item in items if item['status'] in ('done', 'saved')]
+        todo = [item for item in items if item['status'] not in ('done', 'saved')]
+        workers = max(1, min(int(concurrency or self.max_concurrency), self.max_concurrency))
+        yield {'type': 'batch', 'batch_id': batch_id, 'total': len(items),
+               'finished': len(finished), 'pending': len(todo), 'concurrency': workers}
+
+        # Items finished by an earlier, interrupted run are reported first
+        for item in finished:
+            yield {'type': 'result', 'index': item['item_index'], 'status': 'ok', 'story_id': item['story_id'],
+                   'word_count': item['word_count'], 'resumed': True}
+
+        succeeded = len(finished)
+        failed = 0
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        try:
+            futures = {
+                executor.submit(self._generate_item, batch_id, item, user_id): item
+                for item in todo
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                if result['status'] == 'ok':
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield result
+        finally:
+            # A disconnected client stops new items; ones already generating still record their result
+            executor.shutdown(wait=False, cancel_futures=True)
+            inserted = self._insert_finished(batch_id, user_id)
+
+        yield {'type': 'done', 'batch_id': batch_id, 'succeeded': succeeded, 'failed': failed,
+               'inserted': inserted}
+
+    def _generate_item(self, batch_id, item, user_id):
+        index = item['item_index']
+        try:
+            story_data = self.generate(json.loads(item['spec']), user_id)
+            word_count = len(story_data['story'].split())
+            self._record(batch_id, index, 'done', result=json.dumps(story_data), word_count=word_count)
+            return {'type': 'result', 'index': index, 'status': 'ok', 'story_id': item['story_id'],
+                    'title': story_data.get('title'), 'word_count': word_count}
+        except Exception as e:
+            logger.error(f"Error generating batch item {batch_id}/{index}: {str(e)}")
+            try:
+                self._record(batch_id, index, 'error', error=str(e))
+            except Exception as record_error:
+                logger.error(f"Error recording batch item {batch_id}/{index}: {str(record_error)}")
+            return {'type': 'result', 'index': index, 'status': 'error', 'error': str(e)}
+
+    def _record(self, batch_id, index, status, result=None, word_count=None, error=None):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE batch_items SET status = ?, result = ?, word_count = ?, error = ?
+                    WHERE batch_id = ? AND item_index = ?
+                ''', (status, result, word_count, error, batch_id, index))
+        finally:
+            self.pool.release(conn)
+
+    def _insert_finished(self, batch_id, user_id):
+        """Insert every generated-but-unsaved story of the batch in one transaction"""
+        conn = self.pool.acquire()
+        try:
+            rows = conn.execute('''
+                SELECT item_index, story_id, result FROM batch_items
+                WHERE batch_id = ? AND status = 'done'
+            ''', (batch_id,)).fetchall()
+            stories = [json.loads(row['result']) for row in rows]
+            with conn:
+                for row, story_data in zip(rows, stories):
+                    insert_story(conn, row['story_id'], user_id, story_data)
+                conn.executemany(
+                    "UPDATE batch_items SET status = 'saved', result = NULL WHERE batch_id = ? AND item_index = ?",
+                    [(batch_id, row['item_index']) for row in rows]
+                )
+                conn.execute('''
+                    UPDATE batches SET
+                        status = CASE WHEN EXISTS (
+                            SELECT 1 FROM batch_items WHERE batch_id = ? AND status != 'saved'
+                        ) THEN 'partial' ELSE 'complete' END,
+                        finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (batch_id, batch_id))
+        finally:
+            self.pool.release(conn)
+        if stories and self.on_insert is not None:
+            try:
+                self.on_insert(stories)
+            except Exception as e:
+                logger.error(f"Error in batch insert hook: {str(e)}")
+        return len(stories)
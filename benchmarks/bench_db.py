@@ -0,0 +1,131 @@
+"""Query latency benchmark for the story list endpoints.
+
+Builds a throwaway database with N stories spread across many users, then
+times the queries behind /my-stories, /public-stories, /favorites and
+/story-stats before and after the index migration.
+
+    python benchmarks/bench_db.py --stories 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database  # noqa: E402
+
+GENRES = ['fantasy', 'sci-fi', 'mystery', 'romance', 'horror', 'adventure', 'comedy', None]
+
+QUERIES = {
+    'get_user_stories': ('SELECT * FROM stories WHERE user_id = ? ORDER BY created_at DESC', 'user'),
+    'get_public_stories': ('''
+        SELECT s.*, u.username FROM stories s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.is_public = 1
+        ORDER BY s.created_at DESC
+        LIMIT 20
+    ''', None),
+    'favorites': ('''
+        SELECT s.*, u.username FROM favorites f
+        JOIN stories s ON f.story_id = s.id
+        JOIN users u ON s.user_id = u.id
+        WHERE f.user_id = ?
+        ORDER BY f.created_at DESC
+    ''', 'user'),
+    'story_stats': ('''
+        SELECT COUNT(*) as total_stories, SUM(word_count) as total_words, AVG(word_count) as avg_words
+        FROM stories WHERE user_id = ?
+    ''', 'user'),
+}
+
+
+def populate(conn, num_users, num_stories, num_favorites, body_words):
+    body = ' '.join(['word'] * body_words)
+    conn.executemany(
+        'INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+        ((i, f'user{i}', f'user{i}@example.com', 'x') for i in range(1, num_users + 1))
+    )
+    story_ids = []
+    batch = []
+    for i in range(num_stories):
+        story_id = str(uuid.uuid4())
+        story_ids.append(story_id)
+        created_at = f'2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{i % 60:02d}'
+        batch.append((story_id, random.randint(1, num_users), f'Story {i}', 'A prompt', body,
+                      random.choice(GENRES), body_words, created_at, int(random.random() < 0.2)))
+        if len(batch) == 50000:
+            conn.executemany('''
+                INSERT INTO stories (id, user_id, title, prompt, story, genre, word_count, created_at, is_public)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''
+            INSERT INTO stories (id, user_id, title, prompt, story, genre, word_count, created_at, is_public)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+    conn.executemany(
+        'INSERT INTO favorites (user_id, story_id) VALUES (?, ?)',
+        ((random.randint(1, num_users), random.choice(story_ids)) for _ in range(num_favorites))
+    )
+    conn.commit()
+
+
+def time_queries(conn, num_users, repeat):
+    results = {}
+    for name, (sql, param) in QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            args = (random.randint(1, num_users),) if param == 'user' else ()
+            start = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        results[name] = {
+            'p50_ms': round(statistics.median(samples), 3),
+            'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3),
+            'max_ms': round(samples[-1], 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stories', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--favorites', type=int, default=100000)
+    parser.add_argument('--body-words', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--db', help='Database file to use (default: a temporary file)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = database.connect(path)
+    database.MIGRATIONS[0](conn)
+
+    start = time.perf_counter()
+    populate(conn, args.users, args.stories, args.favorites, args.body_words)
+    print(f'Populated {args.stories} stories in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    conn.execute('ANALYZE')
+
+    report = {'stories': args.stories, 'users': args.users, 'favorites': args.favorites}
+    report['before'] = time_queries(conn, args.users, args.repeat)
+
+    for migration in database.MIGRATIONS[1:]:
+        migration(conn)
+    conn.commit()
+    conn.execute('ANALYZE')
+    report['after'] = time_queries(conn, args.users, args.repeat)
+
+    conn.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""Load test for the streaming and list endpoints against the fake Gemini backend.
+
+Starts the app in a subprocess with GEMINI_BACKEND=fake and a throwaway
+database (or targets --url), drives each endpoint at the requested
+concurrency levels and prints a JSON report with time-to-first-token,
+latency percentiles and throughput.
+
+    python benchmarks/bench_load.py --server asgi --concurrency 1,10,50
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ENDPOINTS = ('generate', 'enhance', 'multiple-endings', 'export-pdf', 'my-stories', 'public-stories', 'favorites')
+
+SAMPLE_STORY = (
+    "The lighthouse keeper had not seen a ship in eleven years, so when the lamp "
+    "began to turn on its own one stormy night, she climbed the stairs with a lantern "
+    "and a pounding heart."
+)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return round(ordered[index], 2)
+
+
+def summarize(samples):
+    return {
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': round(max(samples), 2) if samples else None,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def log_tail(path, lines=40):
+    """Last lines of the server log, for reporting why a run failed"""
+    try:
+        with open(path, errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+    except OSError:
+        return ''
+
+
+def report_server_log(log_path):
+    if log_path:
+        print(f'--- server log ({log_path}) ---\n{log_tail(log_path)}', file=sys.stderr)
+
+
+def start_server(kind, workdir, env_overrides):
+    """Migrate a fresh database in workdir and start the server; returns (process, url, log path)"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'GEMINI_BACKEND': 'fake',
+        'GEMINI_RPM': '0',
+        'GEMINI_TPM': '0',
+        'RESPONSE_CACHE_ENABLED': '0',
+        'COVER_FETCHER': 'stub',
+        'PYTHONPATH': ROOT + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    env.update(env_overrides)
+    migrate = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=workdir, env=env,
+                             capture_output=True, text=True)
+    if migrate.returncode != 0:
+        raise RuntimeError(f'migrate failed:\n{migrate.stderr[-2000:]}')
+    if kind == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads']
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'wb') as log:
+        proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/random-prompt', timeout=1)
+            return proc, url, log_path
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    proc.wait()
+    raise RuntimeError(f'Server did not start:\n{log_tail(log_path)}')
+
+
+def new_session(url, username, password):
+    session = requests.Session()
+    session.post(f'{url}/login', json={'username': username, 'password': password}).raise_for_status()
+    return session
+
+
+def read_stream(response, first_event):
+    """Consume an SSE response; return (seconds to first matching event, error message)"""
+    start = time.perf_counter()
+    first = None
+    error = None
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data: '):
+            continue
+        event = json.loads(line[6:])
+        if first is None and event.get('type') in first_event:
+            first = time.perf_counter() - start
+        if event.get('type') in ('error', 'ending_error'):
+            error = event.get('error')
+    return first, error
+
+
+def make_request(endpoint, session, url, story_ids):
+    """Issue one request; returns (ttft seconds or None, error or None)"""
+    if endpoint == 'generate':
+        payload = {'prompt': f'A lighthouse that turns on by itself {uuid.uuid4().hex[:6]}', 'max_length': 300,
+                   'use_cache': False}
+        with session.post(f'{url}/generate', json=payload, stream=True) as r:
+            r.raise_for_status()
+            return read_stream(r, ('chunk',))
+    if endpoint == 'enhance':
+        payload = {'story': SAMPLE_STORY, 'type': 'detail', 'stream': True, 'use_cache': False}
+        with session.post(f'{url}/enhance', json=payload, stream=True) as r:
+            r.raise_for_status()
+            return read_stream(r, ('chunk',))
+    if endpoint == 'multiple-endings':
+        payload = {'story': SAMPLE_STORY, 'num_endings': 3, 'use_cache': False, 'stream': True}
+        with session.post(f'{url}/multiple-endings', json=payload, stream=True) as r:
+            r.raise_for_status()
+            return read_stream(r, ('ending',))
+    if endpoint == 'export-pdf':
+        r = session.get(f'{url}/export-pdf/{story_ids[0]}')
+    else:
+        r = session.get(f'{url}/{endpoint}')
+    r.raise_for_status()
+    return None, None
+
+
+def run_level(endpoint, url, credentials, story_ids, concurrency, requests_per_worker):
+    ttfts, latencies, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker():
+        session = new_session(url, *credentials)
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            try:
+                ttft, error = make_request(endpoint, session, url, story_ids)
+            except Exception as e:
+                ttft, error = None, str(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+                if ttft is not None:
+                    ttfts.append(ttft * 1000)
+                if error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'latency_ms': summarize(latencies),
+        'ttft_ms': summarize(ttfts) if ttfts else None,
+    }
+
+
+def seed_data(url, credentials, count):
+    session = requests.Session()
+    username, password = credentials
+    r = session.post(f'{url}/register', json={'username': username, 'email': f'{username}@bench.local',
+                                              'password': password})
+    if r.status_code == 500:
+        r.raise_for_status()
+    if r.status_code != 200:
+        session = new_session(url, username, password)
+    story_ids = []
+    for i in range(count):
+        with session.post(f'{url}/generate', json={'prompt': f'Seed story {i}', 'is_public': True,
+                                                   'max_length': 100}, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if line and line.startswith('data: '):
+                    event = json.loads(line[6:])
+                    if event.get('type') == 'done' and event.get('story_id'):
+                        story_ids.append(event['story_id'])
+    for story_id in story_ids[:5]:
+        session.post(f'{url}/favorite/{story_id}')
+    return story_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask',
+                        help='Server to start against the fake backend')
+    parser.add_argument('--url', help='Benchmark an already running server instead of starting one')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', default='1,10,50', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=5, help='Requests per worker at each level')
+    parser.add_argument('--seed-stories', type=int, default=20)
+    parser.add_argument('--ttft', default='0.2', help='Fake backend time to first chunk (s)')
+    parser.add_argument('--chunk-latency', default='0.02', help='Fake backend delay between chunks (s)')
+    parser.add_argument('--error-rate', default='0', help='Fraction of fake calls that fail')
+    parser.add_argument('--rate-limit-rate', default='0', help='Fraction of fake calls that return 429')
+    parser.add_argument('--output', help='Write the JSON report to this file as well as stdout')
+    args = parser.parse_args()
+
+    proc = log_path = None
+    workdir = tempfile.mkdtemp(prefix='story-bench-')
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        proc, url, log_path = start_server(args.server, workdir, {
+            'FAKE_GEMINI_TTFT': args.ttft,
+            'FAKE_GEMINI_CHUNK_LATENCY': args.chunk_latency,
+            'FAKE_GEMINI_ERROR_RATE': args.error_rate,
+            'FAKE_GEMINI_429_RATE': args.rate_limit_rate,
+            'RATE_LIMIT_RETRIES': '0',
+        })
+
+    try:
+        credentials = (f'bench{uuid.uuid4().hex[:8]}', 'bench-password')
+        try:
+            story_ids = seed_data(url, credentials, args.seed_stories)
+        except Exception:
+            report_server_log(log_path)
+            raise
+        report = {
+            'server': 'external' if args.url else args.server,
+            'fake_backend': {'ttft': float(args.ttft), 'chunk_latency': float(args.chunk_latency),
+                             'error_rate': float(args.error_rate), 'rate_limit_rate': float(args.rate_limit_rate)},
+            'results': {}
+        }
+        levels = [int(level) for level in args.concurrency.split(',')]
+        for endpoint in args.endpoints.split(','):
+            report['results'][endpoint] = {}
+            for level in levels:
+                print(f'{endpoint} @ {level}...', file=sys.stderr)
+                result = run_level(endpoint, url, credentials, story_ids, level, args.requests)
+                report['results'][endpoint][str(level)] = result
+                if result['errors']:
+                    report_server_log(log_path)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Worker cold start benchmark with a regression budget.
+
+Runs `import app; app.create_app()` (or `import asgi`) in fresh interpreters
+under `python -X importtime` against a throwaway, already migrated database,
+and prints a JSON report with the median import and startup time and the
+slowest top-level imports. Exits with status 1 if the median startup time
+is over --budget-ms or a module that should load on first use (the Gemini
+SDK, ReportLab, requests) was imported at startup, so it can run in CI.
+
+    python benchmarks/bench_startup.py --runs 10 --budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Only needed once a story is generated against the real API, a PDF is rendered or a cover is downloaded
+LAZY_MODULES = ('google.genai', 'reportlab', 'requests')
+
+TARGETS = {
+    'app': 'import app; app.create_app()',
+    'asgi': 'import asgi',
+}
+
+TIMER = '''
+import time
+start = time.perf_counter()
+{code}
+print(f"STARTUP_MS {{(time.perf_counter() - start) * 1000:.1f}}")
+'''
+
+
+def parse_importtime(stderr, target):
+    """Return (cumulative ms of target, {module: cumulative ms} of its direct imports, all module names)"""
+    names = set()
+    children = {}
+    pending = {}
+    total = None
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        names.add(name)
+        # A module's imports are listed before it, one level deeper
+        if depth == 1:
+            pending[name] = int(cumulative_us) / 1000.0
+        elif depth == 0:
+            if name == target:
+                total = int(cumulative_us) / 1000.0
+                children = pending
+            pending = {}
+    return total, children, names
+
+
+def run_once(target, env):
+    code = TIMER.format(code=TARGETS[target])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'{target} failed to start:\n{result.stderr[-2000:]}')
+    startup_ms = next(float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith('STARTUP_MS'))
+    return (startup_ms,) + parse_importtime(result.stderr, target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--target', choices=sorted(TARGETS), default='app', help='Entry point to start')
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters to time')
+    parser.add_argument('--budget-ms', type=float, default=600, help='Fail if the median startup time is above this')
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to report')
+    parser.add_argument('--output', help='Write the JSON report to this file as well as stdout')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='story-bench-')
+    env = dict(os.environ)
+    env.update({
+        'GEMINI_BACKEND': 'genai',
+        'GEMINI_API_KEY': 'bench-not-used',
+        'COVER_FETCHER': 'http',
+        'DATABASE_PATH': os.path.join(workdir, 'stories.db'),
+        'PDF_CACHE_DIR': os.path.join(workdir, 'pdf_cache'),
+        'COVER_CACHE_DIR': os.path.join(workdir, 'cover_cache'),
+        'PYTHONPATH': ROOT + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+
+    # Deployments migrate once before starting workers, so that is not timed either
+    migrate = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+    if migrate.returncode != 0:
+        raise RuntimeError(f'migrate failed:\n{migrate.stderr[-2000:]}')
+    # A first start warms the filesystem cache and creates the cache directories
+    run_once(args.target, env)
+
+    startups = []
+    imports = []
+    top_level = {}
+    eager = set()
+    for _ in range(args.runs):
+        startup_ms, import_ms, children, names = run_once(args.target, env)
+        startups.append(startup_ms)
+        imports.append(import_ms)
+        for name, ms in children.items():
+            top_level.setdefault(name, []).append(ms)
+        eager.update(name for name in LAZY_MODULES if name in names)
+
+    slowest = sorted(((name, statistics.median(times)) for name, times in top_level.items()),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+    median_startup = statistics.median(startups)
+    report = {
+        'target': args.target,
+        'runs': args.runs,
+        'startup_ms': {'median': round(median_startup, 1), 'min': round(min(startups), 1),
+                       'max': round(max(startups), 1)},
+        'import_ms': round(statistics.median(imports), 1),
+        'slowest_imports_ms': {name: round(ms, 1) for name, ms in slowest},
+        'eager_lazy_modules': sorted(eager),
+        'budget_ms': args.budget_ms,
+        'passed': median_startup <= args.budget_ms and not eager
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the image formats served from the cache. SVG is left out on
+# purpose: it can carry script, and covers are served from the site's own origin
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def sniff_content_type(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return 'application/octet-stream'
+
+
+class HttpCoverFetcher:
+    """Downloads cover images from the generator URL, refusing anything over max_bytes"""
+
+    def __init__(self, timeout=60, max_bytes=10 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # requests is imported with the first download rather than at startup
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+            return self._session
+
+    def fetch(self, url):
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith('image/') or content_type.startswith('image/svg'):
+                raise ValueError(f"Cover source returned {content_type or 'no content type'}")
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > self.max_bytes:
+                raise ValueError(f"Cover image is {length} bytes, over the {self.max_bytes} byte limit")
+            data = bytearray()
+            for block in response.iter_content(64 * 1024):
+                data += block
+                if len(data) > self.max_bytes:
+                    raise ValueError(f"Cover image is over the {self.max_bytes} byte limit")
+            return bytes(data)
+
+
+class StubCoverFetcher:
+    """Offline stand-in that draws a gradient derived from the URL"""
+
+    width = 256
+    height = 128
+
+    def fetch(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).digest()
+        start, end = digest[:3], digest[3:6]
+        row = bytearray()
+        for x in range(self.width):
+            row += bytes(a + (b - a) * x // (self.width - 1) for a, b in zip(start, end))
+        # Each scanline starts with filter type 0 (none)
+        pixels = (b'\x00' + bytes(row)) * self.height
+        return b''.join([
+            b'\x89PNG\r\n\x1a\n',
+            _png_chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)),
+            _png_chunk(b'IDAT', zlib.compress(pixels)),
+            _png_chunk(b'IEND', b'')
+        ])
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+class CoverCache(DiskCache):
+    """On-disk cache of proxied cover images, named by a hash of their source URL.
+
+    The first request for a cover downloads it once; concurrent requests for
+    the same cover wait for that download instead of starting their own.
+    """
+
+    suffix = '.img'
+    failure = 'Error fetching cover image'
+    inflight_stat = 'fetching'
+
+    def __init__(self, fetcher, directory='cover_cache', max_bytes=500 * 1024 * 1024, workers=4):
+        super().__init__(directory, max_bytes, workers, 'cover')
+        self.fetcher = fetcher
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:40]
+
+    def get_or_fetch(self, key, load_url, timeout=None):
+        """Return (path, content_type) of the cached cover, downloading it now if needed
+
+        load_url() is only called on a miss; if it returns None the cover is
+        unknown and None is returned.
+        """
+        for attempt in range(2):
+            path = self._lookup(key)
+            if path is None:
+                url = load_url()
+                if url is None:
+                    return None
+                path = self._miss(key, url).result(timeout)
+            try:
+                with open(path, 'rb') as f:
+                    head = f.read(16)
+                return path, sniff_content_type(head)
+            except FileNotFoundError:
+                # Evicted between finding it and opening it; download it again once
+                if attempt:
+                    raise
+
+    def prefetch(self, key, url):
+        """Start downloading in the background so the first view is a file send"""
+        if not os.path.exists(self.path_for(key)):
+            self._submit(key, url)
+
+    def _produce(self, url):
+        data = self.fetcher.fetch(url)
+        if sniff_content_type(data[:16]) == 'application/octet-stream':
+            raise ValueError("Cover source did not return a JPEG, PNG, GIF or WebP image")
+        return data
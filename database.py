@@ -0,0 +1,546 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from story_codec import StoryCodec
+
+logger = logging.getLogger(__name__)
+
+DATABASE = os.environ.get('DATABASE_PATH', 'stories.db')
+
+# Characters of the story body kept in the excerpt column for list views
+EXCERPT_LENGTH = 200
+
+# Encoding for newly written story bodies: none, zlib or zstd (see compress-stories)
+STORY_CODEC = StoryCodec(os.environ.get('STORY_COMPRESSION', 'none'),
+                         level=int(os.environ.get('STORY_COMPRESSION_LEVEL', 6)))
+
+# journal_mode is persistent in the file; the rest are per-connection settings
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = {synchronous}',
+    'PRAGMA busy_timeout = {busy_timeout}',
+    'PRAGMA cache_size = -{cache_kb}',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+def connect(path=None):
+    """Open a tuned SQLite connection"""
+    conn = sqlite3.connect(path or DATABASE, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    settings = {
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'cache_kb': int(os.environ.get('SQLITE_CACHE_KB', 16384)),
+    }
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma.format(**settings))
+    # Lets the search index's content view decode story bodies, which 'rebuild' and snippet()
+    # need. Story writes don't: insert_story and delete_story index the text themselves, so
+    # connections opened elsewhere (e.g. the sqlite3 shell) can write stories, but the search
+    # index misses those changes until `flask rebuild-search` runs
+    conn.create_function('story_text', 3, lambda story, story_format, story_dict:
+                         STORY_CODEC.decode(conn, story, story_format, story_dict), deterministic=True)
+    return conn
+
+
+class ConnectionPool:
+    """Small pool of reusable connections handed out one per request thread"""
+
+    def __init__(self, path=None, size=8):
+        self.path = path or DATABASE
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.created += 1
+            return connect(self.path)
+
+    def release(self, conn):
+        # Never hand a connection with an open transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _create_base_tables(conn):
+    # Users table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Stories table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stories (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            title TEXT,
+            prompt TEXT NOT NULL,
+            story TEXT NOT NULL,
+            genre TEXT,
+            word_count INTEGER,
+            rating INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_public BOOLEAN DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Story collections/favorites
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            story_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (story_id) REFERENCES stories (id)
+        )
+    ''')
+
+
+def _add_list_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stories_user_created ON stories (user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stories_public_created ON stories (is_public, created_at)')
+    # Older databases could hold duplicate favorites; keep the first of each pair
+    conn.execute('''
+        DELETE FROM favorites WHERE id NOT IN (
+            SELECT MIN(id) FROM favorites GROUP BY user_id, story_id
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_favorites_user_story ON favorites (user_id, story_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites (user_id, created_at)')
+
+
+def _add_list_projection(conn):
+    # Short excerpt stored alongside the body so list views never read the full story
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(stories)')]
+    if 'excerpt' not in columns:
+        conn.execute('ALTER TABLE stories ADD COLUMN excerpt TEXT')
+    conn.execute(f'UPDATE stories SET excerpt = substr(story, 1, {EXCERPT_LENGTH}) WHERE excerpt IS NULL')
+    # Keyset pagination orders on (created_at, id), so id has to be in the index too
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stories_user_created_id ON stories (user_id, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stories_public_created_id ON stories (is_public, created_at, id)')
+    conn.execute('DROP INDEX IF EXISTS idx_stories_user_created')
+    conn.execute('DROP INDEX IF EXISTS idx_stories_public_created')
+
+
+def _add_user_stats(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_stories INTEGER NOT NULL DEFAULT 0,
+            total_words INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # genre is '' rather than NULL for stories without one, so it can be part of the key
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_genre_stats (
+            user_id INTEGER NOT NULL,
+            genre TEXT NOT NULL DEFAULT '',
+            story_count INTEGER NOT NULL DEFAULT 0,
+            total_words INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, genre)
+        ) WITHOUT ROWID
+    ''')
+    rebuild_user_stats(conn)
+
+
+def _add_feed_version(conn):
+    # Bumped by triggers whenever the public feed changes, so every worker can cheaply tell
+    # whether its cached copy is stale, whichever process (or writer thread) made the change
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feed_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO feed_version (name, version) VALUES ('public', 0)")
+    bump = "UPDATE feed_version SET version = version + 1 WHERE name = 'public';"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_public_insert AFTER INSERT ON stories
+        WHEN NEW.is_public BEGIN {bump} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_public_delete AFTER DELETE ON stories
+        WHEN OLD.is_public BEGIN {bump} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_public_update AFTER UPDATE ON stories
+        WHEN OLD.is_public OR NEW.is_public BEGIN {bump} END
+    ''')
+
+
+def _add_covers(conn):
+    # Source URL of each proxied cover image, so /cover/<key> only fetches URLs we generated
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS covers (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _add_story_format(conn):
+    # How each story body is stored, so compressed and plain rows can coexist
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(stories)')]
+    if 'story_format' not in columns:
+        conn.execute('ALTER TABLE stories ADD COLUMN story_format INTEGER NOT NULL DEFAULT 0')
+    if 'story_dict' not in columns:
+        conn.execute('ALTER TABLE stories ADD COLUMN story_dict INTEGER')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            algorithm TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Re-encoding a body doesn't change the public feed, so only feed columns bump its version
+    conn.execute('DROP TRIGGER IF EXISTS stories_public_update')
+    conn.execute('''
+        CREATE TRIGGER stories_public_update
+        AFTER UPDATE OF id, user_id, title, excerpt, genre, word_count, created_at, is_public ON stories
+        WHEN OLD.is_public OR NEW.is_public
+        BEGIN UPDATE feed_version SET version = version + 1 WHERE name = 'public'; END
+    ''')
+
+
+def _add_batches(conn):
+    # Progress of /generate-batch runs, so an interrupted batch can be resumed by id.
+    # Generated stories wait in result (JSON) until they are inserted together.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS batches (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id TEXT NOT NULL,
+            item_index INTEGER NOT NULL,
+            spec TEXT NOT NULL,
+            story_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            result TEXT,
+            word_count INTEGER,
+            error TEXT,
+            PRIMARY KEY (batch_id, item_index)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _add_story_memory(conn):
+    # Rolling summaries used by /continue, keyed by story id (or opening text for unsaved stories)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS story_memory (
+            key TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_chars INTEGER NOT NULL,
+            covered_hash TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_story_memory_updated ON story_memory (updated_at)')
+
+
+def _add_search_index(conn):
+    # Bodies may be compressed, so the index reads them through a view that decodes with story_text()
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS stories_text AS
+        SELECT rowid AS story_rowid, title, prompt, story_text(story, story_format, story_dict) AS story
+        FROM stories
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+            title, prompt, story,
+            content='stories_text', content_rowid='story_rowid',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Title matches count most, then the prompt, then the body
+    conn.execute("INSERT INTO stories_fts (stories_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0)')")
+    old_row = "'delete', old.rowid, old.title, old.prompt, story_text(old.story, old.story_format, old.story_dict)"
+    new_row = "new.rowid, new.title, new.prompt, story_text(new.story, new.story_format, new.story_dict)"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+            INSERT INTO stories_fts (rowid, title, prompt, story) VALUES ({new_row});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+            INSERT INTO stories_fts (stories_fts, rowid, title, prompt, story) VALUES ({old_row});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF title, prompt, story ON stories BEGIN
+            INSERT INTO stories_fts (stories_fts, rowid, title, prompt, story) VALUES ({old_row});
+            INSERT INTO stories_fts (rowid, title, prompt, story) VALUES ({new_row});
+        END
+    ''')
+    rebuild_search_index(conn)
+
+
+def _index_search_from_app(conn):
+    # The triggers called story_text(), which only connect() registers, so writes from any
+    # other connection failed; insert_story and delete_story now keep the index in step
+    for trigger in ('stories_fts_insert', 'stories_fts_delete', 'stories_fts_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+
+def _add_streams(conn):
+    # Finished /generate streams, kept for a while so a client can replay one after reconnecting
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS streams (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_streams_finished ON streams (finished_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stream_events (
+            stream_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            PRIMARY KEY (stream_id, seq)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _add_jobs(conn):
+    # Background jobs for the job queue; times are Unix seconds so leases and backoff are simple arithmetic
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            user_id INTEGER,
+            client_key TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at REAL NOT NULL,
+            lease_until REAL,
+            worker TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+    # Serves the claim query: next queued job by priority, then by when it became ready
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, run_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs (client_key, status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    _create_base_tables,
+    _add_list_indexes,
+    _add_list_projection,
+    _add_user_stats,
+    _add_feed_version,
+    _add_covers,
+    _add_story_format,
+    _add_batches,
+    _add_story_memory,
+    _add_search_index,
+    _add_streams,
+    _add_jobs,
+    _index_search_from_app,
+]
+
+
+def insert_story(conn, story_id, user_id, story_data):
+    """Insert a story and count it in the owner's stats, without committing"""
+    word_count = len(story_data['story'].split())
+    body, story_format, story_dict = STORY_CODEC.encode(conn, story_data['story'])
+    cursor = conn.execute('''
+        INSERT INTO stories (id, user_id, title, prompt, story, story_format, story_dict,
+                             excerpt, genre, word_count, is_public)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        story_id,
+        user_id,
+        story_data.get('title', 'Untitled Story'),
+        story_data['prompt'],
+        body,
+        story_format,
+        story_dict,
+        story_data['story'][:EXCERPT_LENGTH],
+        story_data.get('genre'),
+        word_count,
+        story_data.get('is_public', False)
+    ))
+    # The plain text is at hand here, so the search index never has to decode the body
+    conn.execute('INSERT INTO stories_fts (rowid, title, prompt, story) VALUES (?, ?, ?, ?)', (
+        cursor.lastrowid, story_data.get('title', 'Untitled Story'), story_data['prompt'], story_data['story']
+    ))
+    if user_id:
+        update_user_stats(conn, user_id, story_data.get('genre'), word_count)
+
+
+def unindex_story(conn, row):
+    """Remove a story from the search index before deleting it.
+
+    row must select rowid, title, prompt, story, story_format and story_dict;
+    the index needs exactly the text it was given when the story was inserted.
+    """
+    conn.execute("INSERT INTO stories_fts (stories_fts, rowid, title, prompt, story) VALUES ('delete', ?, ?, ?, ?)",
+                 (row['rowid'], row['title'], row['prompt'], read_story_body(conn, row)))
+
+
+def read_story_body(conn, row):
+    """Decode the story column of a row that also selected story_format and story_dict"""
+    return STORY_CODEC.decode(conn, row['story'], row['story_format'], row['story_dict'])
+
+
+def recompress_stories(conn, codec, batch_size=500):
+    """Re-encode every story body with codec, one short transaction per batch.
+
+    Rows already in the codec's format and dictionary are skipped, so the
+    command can be interrupted and re-run. Returns the number of rows rewritten.
+    """
+    dict_id, _ = codec.active_dictionary(conn)
+    last_rowid = 0
+    rewritten = 0
+    while True:
+        rows = conn.execute('''
+            SELECT rowid, story, story_format, story_dict FROM stories
+            WHERE rowid > ? ORDER BY rowid LIMIT ?
+        ''', (last_rowid, batch_size)).fetchall()
+        if not rows:
+            return rewritten
+        last_rowid = rows[-1]['rowid']
+        updates = []
+        for row in rows:
+            if row['story_format'] == codec.format and row['story_dict'] == dict_id:
+                continue
+            body, story_format, story_dict = codec.encode(conn, read_story_body(conn, row))
+            updates.append((body, story_format, story_dict, row['rowid']))
+        if updates:
+            # Holding the write lock for one batch at a time keeps the app writable during the run
+            with conn:
+                conn.executemany(
+                    'UPDATE stories SET story = ?, story_format = ?, story_dict = ? WHERE rowid = ?', updates
+                )
+            rewritten += len(updates)
+
+
+def update_user_stats(conn, user_id, genre, word_count, sign=1):
+    """Apply one saved (sign=1) or deleted (sign=-1) story to the stats tables.
+
+    Runs on the caller's connection so it commits with the story write.
+    """
+    word_count = word_count or 0
+    conn.execute('''
+        INSERT INTO user_stats (user_id, total_stories, total_words) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_stories = total_stories + excluded.total_stories,
+            total_words = total_words + excluded.total_words
+    ''', (user_id, sign, sign * word_count))
+    conn.execute('''
+        INSERT INTO user_genre_stats (user_id, genre, story_count, total_words) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, genre) DO UPDATE SET
+            story_count = story_count + excluded.story_count,
+            total_words = total_words + excluded.total_words
+    ''', (user_id, genre or '', sign, sign * word_count))
+    if sign < 0:
+        conn.execute('DELETE FROM user_genre_stats WHERE user_id = ? AND story_count <= 0', (user_id,))
+
+
+def get_feed_version(conn, name='public'):
+    row = conn.execute('SELECT version FROM feed_version WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def rebuild_user_stats(conn):
+    """Recompute the stats tables from the stories table"""
+    conn.execute('DELETE FROM user_stats')
+    conn.execute('DELETE FROM user_genre_stats')
+    conn.execute('''
+        INSERT INTO user_stats (user_id, total_stories, total_words)
+        SELECT user_id, COUNT(*), COALESCE(SUM(word_count), 0)
+        FROM stories WHERE user_id IS NOT NULL GROUP BY user_id
+    ''')
+    conn.execute('''
+        INSERT INTO user_genre_stats (user_id, genre, story_count, total_words)
+        SELECT user_id, COALESCE(genre, ''), COUNT(*), COALESCE(SUM(word_count), 0)
+        FROM stories WHERE user_id IS NOT NULL GROUP BY user_id, COALESCE(genre, '')
+    ''')
+
+
+def rebuild_search_index(conn):
+    """Re-index every story from the stories table"""
+    conn.execute("INSERT INTO stories_fts (stories_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO stories_fts (stories_fts) VALUES ('optimize')")
+
+
+def init_db(path=None):
+    """Create the schema and apply any pending migrations, returning how many were applied
+
+    Each migration runs in its own IMMEDIATE transaction that re-reads
+    user_version first, so processes that start together apply it once
+    and the rest find the schema already current.
+    """
+    conn = connect(path)
+    applied = 0
+    try:
+        while True:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    break
+                migration = MIGRATIONS[version]
+                logger.info(f"Applying database migration {version + 1}: {migration.__name__}")
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+            applied += 1
+        if applied:
+            conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+    return applied
+
+
+def pending_migrations(path=None):
+    """Number of migrations the database has not had yet"""
+    conn = connect(path)
+    try:
+        return max(0, len(MIGRATIONS) - conn.execute('PRAGMA user_version').fetchone()[0])
+    finally:
+        conn.close()
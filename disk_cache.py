@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """Size-capped directory of files produced on a background thread pool.
+
+    Subclasses set suffix and failure, and implement _produce(*args) to
+    return the bytes stored under a key. Concurrent requests for the same
+    key share a single _produce call. Files are written atomically and the
+    directory is evicted least-recently-used first once over max_bytes.
+    """
+
+    suffix = '.bin'
+    # Start of the log message when _produce raises
+    failure = 'Error producing cached file'
+    # stats() key for the number of files being produced
+    inflight_stat = 'in_progress'
+
+    def __init__(self, directory, max_bytes, workers, thread_name_prefix):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f'{key}{self.suffix}')
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(self.suffix)]
+
+    def _lookup(self, key):
+        """Path of a cached file, counted as a hit, or None (not counted)"""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _miss(self, key, *args):
+        """Count a miss and return the future of the file being produced"""
+        with self._lock:
+            self.misses += 1
+        return self._submit(key, *args)
+
+    def _submit(self, key, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(self._fill, key, args)
+                self._inflight[key] = future
+        return future
+
+    def _produce(self, *args):
+        raise NotImplementedError
+
+    def _fill(self, key, args):
+        try:
+            path = self.path_for(key)
+            if os.path.exists(path):
+                return path
+            data = self._produce(*args)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._size += len(data)
+                over_budget = self._size > self.max_bytes
+            if over_budget:
+                self._evict()
+            return path
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.error(f"{self.failure}: {str(e)}")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        # Evict down to 90% so we don't rescan on every new file
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                self.inflight_stat: len(self._inflight)
+            }
@@ -0,0 +1,144 @@
+"""Deterministic local stand-in for the google-genai client.
+
+Implements the parts of ``genai.Client`` that StoryGenerator uses
+(``models.generate_content``, ``models.generate_content_stream`` and their
+``aio`` counterparts) so the app can be run and benchmarked offline.
+Select it with ``GEMINI_BACKEND=fake``.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+
+WORDS = (
+    "the", "old", "lantern", "flickered", "as", "she", "stepped", "into", "a", "quiet",
+    "hall", "where", "shadows", "whispered", "about", "forgotten", "kingdoms", "and",
+    "every", "door", "opened", "onto", "another", "memory", "of", "rain", "silver",
+    "river", "map", "stranger", "laughed", "softly", "before", "vanishing", "beyond",
+    "hills", "stars", "burned", "brighter", "than", "ever", "while", "he", "waited",
+)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiClient:
+    """Seeded text generator with configurable latency and fault injection"""
+
+    def __init__(self, seed=0, ttft=0.2, chunk_latency=0.05, chunk_words=8, default_words=300,
+                 error_rate=0.0, rate_limit_rate=0.0, stall_rate=0.0, stall_seconds=10.0):
+        self.seed = seed
+        self.ttft = ttft
+        self.chunk_latency = chunk_latency
+        self.chunk_words = chunk_words
+        self.default_words = default_words
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # Fraction of calls whose first chunk takes stall_seconds instead of ttft
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.calls = 0
+        # Faults come from their own seeded sequence so retries of the same prompt can succeed
+        self._fault_rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = _Models(self)
+        self.aio = _Aio(self)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            seed=int(os.environ.get('FAKE_GEMINI_SEED', 0)),
+            ttft=float(os.environ.get('FAKE_GEMINI_TTFT', 0.2)),
+            chunk_latency=float(os.environ.get('FAKE_GEMINI_CHUNK_LATENCY', 0.05)),
+            chunk_words=int(os.environ.get('FAKE_GEMINI_CHUNK_WORDS', 8)),
+            default_words=int(os.environ.get('FAKE_GEMINI_WORDS', 300)),
+            error_rate=float(os.environ.get('FAKE_GEMINI_ERROR_RATE', 0)),
+            rate_limit_rate=float(os.environ.get('FAKE_GEMINI_429_RATE', 0)),
+            stall_rate=float(os.environ.get('FAKE_GEMINI_STALL_RATE', 0)),
+            stall_seconds=float(os.environ.get('FAKE_GEMINI_STALL_SECONDS', 10)),
+        )
+
+    def _rng(self, contents, config):
+        temperature = getattr(config, 'temperature', None)
+        top_p = getattr(config, 'top_p', None)
+        raw = f"{self.seed}|{temperature}|{top_p}|{contents}".encode('utf-8')
+        return random.Random(int.from_bytes(hashlib.sha256(raw).digest()[:8], 'big'))
+
+    def _plan(self, contents, config):
+        """Pick the outcome, first-chunk delay and chunks for one call; text depends only on the inputs and seed"""
+        with self._lock:
+            self.calls += 1
+            roll = self._fault_rng.random()
+            stalled = self.stall_rate > 0 and self._fault_rng.random() < self.stall_rate
+        if roll < self.rate_limit_rate:
+            raise Exception("429 RESOURCE_EXHAUSTED: fake quota exceeded")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise Exception("500 INTERNAL: fake upstream error")
+
+        rng = self._rng(contents, config)
+        match = re.search(r'roughly (\d+) words', contents)
+        num_words = int(match.group(1)) if match else self.default_words
+        words = [rng.choice(WORDS) for _ in range(num_words)]
+        words[0] = words[0].capitalize()
+        chunks = []
+        for start in range(0, num_words, self.chunk_words):
+            piece = ' '.join(words[start:start + self.chunk_words])
+            chunks.append(piece if start == 0 else ' ' + piece)
+        chunks[-1] += '.'
+        return chunks, self.stall_seconds if stalled else self.ttft
+
+    def generate_content(self, model, contents, config=None):
+        chunks, ttft = self._plan(contents, config)
+        time.sleep(ttft + self.chunk_latency * (len(chunks) - 1))
+        return FakeResponse(''.join(chunks))
+
+    def generate_content_stream(self, model, contents, config=None):
+        chunks, ttft = self._plan(contents, config)
+
+        def stream():
+            time.sleep(ttft)
+            for index, chunk in enumerate(chunks):
+                if index:
+                    time.sleep(self.chunk_latency)
+                yield FakeResponse(chunk)
+        return stream()
+
+    async def generate_content_stream_async(self, model, contents, config=None):
+        chunks, ttft = self._plan(contents, config)
+
+        async def stream():
+            await asyncio.sleep(ttft)
+            for index, chunk in enumerate(chunks):
+                if index:
+                    await asyncio.sleep(self.chunk_latency)
+                yield FakeResponse(chunk)
+        return stream()
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        return self._client.generate_content(model, contents, config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        return self._client.generate_content_stream(model, contents, config)
+
+
+class _AioModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content_stream(self, model, contents, config=None):
+        return await self._client.generate_content_stream_async(model, contents, config)
+
+
+class _Aio:
+    def __init__(self, client):
+        self.models = _AioModels(client)
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class FeedCache:
+    """Serialized pages of a feed, reused until the feed's version changes.
+
+    The version is read from the database at most once per ttl seconds, so
+    changes made by other workers show up within ttl. invalidate() makes
+    the next request re-check immediately after a local change. Each page
+    is stored as the response body together with its strong ETag.
+    """
+
+    def __init__(self, ttl=1.0, max_pages=64):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_etag(body):
+        return hashlib.sha256(body).hexdigest()[:32]
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+
+    def get(self, key, load_version, build):
+        """Return (body, etag) for key, calling build() to produce the body on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            stale = now - self._checked_at >= self.ttl
+        if stale:
+            version = load_version()
+            with self._lock:
+                if version != self._version:
+                    self._pages.clear()
+                    self._version = version
+                self._checked_at = now
+
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version = self._version
+
+        body = build()
+        entry = (body, self.make_etag(body))
+        with self._lock:
+            # Don't store a page built against a version that has since been replaced
+            if version == self._version:
+                self._pages[key] = entry
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'pages': len(self._pages),
+                'version': self._version
+            }
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class JobNotFound(KeyError):
+    pass
+
+
+class JobQueue:
+    """Background jobs stored in SQLite and run by separate worker processes.
+
+    Workers claim the highest-priority ready job by taking a lease on it for
+    visibility_timeout seconds, and extend() the lease while the job runs.
+    A job whose worker crashes is claimed again once the lease runs out; a
+    worker that finishes after losing its lease cannot overwrite the new
+    attempt. Rate-limited jobs are retried with
+    exponential backoff up to max_attempts, and finished jobs are kept for
+    result_ttl seconds.
+    """
+
+    def __init__(self, pool, visibility_timeout=300, result_ttl=3600, max_attempts=5,
+                 backoff=5.0, max_backoff=300.0, max_pending=20):
+        self.pool = pool
+        self.visibility_timeout = visibility_timeout
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Most unfinished jobs one user or client may have queued at once
+        self.max_pending = max_pending
+
+    def submit(self, kind, payload, user_id=None, client_key=None, priority=0):
+        """Queue a job and return its id; raises OverflowError if the caller has too many pending"""
+        job_id = str(uuid.uuid4())
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                # Take the write lock first so concurrent submits can't both pass the limit
+                conn.execute('BEGIN IMMEDIATE')
+                pending = conn.execute('''
+                    SELECT COUNT(*) FROM jobs WHERE client_key = ? AND status IN ('queued', 'running')
+                ''', (client_key,)).fetchone()[0]
+                if pending >= self.max_pending:
+                    raise OverflowError(f'You already have {pending} jobs waiting; please wait for some to finish')
+                now = time.time()
+                conn.execute('''
+                    INSERT INTO jobs (id, kind, payload, user_id, client_key, priority, run_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (job_id, kind, json.dumps(payload), user_id, client_key, priority, now, now))
+        finally:
+            self.pool.release(conn)
+        return job_id
+
+    def get(self, job_id, user_id=None):
+        """Return a job as a dict.
+
+        Raises JobNotFound for unknown or expired jobs and PermissionError for
+        another user's. Jobs submitted anonymously are only protected by their
+        unguessable id.
+        """
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute('''
+                SELECT id, kind, user_id, priority, status, attempts, run_at, result, error, created_at, finished_at
+                FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        finally:
+            self.pool.release(conn)
+        if row is None or (row['finished_at'] and row['finished_at'] < time.time() - self.result_ttl):
+            raise JobNotFound(job_id)
+        if row['user_id'] is not None and row['user_id'] != user_id:
+            raise PermissionError('Unauthorized to access this job')
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def claim(self, worker_id, kinds=None):
+        """Lease the next ready job to worker_id, or return None if there is none"""
+        now = time.time()
+        kind_filter = ''
+        kind_params = []
+        if kinds:
+            kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})"
+            kind_params = list(kinds)
+        conn = self.pool.acquire()
+        try:
+            # Idle workers poll often, so check with a plain read before taking the write lock
+            ready = conn.execute(f'''
+                SELECT 1 FROM jobs
+                WHERE (status = 'queued' AND run_at <= ? {kind_filter}) OR (status = 'running' AND lease_until < ?)
+                LIMIT 1
+            ''', [now] + kind_params + [now]).fetchone()
+            if ready is None:
+                return None
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                # Jobs whose worker stopped renewing its lease go back on the queue, or fail once out of attempts
+                conn.execute('''
+                    UPDATE jobs SET
+                        status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                        error = CASE WHEN attempts >= ? THEN 'The worker running this job stopped responding' END,
+                        finished_at = CASE WHEN attempts >= ? THEN ? END,
+                        worker = NULL, lease_until = NULL
+                    WHERE status = 'running' AND lease_until < ?
+                ''', (self.max_attempts, self.max_attempts, self.max_attempts, now, now))
+                row = conn.execute(f'''
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?
+                    WHERE id = (
+                        SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ? {kind_filter}
+                        ORDER BY priority DESC, run_at LIMIT 1
+                    )
+                    RETURNING id, kind, payload, user_id, client_key, attempts
+                ''', [worker_id, now + self.visibility_timeout, now] + kind_params).fetchone()
+        finally:
+            self.pool.release(conn)
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['worker'] = worker_id
+        return job
+
+    def extend(self, job):
+        """Renew a running job's lease; returns False if it had already passed to another worker"""
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    UPDATE jobs SET lease_until = ?
+                    WHERE id = ? AND worker = ? AND status = 'running'
+                ''', (time.time() + self.visibility_timeout, job['id'], job['worker']))
+        finally:
+            self.pool.release(conn)
+        return cursor.rowcount > 0
+
+    def complete(self, job, result):
+        """Store a job's result; returns False if the job's lease had already passed to another worker"""
+        return self._finish(job, "status = 'done', result = ?, error = NULL", [json.dumps(result)])
+
+    def fail(self, job, error, retry=False):
+        """Record a failed attempt, scheduling a retry with backoff if allowed and attempts remain"""
+        if retry and job['attempts'] < self.max_attempts:
+            delay = min(self.max_backoff, self.backoff * 2 ** (job['attempts'] - 1))
+            # Jitter keeps jobs that were rate limited together from retrying together
+            delay *= random.uniform(0.5, 1.0)
+            return self._finish(job, "status = 'queued', run_at = ?, error = ?, worker = NULL, lease_until = NULL",
+                                [time.time() + delay, error], finished=False)
+        return self._finish(job, "status = 'failed', error = ?", [error])
+
+    def _finish(self, job, assignments, params, finished=True):
+        if finished:
+            assignments += ', finished_at = ?, lease_until = NULL'
+            params = params + [time.time()]
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                cursor = conn.execute(f'''
+                    UPDATE jobs SET {assignments}
+                    WHERE id = ? AND worker = ? AND status = 'running'
+                ''', params + [job['id'], job['worker']])
+        finally:
+            self.pool.release(conn)
+        if cursor.rowcount == 0:
+            logger.warning(f"Job {job['id']} was reclaimed before {job['worker']} finished it")
+        return cursor.rowcount > 0
+
+    def purge(self):
+        """Delete finished jobs older than result_ttl"""
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                return conn.execute('DELETE FROM jobs WHERE finished_at < ?',
+                                    (time.time() - self.result_ttl,)).rowcount
+        finally:
+            self.pool.release(conn)
+
+    def stats(self):
+        conn = self.pool.acquire()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            # Jobs waiting out a retry backoff are not late, so only ready ones count
+            oldest = conn.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?",
+                                  (time.time(),)).fetchone()[0]
+        finally:
+            self.pool.release(conn)
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_queued_seconds': round(max(0.0, time.time() - oldest), 1) if oldest else 0.0
+        }
+
+
+class JobWorker:
+    """Runs jobs from a JobQueue on a few threads until stopped.
+
+    handlers maps a job kind to handler(payload, user_key) -> result dict.
+    A handler that raises Exception('RATE_LIMIT') is retried with backoff;
+    any other exception fails the job. Leases of running jobs are renewed
+    every third of the visibility timeout, so a handler may take longer
+    than the timeout as long as this process stays alive.
+    """
+
+    def __init__(self, queue, handlers, threads=4, poll_interval=0.5, purge_interval=60):
+        self.queue = queue
+        self.handlers = handlers
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._lock = threading.Lock()
+        self._running = {}
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def run(self, stop):
+        """Work until the stop event is set, then let running jobs finish"""
+        workers = [
+            threading.Thread(target=self._loop, args=(stop, f'{self.worker_id}:{index}'), name=f'job-{index}')
+            for index in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        last_purge = 0.0
+        last_renewal = time.monotonic()
+        # After a stop, keep renewing leases until the running jobs have finished
+        while any(thread.is_alive() for thread in workers):
+            time.sleep(1.0)
+            if time.monotonic() - last_renewal >= self.queue.visibility_timeout / 3:
+                last_renewal = time.monotonic()
+                self._renew_leases()
+            if not stop.is_set() and time.monotonic() - last_purge >= self.purge_interval:
+                last_purge = time.monotonic()
+                try:
+                    self.queue.purge()
+                except Exception as e:
+                    logger.error(f"Error purging old jobs: {str(e)}")
+
+    def _renew_leases(self):
+        with self._lock:
+            jobs = list(self._running.values())
+        for job in jobs:
+            try:
+                if not self.queue.extend(job):
+                    logger.warning(f"Job {job['id']} was reclaimed while {job['worker']} was running it")
+            except Exception as e:
+                logger.error(f"Error renewing the lease of job {job['id']}: {str(e)}")
+
+    def _loop(self, stop, worker_id):
+        kinds = list(self.handlers)
+        while not stop.is_set():
+            try:
+                job = self.queue.claim(worker_id, kinds)
+            except Exception as e:
+                logger.error(f"Error claiming a job: {str(e)}")
+                job = None
+            if job is None:
+                stop.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        with self._lock:
+            self._running[job['id']] = job
+        try:
+            result = self.handlers[job['kind']](job['payload'], job['client_key'])
+        except Exception as e:
+            retry = str(e) == 'RATE_LIMIT'
+            if not retry:
+                logger.error(f"Job {job['id']} ({job['kind']}) failed: {str(e)}")
+            self._release(job)
+            self.queue.fail(job, str(e), retry=retry)
+            with self._lock:
+                if retry and job['attempts'] < self.queue.max_attempts:
+                    self.retried += 1
+                else:
+                    self.failed += 1
+            return
+        self._release(job)
+        self.queue.complete(job, result)
+        with self._lock:
+            self.completed += 1
+
+    def _release(self, job):
+        with self._lock:
+            self._running.pop(job['id'], None)
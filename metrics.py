@@ -0,0 +1,248 @@
+"""In-process metrics exported in the Prometheus text format.
+
+Counters and histograms are kept per process, so with several workers each
+one reports its own series (scrape them individually or aggregate by
+instance). Collectors registered with add_collector are called at scrape
+time to export state that other components already track.
+"""
+import threading
+import time
+
+# Seconds; wide enough to cover both a cached list query and a slow Gemini stream
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names"""
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts plus sum and count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, ('le', _format_value(bound)))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, key, ('le', '+Inf'))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labels, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning [(name, type, help, [(labels_dict, value), ...]), ...]"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, description, samples in collector():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    names = tuple(labels)
+                    rendered = _format_labels(names, tuple(labels[n] for n in names))
+                    lines.append(f'{name}{rendered} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+GEMINI_LATENCY = REGISTRY.register(Histogram(
+    'storygen_gemini_call_seconds', 'Duration of upstream Gemini calls, from request to last chunk',
+    labels=('endpoint', 'model', 'outcome')
+))
+GEMINI_TTFT = REGISTRY.register(Histogram(
+    'storygen_gemini_ttft_seconds', 'Time from sending a Gemini request to its first text chunk',
+    labels=('endpoint', 'model')
+))
+GEMINI_CHUNKS = REGISTRY.register(Histogram(
+    'storygen_gemini_chunks', 'Text chunks received per Gemini call',
+    labels=('endpoint', 'model'), buckets=COUNT_BUCKETS
+))
+GEMINI_BYTES = REGISTRY.register(Histogram(
+    'storygen_gemini_response_bytes', 'UTF-8 bytes of text received per Gemini call',
+    labels=('endpoint', 'model'), buckets=BYTES_BUCKETS
+))
+GEMINI_CACHE_HITS = REGISTRY.register(Counter(
+    'storygen_gemini_cache_hits_total', 'Gemini calls answered from the response cache',
+    labels=('endpoint',)
+))
+RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    'storygen_rate_limit_wait_seconds', 'Time spent queued for a rate limit slot before a Gemini call',
+    labels=('endpoint',)
+))
+RATE_LIMIT_EVENTS = REGISTRY.register(Counter(
+    'storygen_rate_limit_events_total', 'Upstream 429s, retries and calls failed with RATE_LIMIT',
+    labels=('endpoint', 'event')
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'storygen_db_query_seconds', 'Duration of SQLite helper functions',
+    labels=('helper',)
+))
+DB_WRITE_BATCH_SIZE = REGISTRY.register(Histogram(
+    'storygen_db_write_batch_size', 'Stories committed per write-behind transaction',
+    buckets=COUNT_BUCKETS
+))
+PDF_RENDER_SECONDS = REGISTRY.register(Histogram(
+    'storygen_pdf_render_seconds', 'Time to render a story PDF'
+))
+STREAM_SECONDS = REGISTRY.register(Histogram(
+    'storygen_sse_stream_seconds', 'Duration of SSE responses from first to last frame',
+    labels=('endpoint',)
+))
+STREAM_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'storygen_sse_write_seconds', 'Time per SSE response spent handing frames to the server',
+    labels=('endpoint',)
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    'storygen_http_request_seconds', 'Time to produce response headers, by Flask endpoint',
+    labels=('endpoint', 'method', 'status')
+))
+
+
+class GeminiCall:
+    """Records latency, TTFT, chunk count and bytes for one upstream call"""
+
+    def __init__(self, endpoint, model):
+        self.endpoint = endpoint
+        self.model = model
+        self.start = time.perf_counter()
+        self.chunks = 0
+        self.bytes = 0
+        self.finished = False
+
+    def chunk(self, text):
+        if not text:
+            return
+        if self.chunks == 0:
+            GEMINI_TTFT.observe(time.perf_counter() - self.start, endpoint=self.endpoint, model=self.model)
+        self.chunks += 1
+        self.bytes += len(text.encode('utf-8'))
+
+    def finish(self, outcome):
+        if self.finished:
+            return
+        self.finished = True
+        GEMINI_LATENCY.observe(time.perf_counter() - self.start, endpoint=self.endpoint,
+                               model=self.model, outcome=outcome)
+        if outcome == 'ok':
+            GEMINI_CHUNKS.observe(self.chunks, endpoint=self.endpoint, model=self.model)
+            GEMINI_BYTES.observe(self.bytes, endpoint=self.endpoint, model=self.model)
+
+
+def timed_stream(endpoint, frames):
+    """Wrap a WSGI SSE generator to record stream duration and write time.
+
+    Under WSGI the server writes each frame before asking for the next one,
+    so the time spent suspended at a yield is the time taken to write it.
+    """
+    start = time.perf_counter()
+    writing = 0.0
+    try:
+        for frame in frames:
+            yielded = time.perf_counter()
+            yield frame
+            writing += time.perf_counter() - yielded
+    finally:
+        STREAM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        STREAM_WRITE_SECONDS.observe(writing, endpoint=endpoint)
@@ -0,0 +1,465 @@
+"""Model fallback chain, circuit breakers and hedged streaming for Gemini calls.
+
+GEMINI_MODELS lists the models to use in order of preference, each with its
+own timeout. A model whose breaker is open is skipped until its reset
+timeout has passed. For streams, a backup request is started when the first
+chunk is later than the hedge threshold; whichever attempt streams first is
+kept and the other is cancelled.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import GeminiCall
+
+logger = logging.getLogger(__name__)
+
+# Never hedge sooner than this, however fast the observed TTFT
+HEDGE_MIN_DELAY = 1.0
+# TTFT samples needed before a percentile threshold is trusted
+HEDGE_MIN_SAMPLES = 20
+# Longest a sync stream waits for an event before checking whether its caller gave up
+CANCEL_CHECK_INTERVAL = 1.0
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class StreamCancelled(Exception):
+    pass
+
+
+def parse_model_chain(spec, default_model, default_timeout):
+    """Parse "model[:timeout],model[:timeout]" into [(model, timeout)]"""
+    chain = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, timeout = item.partition(':')
+        chain.append((name.strip(), float(timeout) if timeout else default_timeout))
+    return chain or [(default_model, default_timeout)]
+
+
+class CircuitBreaker:
+    """Skips a model after repeated failures.
+
+    After failure_threshold consecutive failures the breaker opens and the
+    model is skipped for reset_timeout seconds. Then a single trial call is
+    let through (half-open); its outcome closes the breaker or opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.opened = 0
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def release(self):
+        """Forget a half-open trial whose outcome says nothing about the model"""
+        with self._lock:
+            self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+
+class ModelRoute:
+    """One entry of the fallback chain with its timeout, breaker and recent TTFTs"""
+
+    def __init__(self, name, timeout, breaker):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker
+        self._ttfts = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def observe_ttft(self, seconds):
+        with self._lock:
+            self._ttfts.append(seconds)
+
+    def ttft_quantile(self, q):
+        with self._lock:
+            samples = sorted(self._ttfts)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class _Attempt:
+    def __init__(self, route, endpoint):
+        self.route = route
+        self.call = GeminiCall(endpoint, route.name)
+        self.started = time.monotonic()
+        self.last_chunk = None
+        self.cancelled = threading.Event()
+        self.task = None
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class _Race:
+    """State of one hedged, fallback-capable call, driven by a sync or async event loop.
+
+    launch(route) starts an attempt whose reader reports (attempt, kind, value)
+    events, kind being 'chunk', 'done' or 'error'.
+    """
+
+    def __init__(self, router, launch, is_rate_limit, can_hedge):
+        self.router = router
+        self._launch = launch
+        self.is_rate_limit = is_rate_limit
+        self.can_hedge = can_hedge
+        self.candidates = router.candidates()
+        self.attempts = []
+        self.winner = None
+        self.hedged = False
+        self.done = False
+        self.launch(router.next_route(self.candidates))
+        delay = router.hedge_delay(self.attempts[0].route)
+        self.hedge_at = self.attempts[0].started + delay if delay is not None else None
+
+    def launch(self, route):
+        self.attempts.append(self._launch(route))
+
+    def timeout(self):
+        """Seconds until the next timeout or hedge is due"""
+        if self.winner is not None:
+            deadline = self.winner.last_chunk + self.winner.route.timeout
+        else:
+            deadlines = [attempt.started + attempt.route.timeout for attempt in self.attempts]
+            if self.hedge_at is not None:
+                deadlines.append(self.hedge_at)
+            deadline = min(deadlines)
+        return max(deadline - time.monotonic(), 0.0)
+
+    def hedge_due(self):
+        """Whether expire() would now ask can_hedge() about a backup request"""
+        return self.hedge_at is not None and bool(self.attempts) and time.monotonic() >= self.hedge_at
+
+    def expire(self, hedge_allowed=None):
+        """Handle a wait that ended without an event; hedge_allowed, if given, replaces can_hedge()"""
+        now = time.monotonic()
+        if self.winner is not None:
+            winner = self.winner
+            # Stop its reader; a stalled stream would otherwise hold a thread and a connection
+            winner.cancel()
+            self.attempts.remove(winner)
+            self.router.finish(winner, 'timeout')
+            raise TimeoutError(f"{winner.route.name} stopped streaming for {winner.route.timeout:.0f}s")
+        for attempt in [a for a in self.attempts if now >= a.started + a.route.timeout]:
+            logger.warning(f"Gemini model {attempt.route.name} sent nothing in {attempt.route.timeout:.0f}s")
+            attempt.cancel()
+            self.attempts.remove(attempt)
+            self.router.finish(attempt, 'timeout')
+        if self.hedge_at is not None and now >= self.hedge_at:
+            self.hedge_at = None
+            if hedge_allowed is None:
+                hedge_allowed = self.can_hedge is None or self.can_hedge()
+            if self.attempts and hedge_allowed:
+                self.hedged = True
+                self.router.count('hedges')
+                # Prefer the next healthy model; hedge on the same one if it is the only one left
+                self.launch(next(self.candidates, None) or self.attempts[0].route)
+        if not self.attempts:
+            route = next(self.candidates, None)
+            if route is None:
+                raise TimeoutError("No Gemini model responded within its timeout")
+            self.router.count('fallbacks')
+            self.launch(route)
+
+    def handle(self, attempt, kind, value):
+        """Apply one event; returns text to pass on, if any"""
+        if attempt not in self.attempts:
+            # Leftover from a cancelled attempt
+            return None
+        if kind == 'chunk':
+            if self.winner is None:
+                self.winner = attempt
+                self.hedge_at = None
+                attempt.route.observe_ttft(time.monotonic() - attempt.started)
+                if attempt is not self.attempts[0]:
+                    self.router.count('hedges_won')
+                for other in self.attempts:
+                    if other is not attempt:
+                        other.cancel()
+                        other.call.finish('hedge_lost')
+                self.attempts = [attempt]
+            attempt.last_chunk = time.monotonic()
+            attempt.call.chunk(value)
+            return value
+
+        self.attempts.remove(attempt)
+        if kind == 'done':
+            self.router.finish(attempt, 'ok')
+            # A complete answer (even an empty one) ends the race
+            self.done = True
+            return None
+
+        rate_limited = self.is_rate_limit(value)
+        self.router.finish(attempt, 'rate_limited' if rate_limited else 'error')
+        if attempt is self.winner or (rate_limited and not self.attempts):
+            # Text already went out, or the quota is exhausted; let the caller's retry logic decide
+            raise value
+        if not self.attempts:
+            logger.warning(f"Gemini model {attempt.route.name} failed, trying the next one: {str(value)}")
+            route = next(self.candidates, None)
+            if route is None:
+                raise value
+            self.router.count('fallbacks')
+            self.launch(route)
+        return None
+
+    def close(self):
+        for attempt in self.attempts:
+            attempt.cancel()
+            attempt.call.finish('cancelled')
+        self.attempts = []
+
+
+class ModelRouter:
+    def __init__(self, models, hedge='p95', failure_threshold=5, reset_timeout=30.0):
+        self.routes = [
+            ModelRoute(name, timeout, CircuitBreaker(failure_threshold, reset_timeout))
+            for name, timeout in models
+        ]
+        # 'off', a percentile such as 'p95', or a fixed number of seconds
+        self.hedge = hedge
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedges_won = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls, env, default_model):
+        return cls(
+            parse_model_chain(env.get('GEMINI_MODELS'), default_model, float(env.get('GEMINI_TIMEOUT', 60))),
+            hedge=env.get('GEMINI_HEDGE_TTFT', 'p95'),
+            failure_threshold=int(env.get('GEMINI_BREAKER_FAILURES', 5)),
+            reset_timeout=float(env.get('GEMINI_BREAKER_RESET', 30))
+        )
+
+    @property
+    def primary(self):
+        return self.routes[0].name
+
+    def candidates(self):
+        """Routes whose breaker lets a call through, in order; checked lazily as they are tried"""
+        for route in self.routes:
+            if route.breaker.allow():
+                yield route
+
+    def hedge_delay(self, route):
+        """Seconds to wait for the first chunk before hedging, or None to not hedge"""
+        if self.hedge in ('', 'off', '0'):
+            return None
+        if self.hedge.startswith('p'):
+            delay = route.ttft_quantile(float(self.hedge[1:]) / 100)
+            return max(delay, HEDGE_MIN_DELAY) if delay is not None else None
+        return max(float(self.hedge), HEDGE_MIN_DELAY)
+
+    def next_route(self, candidates):
+        route = next(candidates, None)
+        if route is None:
+            raise ModelUnavailable("All Gemini models are failing; please try again shortly")
+        return route
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def finish(self, attempt, outcome):
+        self.record(attempt.route, attempt.call, outcome)
+
+    def record(self, route, call, outcome):
+        """Record a call's outcome in its metrics and its model's breaker"""
+        call.finish(outcome)
+        if outcome == 'ok':
+            route.breaker.record_success()
+        elif outcome in ('error', 'timeout'):
+            route.breaker.record_failure()
+        else:
+            # A 429 says nothing about the model's health; just release a half-open trial
+            route.breaker.release()
+
+    def call(self, send, endpoint, is_rate_limit):
+        """Return send(model, timeout) from the first model in the chain that succeeds.
+
+        Rate limit errors are raised straight away for the caller's retry logic.
+        """
+        candidates = self.candidates()
+        route = self.next_route(candidates)
+        while True:
+            call = GeminiCall(endpoint, route.name)
+            try:
+                text = send(route.name, route.timeout)
+            except Exception as e:
+                rate_limited = is_rate_limit(e)
+                self.record(route, call, 'rate_limited' if rate_limited else 'error')
+                fallback = None if rate_limited else next(candidates, None)
+                if fallback is None:
+                    raise
+                logger.warning(f"Gemini model {route.name} failed, trying {fallback.name}: {str(e)}")
+                self.count('fallbacks')
+                route = fallback
+                continue
+            call.chunk(text)
+            self.record(route, call, 'ok')
+            return text
+
+    def stream(self, open_stream, endpoint, is_rate_limit, can_hedge=None, cancelled=None):
+        """Yield text chunks from the first model attempt to stream.
+
+        open_stream(model, timeout) returns an iterator of text chunks and is
+        read on its own thread per attempt, so a stalled connection can be
+        abandoned. Falls back to the next model when an attempt fails or
+        times out before its first chunk; once text has been yielded, errors
+        propagate. can_hedge() is asked before starting a backup request.
+        Setting the cancelled event stops the call with StreamCancelled even
+        while the model is silent.
+        """
+        events = queue.Queue()
+
+        def launch(route):
+            attempt = _Attempt(route, endpoint)
+            threading.Thread(target=self._pump, args=(attempt, open_stream, events), daemon=True,
+                             name=f'gemini-{route.name}').start()
+            return attempt
+
+        race = _Race(self, launch, is_rate_limit, can_hedge)
+        try:
+            while not race.done:
+                try:
+                    event = events.get(timeout=min(race.timeout(), CANCEL_CHECK_INTERVAL))
+                except queue.Empty:
+                    if cancelled is not None and cancelled.is_set():
+                        raise StreamCancelled("The caller stopped waiting for this stream")
+                    if race.timeout() <= 0:
+                        race.expire()
+                    continue
+                text = race.handle(*event)
+                if text:
+                    yield text
+        finally:
+            race.close()
+
+    @staticmethod
+    def _pump(attempt, open_stream, events):
+        stream = None
+        try:
+            stream = open_stream(attempt.route.name, attempt.route.timeout)
+            for text in stream:
+                if attempt.cancelled.is_set():
+                    return
+                if text:
+                    events.put((attempt, 'chunk', text))
+            events.put((attempt, 'done', None))
+        except Exception as e:
+            if not attempt.cancelled.is_set():
+                events.put((attempt, 'error', e))
+        finally:
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+
+    async def astream(self, open_stream, endpoint, is_rate_limit, can_hedge=None):
+        """Async counterpart of stream(); open_stream(model, timeout) and can_hedge() are awaited"""
+        events = asyncio.Queue()
+
+        def launch(route):
+            attempt = _Attempt(route, endpoint)
+            attempt.task = asyncio.ensure_future(self._apump(attempt, open_stream, events))
+            return attempt
+
+        race = _Race(self, launch, is_rate_limit, can_hedge)
+        try:
+            while not race.done:
+                try:
+                    event = await asyncio.wait_for(events.get(), race.timeout())
+                except asyncio.TimeoutError:
+                    hedge_allowed = None
+                    if race.hedge_due():
+                        hedge_allowed = can_hedge is None or await can_hedge()
+                    race.expire(hedge_allowed)
+                    continue
+                text = race.handle(*event)
+                if text:
+                    yield text
+        finally:
+            race.close()
+
+    @staticmethod
+    async def _apump(attempt, open_stream, events):
+        stream = None
+        try:
+            stream = await open_stream(attempt.route.name, attempt.route.timeout)
+            async for text in stream:
+                if text:
+                    events.put_nowait((attempt, 'chunk', text))
+            events.put_nowait((attempt, 'done', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            events.put_nowait((attempt, 'error', e))
+        finally:
+            if stream is not None and hasattr(stream, 'aclose'):
+                await stream.aclose()
+
+    def stats(self):
+        with self._lock:
+            counters = {'hedges': self.hedges, 'hedges_won': self.hedges_won, 'fallbacks': self.fallbacks}
+        counters['models'] = [
+            {
+                'model': route.name,
+                'timeout': route.timeout,
+                'breaker': route.breaker.state,
+                'breaker_opened': route.breaker.opened,
+                'hedge_after': self.hedge_delay(route)
+            }
+            for route in self.routes
+        ]
+        return counters
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import logging
+import os
+from xml.sax.saxutils import escape
+
+from disk_cache import DiskCache
+from metrics import PDF_RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever render_story_pdf output changes so cached files are not reused
+TEMPLATE_VERSION = '1'
+
+_styles = None
+
+
+def get_styles():
+    """Build the ReportLab stylesheet once per process"""
+    global _styles
+    if _styles is None:
+        from reportlab.lib.styles import getSampleStyleSheet
+        _styles = getSampleStyleSheet()
+    return _styles
+
+
+def render_story_pdf(title, story_text):
+    """Render a story as PDF bytes"""
+    # ReportLab is slow to import, so workers load it with the first PDF they render
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = get_styles()
+    story_elements = []
+
+    # Title
+    safe_title = escape(title or '')
+    story_elements.append(Paragraph(f"<b>{safe_title}</b>", styles['Title']))
+    story_elements.append(Spacer(1, 12))
+
+    # Story content
+    for para in story_text.split('\n\n'):
+        if para.strip():
+            story_elements.append(Paragraph(escape(para), styles['Normal']))
+            story_elements.append(Spacer(1, 6))
+
+    doc.build(story_elements)
+    return buffer.getvalue()
+
+
+class PDFCache(DiskCache):
+    """Content-addressed on-disk cache of rendered story PDFs.
+
+    Files are named by a hash of the template version, title and story text,
+    so edits produce a new file and unchanged stories are never re-rendered.
+    """
+
+    suffix = '.pdf'
+    failure = 'Error rendering PDF'
+    inflight_stat = 'rendering'
+
+    def __init__(self, directory='pdf_cache', max_bytes=200 * 1024 * 1024, workers=2):
+        super().__init__(directory, max_bytes, workers, 'pdf')
+
+    @staticmethod
+    def make_key(title, story_text):
+        digest = hashlib.sha256()
+        for part in (TEMPLATE_VERSION, title or '', story_text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get_or_render(self, title, story_text):
+        """Return (key, path) of the cached PDF, rendering it now if needed"""
+        key = self.make_key(title, story_text)
+        path = self._lookup(key)
+        if path is None:
+            path = self._miss(key, title, story_text).result()
+        return key, path
+
+    def prerender(self, title, story_text):
+        """Render in the background so the first download is a file send"""
+        key = self.make_key(title, story_text)
+        if not os.path.exists(self.path_for(key)):
+            self._submit(key, title, story_text)
+        return key
+
+    def _produce(self, title, story_text):
+        with PDF_RENDER_SECONDS.time():
+            return render_story_pdf(title, story_text)
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Two-tier cache for Gemini responses.
+
+    The first tier is a bounded in-process LRU. The optional second tier is a
+    SQLite table (in stories.db or a sidecar file) shared by every worker that
+    points at the same path. Both tiers honour the same TTL.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, db_path=None, db_max_entries=5000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.db_path:
+            self._init_db()
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=5))
+
+    def _init_db(self):
+        with self._connect() as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache (accessed_at)')
+
+    @staticmethod
+    def make_key(prompt, model_name, temperature, top_p):
+        """Build a cache key from everything that influences the upstream output"""
+        raw = json.dumps([model_name, prompt, float(temperature), float(top_p)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+
+        row = self._db_get(key, now) if self.db_path else None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Keep the original creation time so the entry expires when the persistent copy does
+            value, created_at = row
+            self._store(key, value, created_at)
+        return value
+
+    def set(self, key, value):
+        """Store value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+        if self.db_path:
+            self._db_set(key, value, now)
+
+    async def get_async(self, key):
+        """Async variant of get() that reads the SQLite tier on a thread"""
+        if self.db_path:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def set_async(self, key, value):
+        """Async variant of set() that writes the SQLite tier on a thread"""
+        if self.db_path:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def _store(self, key, value, created_at):
+        self._entries[key] = (value, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, key, now):
+        """Return (value, created_at) from the persistent tier, or None"""
+        try:
+            with self._connect() as conn, conn:
+                row = conn.execute(
+                    'SELECT value, created_at FROM response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                    with self._lock:
+                        self.evictions += 1
+                    return None
+                conn.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key))
+                return row[0], row[1]
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {str(e)}")
+            return None
+
+    def _db_set(self, key, value, now):
+        try:
+            with self._connect() as conn, conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    (key, value, now, now)
+                )
+                cursor = conn.execute('''
+                    DELETE FROM response_cache WHERE created_at < ? OR key IN (
+                        SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (now - self.ttl, self.db_max_entries))
+                if cursor.rowcount > 0:
+                    with self._lock:
+                        self.evictions += cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write failed: {str(e)}")
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            with self._connect() as conn, conn:
+                conn.execute('DELETE FROM response_cache')
+
+    def stats(self):
+        """Get hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'persistent': bool(self.db_path)
+            }
+
+
+def replay_chunks(text, chunk_size=64):
+    """Split a cached response into stream-sized pieces on whitespace boundaries"""
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            if space > start:
+                end = space + 1
+        yield text[start:end]
+        start = end
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Yielded to callers that want to show progress while a call is queued
+QueueStatus = namedtuple('QueueStatus', ['position', 'eta'])
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class MemoryBuckets:
+    """Request and token buckets held in this process"""
+
+    # try_consume() never blocks, so async callers can run it on the event loop
+    blocking = False
+
+    def __init__(self, rpm, tpm):
+        self._lock = threading.Lock()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def try_consume(self, tokens):
+        """Consume one request and tokens if available; otherwise return seconds to wait"""
+        with self._lock:
+            return self._consume(tokens)
+
+    def _consume(self, tokens):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60.0)
+            # A single call bigger than the whole budget would never fit
+            tokens = min(tokens, self.tpm)
+
+        wait = 0.0
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60.0 / self.rpm)
+        if self.tpm and self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) * 60.0 / self.tpm)
+        if wait > 0:
+            return wait
+
+        if self.rpm:
+            self.requests -= 1
+        if self.tpm:
+            self.tokens -= tokens
+        return 0.0
+
+    def block(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class SQLiteBuckets:
+    """Request and token buckets shared by every worker using the same database"""
+
+    # try_consume() runs a write transaction that can wait on other processes
+    blocking = True
+
+    def __init__(self, rpm, tpm, db_path):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.db_path = db_path
+        with self._connect() as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_state (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute(
+                'INSERT OR IGNORE INTO rate_limit_state (name, requests, tokens, updated_at) VALUES (?, ?, ?, ?)',
+                ('gemini', float(rpm), float(tpm), time.time())
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        return closing(conn)
+
+    def try_consume(self, tokens):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                requests_left, tokens_left, updated_at, blocked_until = conn.execute(
+                    'SELECT requests, tokens, updated_at, blocked_until FROM rate_limit_state WHERE name = ?',
+                    ('gemini',)
+                ).fetchone()
+                if now < blocked_until:
+                    return blocked_until - now
+
+                elapsed = max(0.0, now - updated_at)
+                if self.rpm:
+                    requests_left = min(self.rpm, requests_left + elapsed * self.rpm / 60.0)
+                if self.tpm:
+                    tokens_left = min(self.tpm, tokens_left + elapsed * self.tpm / 60.0)
+                    tokens = min(tokens, self.tpm)
+
+                wait = 0.0
+                if self.rpm and requests_left < 1:
+                    wait = max(wait, (1 - requests_left) * 60.0 / self.rpm)
+                if self.tpm and tokens_left < tokens:
+                    wait = max(wait, (tokens - tokens_left) * 60.0 / self.tpm)
+                if wait == 0:
+                    if self.rpm:
+                        requests_left -= 1
+                    if self.tpm:
+                        tokens_left -= tokens
+
+                conn.execute(
+                    'UPDATE rate_limit_state SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?',
+                    (requests_left, tokens_left, now, 'gemini')
+                )
+                return wait
+            finally:
+                conn.execute('COMMIT')
+
+    def block(self, seconds):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE rate_limit_state SET blocked_until = MAX(blocked_until, ?) WHERE name = ?',
+                (time.time() + seconds, 'gemini')
+            )
+
+
+class RateLimitScheduler:
+    """Client-side token-bucket scheduler with a per-user fair queue.
+
+    Calls acquire a slot before going upstream. When the request or token
+    budget is exhausted they wait in a queue that is served round-robin
+    across users, so one heavy user cannot starve everyone else. Upstream
+    429s pause the whole scheduler with jittered exponential backoff.
+    """
+
+    def __init__(self, rpm=15, tpm=250000, db_path=None, max_wait=120,
+                 backoff_base=2.0, backoff_max=60.0):
+        self.enabled = bool(rpm or tpm)
+        self.rpm = rpm
+        self.max_wait = max_wait
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        if db_path:
+            self.buckets = SQLiteBuckets(rpm, tpm, db_path)
+        else:
+            self.buckets = MemoryBuckets(rpm, tpm)
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._head_wait = 0.0
+        self._consecutive_429s = 0
+        self.granted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _position(self, user_key, ticket):
+        """Round-robin position of ticket across all user queues (0 = next)"""
+        depth = self._queues[user_key].index(ticket)
+        position = 0
+        for key, queue in self._queues.items():
+            position += min(len(queue), depth)
+            if key == user_key:
+                break
+            if len(queue) > depth:
+                position += 1
+        return position
+
+    def _estimate_wait(self, position, bucket_wait):
+        per_request = 60.0 / self.rpm if self.rpm else 0.0
+        return bucket_wait + position * per_request
+
+    def _enqueue(self, user_key):
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(user_key, deque()).append(ticket)
+        return ticket
+
+    def _dequeue(self, user_key, ticket, granted):
+        with self._cond:
+            queue = self._queues.get(user_key)
+            if queue is not None:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[user_key]
+                elif granted:
+                    # Served users go to the back of the rotation
+                    self._queues.move_to_end(user_key)
+            self._cond.notify_all()
+
+    def _poll(self, user_key, ticket, tokens):
+        """Try to take a slot for ticket; returns (granted, status, seconds until next check)"""
+        with self._cond:
+            position = self._position(user_key, ticket)
+            bucket_wait = self._head_wait
+        if position == 0:
+            # Only the head of the queue consumes, so the bucket (possibly a SQLite
+            # transaction) is checked without holding up other threads on the queue lock
+            bucket_wait = self.buckets.try_consume(tokens)
+        with self._cond:
+            if position == 0:
+                self._head_wait = bucket_wait
+                if bucket_wait == 0:
+                    self.granted += 1
+                    return True, None, 0
+            eta = self._estimate_wait(position, bucket_wait)
+            if eta > self.max_wait:
+                self.rejected += 1
+                raise Exception("RATE_LIMIT")
+        recheck = min(max(bucket_wait, 0.05), 1.0) if position == 0 else 1.0
+        return False, QueueStatus(position, round(eta, 1)), recheck
+
+    def wait(self, user_key, tokens):
+        """Block until a slot is available, yielding QueueStatus while queued.
+
+        Raises Exception("RATE_LIMIT") if the estimated wait exceeds max_wait.
+        """
+        if not self.enabled:
+            return
+
+        ticket = self._enqueue(user_key)
+        granted = False
+        try:
+            last_status = None
+            while True:
+                granted, status, recheck = self._poll(user_key, ticket, tokens)
+                if granted:
+                    return
+                if status != last_status:
+                    last_status = status
+                    yield status
+                with self._cond:
+                    self._cond.wait(timeout=recheck)
+        finally:
+            self._dequeue(user_key, ticket, granted)
+
+    async def wait_async(self, user_key, tokens):
+        """Async variant of wait() that sleeps on the event loop instead of a thread"""
+        if not self.enabled:
+            return
+
+        ticket = self._enqueue(user_key)
+        granted = False
+        try:
+            last_status = None
+            while True:
+                if self.buckets.blocking:
+                    granted, status, recheck = await asyncio.to_thread(self._poll, user_key, ticket, tokens)
+                else:
+                    granted, status, recheck = self._poll(user_key, ticket, tokens)
+                if granted:
+                    return
+                if status != last_status:
+                    last_status = status
+                    yield status
+                # Async waiters can't be woken by notify_all, so poll a little faster
+                await asyncio.sleep(min(recheck, 0.25))
+        finally:
+            self._dequeue(user_key, ticket, granted)
+
+    def acquire(self, user_key, tokens):
+        """Blocking variant of wait() for callers that can't report progress"""
+        for _ in self.wait(user_key, tokens):
+            pass
+
+    def try_acquire(self, tokens):
+        """Take a slot only if one is free now and nobody is queued; used for optional extra calls"""
+        if not self.enabled:
+            return True
+        with self._cond:
+            if self._queues:
+                return False
+        if self.buckets.try_consume(tokens) > 0:
+            return False
+        with self._cond:
+            self.granted += 1
+        return True
+
+    async def try_acquire_async(self, tokens):
+        """Async variant of try_acquire() that keeps a blocking bucket store off the event loop"""
+        if self.buckets.blocking:
+            return await asyncio.to_thread(self.try_acquire, tokens)
+        return self.try_acquire(tokens)
+
+    def report_rate_limit(self):
+        """Back off after an upstream 429 and return the pause applied"""
+        with self._cond:
+            self._consecutive_429s += 1
+            self.rate_limited += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (self._consecutive_429s - 1)))
+            delay = random.uniform(delay / 2, delay)
+        self.buckets.block(delay)
+        logger.warning(f"Upstream rate limit, pausing Gemini calls for {delay:.1f}s")
+        return delay
+
+    async def report_rate_limit_async(self):
+        """Async variant of report_rate_limit() that keeps a blocking bucket store off the event loop"""
+        if self.buckets.blocking:
+            return await asyncio.to_thread(self.report_rate_limit)
+        return self.report_rate_limit()
+
+    def report_success(self):
+        with self._cond:
+            self._consecutive_429s = 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'queued': sum(len(q) for q in self._queues.values()),
+                'queued_users': len(self._queues),
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'rate_limited': self.rate_limited
+            }
@@ -71,9 +71,17 @@ if not exist app.py (
     pause
     popd & exit /b 1
 )
-echo [INFO]  Launching Flask server...
 set "FLASK_APP=app.py"
 set "FLASK_DEBUG=1"
+echo [INFO]  Applying database migrations...
+python -m flask migrate
+if errorlevel 1 (
+    echo [ERROR] Failed to migrate the database.
+    pause
+    popd & exit /b 1
+)
+echo [OK]    Database is up to date.
+echo [INFO]  Launching Flask server...
 start "Flask Server" cmd /k "python -m flask run --host=127.0.0.1 --port=5000"
 REM 6) Wait for server to become available
 echo [INFO]  Waiting for server on http://127.0.0.1:5000 ...
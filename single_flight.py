@@ -0,0 +1,195 @@
+"""Single-flight sharing of identical in-flight Gemini streams.
+
+The first request for a key starts the upstream stream on a driver thread;
+identical requests that arrive while it is running subscribe to the same
+buffer instead of opening their own. Every subscriber, including late
+joiners, reads the buffer from the start, so each one receives the complete
+response.
+"""
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How often a cancellable subscriber waiting on a silent upstream checks its cancelled event
+CANCEL_CHECK_INTERVAL = 0.25
+
+
+class Flight:
+    """Buffer and state of one shared upstream stream"""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        # Latest non-text item (e.g. a queue position), shown until text arrives
+        self.status = None
+        self.status_version = 0
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.cond = threading.Condition()
+        self._async_waiters = []
+
+    def publish(self):
+        """Wake every subscriber; call with cond held"""
+        self.cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters = []
+
+    def snapshot(self, index, status_version):
+        """Return (new chunks, new status, done, error), or None if nothing changed; call with cond held"""
+        if index == len(self.chunks) and status_version == self.status_version and not self.done:
+            return None
+        status = self.status if status_version != self.status_version else None
+        return self.chunks[index:], status, self.done, self.error
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """Shares one upstream stream between identical concurrent requests.
+
+    Items from the upstream iterator are text chunks (str) or status
+    objects; only the latest status is kept, and only subscribers that have
+    not received any text yet are sent it. When every subscriber has gone
+    the upstream is closed at its next item.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _subscribe(self, key, start):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(key)
+                self.leaders += 1
+            else:
+                self.followers += 1
+            flight.subscribers += 1
+        if leader:
+            threading.Thread(target=self._drive, args=(flight, start), daemon=True, name='single-flight').start()
+        return flight
+
+    def _unsubscribe(self, flight):
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is reading any more; the next identical request starts a fresh stream
+                flight.abandoned = True
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def _drive(self, flight, start):
+        stream = None
+        try:
+            stream = start()
+            for item in stream:
+                if flight.abandoned:
+                    break
+                with flight.cond:
+                    if isinstance(item, str):
+                        if item:
+                            flight.chunks.append(item)
+                    else:
+                        flight.status = item
+                        flight.status_version += 1
+                    flight.publish()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+            # Later requests go to the response cache (or upstream) rather than this buffer
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            with flight.cond:
+                flight.done = True
+                flight.publish()
+
+    @staticmethod
+    def _emit(update, has_text):
+        chunks, status, done, error = update
+        items = []
+        if status is not None and not has_text and not chunks:
+            items.append(status)
+        items.extend(chunks)
+        return items
+
+    def join(self, key, start, cancelled=None):
+        """Yield the shared stream for key, starting it with start() if nobody else has.
+
+        Raises the upstream's exception after any text it produced. Setting
+        the cancelled event ends this subscription early, even while the
+        upstream is silent.
+        """
+        flight = self._subscribe(key, start)
+        try:
+            index = 0
+            status_version = 0
+            while True:
+                with flight.cond:
+                    update = flight.snapshot(index, status_version)
+                    while update is None:
+                        if cancelled is not None and cancelled.is_set():
+                            return
+                        flight.cond.wait(timeout=CANCEL_CHECK_INTERVAL if cancelled is not None else None)
+                        update = flight.snapshot(index, status_version)
+                    status_version = flight.status_version
+                for item in self._emit(update, index > 0):
+                    yield item
+                index += len(update[0])
+                if update[2]:
+                    if update[3] is not None:
+                        raise update[3]
+                    return
+        finally:
+            self._unsubscribe(flight)
+
+    async def join_async(self, key, start):
+        """Async variant of join(); the upstream still runs on a driver thread"""
+        flight = self._subscribe(key, start)
+        loop = asyncio.get_running_loop()
+        try:
+            index = 0
+            status_version = 0
+            while True:
+                with flight.cond:
+                    update = flight.snapshot(index, status_version)
+                    if update is None:
+                        waiter = loop.create_future()
+                        flight._async_waiters.append((loop, waiter))
+                    else:
+                        status_version = flight.status_version
+                if update is None:
+                    await waiter
+                    continue
+                for item in self._emit(update, index > 0):
+                    yield item
+                index += len(update[0])
+                if update[2]:
+                    if update[3] is not None:
+                        raise update[3]
+                    return
+        finally:
+            self._unsubscribe(flight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'subscribers': sum(flight.subscribers for flight in self._flights.values()),
+                'leaders': self.leaders,
+                'followers': self.followers
+            }
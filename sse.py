@@ -0,0 +1,284 @@
+"""Server-Sent Events framing shared by the Flask and ASGI streaming endpoints.
+
+Handlers yield event dicts. The framing layer merges consecutive ``chunk``
+events into fewer, larger frames, sends comment heartbeats while a stream is
+idle so proxies don't drop it, and can gzip the whole event stream. An
+event carrying an ``id`` key is sent with an SSE ``id:`` line instead, so
+clients can resume from it with Last-Event-ID.
+
+Heartbeats need the reader to wake up while the upstream is silent. Async
+streams get that from the event loop. Blocking sources get it from a timed
+read: get(timeout) returning the next event, IDLE or END (see
+stream_buffer.StreamReader). A plain iterator can be given one with
+ThreadedSource, which runs it on a helper thread and hands its events over
+through a queue.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+HEARTBEAT = ': keep-alive\n\n'
+
+# Returned by a timed source's get(timeout): nothing arrived in time / the stream is over
+IDLE = object()
+END = object()
+
+
+def sse_event(payload, event_id=None):
+    """Format a payload as a Server-Sent Events data frame"""
+    if event_id is None:
+        return f"data: {json.dumps(payload)}\n\n"
+    return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _split_id(event):
+    if 'id' not in event:
+        return event, None
+    payload = dict(event)
+    return payload, payload.pop('id')
+
+
+class SSEPolicy:
+    """How chunk events are coalesced and how often idle streams are kept alive"""
+
+    def __init__(self, max_bytes=512, max_delay=0.05, heartbeat=15.0, gzip=False):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.heartbeat = heartbeat
+        self.gzip = gzip
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.environ.get('SSE_COALESCE_BYTES', 512)),
+            max_delay=float(os.environ.get('SSE_COALESCE_MS', 50)) / 1000.0,
+            heartbeat=float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15)),
+            gzip=os.environ.get('SSE_GZIP', '0') == '1'
+        )
+
+    def accepts_gzip(self, accept_encoding):
+        return self.gzip and 'gzip' in (accept_encoding or '').lower()
+
+
+class FrameAssembler:
+    """Turns event dicts into SSE frame text, merging consecutive chunk events.
+
+    The first chunk of a stream is framed immediately so coalescing never
+    adds to time to first token. Later chunks are held until max_bytes of
+    text is pending, max_delay has passed, or a non-chunk event arrives. A
+    merged frame carries the id of the last chunk in it.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.parts = []
+        self.pending_bytes = 0
+        self.pending_since = None
+        self.pending_id = None
+        self.sent_first_chunk = False
+
+    def push(self, event):
+        """Add one event; returns frame text ready to send ('' if buffered)"""
+        event, event_id = _split_id(event)
+        if event.get('type') != 'chunk':
+            return self.flush() + sse_event(event, event_id)
+
+        text = event.get('text') or ''
+        if not self.sent_first_chunk or self.policy.max_bytes <= 0:
+            self.sent_first_chunk = True
+            return self.flush() + sse_event(event, event_id)
+
+        self.parts.append(text)
+        self.pending_id = event_id
+        self.pending_bytes += len(text.encode('utf-8'))
+        now = time.monotonic()
+        if self.pending_since is None:
+            self.pending_since = now
+        if self.pending_bytes >= self.policy.max_bytes or now - self.pending_since >= self.policy.max_delay:
+            return self.flush()
+        return ''
+
+    def flush(self):
+        if not self.parts:
+            return ''
+        frame = sse_event({'type': 'chunk', 'text': ''.join(self.parts)}, self.pending_id)
+        self.parts = []
+        self.pending_id = None
+        self.pending_bytes = 0
+        self.pending_since = None
+        return frame
+
+    def flush_due_in(self):
+        """Seconds until buffered text must be sent, or None if nothing is buffered"""
+        if self.pending_since is None:
+            return None
+        return max(0.0, self.pending_since + self.policy.max_delay - time.monotonic())
+
+
+class FrameEncoder:
+    """Encodes frame text to bytes, optionally as one continuous gzip stream"""
+
+    def __init__(self, compress=False):
+        # wbits=31 writes a gzip header; each write is sync-flushed so the client can decode it immediately
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(self, text):
+        data = text.encode('utf-8')
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.compressor is None:
+            return b''
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class ThreadedSource:
+    """Timed-read source for a plain iterator, which runs on a helper thread.
+
+    wrap, if given, is applied to the thread's target function, e.g. Flask's
+    copy_current_request_context so the iterator still sees the request.
+    Errors raised by the iterator are re-raised from get(). close() stops
+    the helper at the iterator's next event and closes it there, since a
+    running generator can't be closed from another thread.
+    """
+
+    def __init__(self, events, wrap=None, maxsize=64):
+        self.events = events
+        self.queue = queue.Queue(maxsize)
+        self.stopped = threading.Event()
+        target = wrap(self._produce) if wrap else self._produce
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for event in self.events:
+                if not self._put((event, None)):
+                    break
+        except Exception as e:
+            self._put((None, e))
+        finally:
+            if hasattr(self.events, 'close'):
+                self.events.close()
+        self._put((END, None))
+
+    def get(self, timeout=None):
+        try:
+            item, error = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return IDLE
+        if error is not None:
+            raise error
+        return item
+
+    def close(self):
+        self.stopped.set()
+
+
+def _next_wait(assembler, policy, last_write):
+    waits = []
+    due = assembler.flush_due_in()
+    if due is not None:
+        waits.append(due)
+    if policy.heartbeat > 0:
+        waits.append(max(0.0, last_write + policy.heartbeat - time.monotonic()))
+    return min(waits) if waits else None
+
+
+def _on_idle(assembler, policy, last_write):
+    text = ''
+    due = assembler.flush_due_in()
+    if due is not None and due <= 0:
+        text = assembler.flush()
+    elif policy.heartbeat > 0 and time.monotonic() - last_write >= policy.heartbeat:
+        text = HEARTBEAT
+    return text
+
+
+def iter_frames(events, policy, compress=False):
+    """Frame a blocking source of event dicts as encoded SSE bytes.
+
+    A source with a timed get() is read with timeouts, so heartbeats and
+    time-based flushes happen while the upstream is silent. Any other
+    iterable is read as is: buffered text is flushed when the next event
+    arrives or the stream ends, and no heartbeats are sent.
+    """
+    assembler = FrameAssembler(policy)
+    encoder = FrameEncoder(compress)
+    last_write = time.monotonic()
+
+    try:
+        if hasattr(events, 'get'):
+            while True:
+                item = events.get(_next_wait(assembler, policy, last_write))
+                if item is END:
+                    break
+                text = _on_idle(assembler, policy, last_write) if item is IDLE else assembler.push(item)
+                if text:
+                    last_write = time.monotonic()
+                    yield encoder.encode(text)
+        else:
+            for event in events:
+                text = assembler.push(event)
+                if text:
+                    yield encoder.encode(text)
+    finally:
+        if hasattr(events, 'close'):
+            events.close()
+
+    tail = assembler.flush()
+    data = (encoder.encode(tail) if tail else b'') + encoder.finish()
+    if data:
+        yield data
+
+
+async def aiter_frames(events, policy, compress=False):
+    """Async counterpart of iter_frames for async generators of event dicts"""
+    assembler = FrameAssembler(policy)
+    encoder = FrameEncoder(compress)
+    last_write = time.monotonic()
+    # Kept across timeouts: cancelling a pending __anext__ would close the generator
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=_next_wait(assembler, policy, last_write))
+            if pending in done:
+                try:
+                    event = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                text = assembler.push(event)
+            else:
+                text = _on_idle(assembler, policy, last_write)
+            if text:
+                last_write = time.monotonic()
+                yield encoder.encode(text)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait({pending})
+        await events.aclose()
+
+    tail = assembler.flush()
+    data = (encoder.encode(tail) if tail else b'') + encoder.finish()
+    if data:
+        yield data
@@ -222,45 +222,51 @@ async function generateStory() {
         result.style.display = 'block';
         loading.style.display = 'none';
         
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder('utf-8');
         let fullText = '';
-        
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-            
-            const chunk = decoder.decode(value, { stream: true });
-            const lines = chunk.split('\n');
-            
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const dataStr = line.substring(6).trim();
-                    if (!dataStr) continue;
-                    try {
-                        const data = JSON.parse(dataStr);
-                        if (data.type === 'init') {
-                            storyDiv.innerHTML = `<img src="${data.image}" alt="Story Cover" style="width:100%; border-radius:8px; margin-bottom:15px; box-shadow: 0 4px 6px rgba(0,0,0,0.1);"><div id="storyText" class="markdown-body"></div>`;
-                        } else if (data.type === 'chunk') {
-                            fullText += data.text;
-                            const textDiv = document.getElementById('storyText');
-                            if (textDiv) {
-                                textDiv.innerHTML = marked.parse(fullText);
-                            } else {
-                                storyDiv.innerHTML = marked.parse(fullText);
-                            }
-                        } else if (data.type === 'done') {
-                            currentStoryId = data.story_id;
-                            generatedStory = fullText;
-                            showMessage(`Story generated! (${data.word_count} words)`, 'success');
-                        } else if (data.type === 'error') {
-                            showMessage(data.error, 'error');
-                        }
-                    } catch(e) {
-                        console.error('Error parsing stream data:', e, dataStr);
-                    }
+        let streamId = null;
+        let finished = false;
+        const position = { lastEventId: 0 };
+
+        const onEvent = data => {
+            if (data.type === 'init') {
+                streamId = data.stream_id;
+                storyDiv.innerHTML = `<img src="${data.image}" alt="Story Cover" style="width:100%; border-radius:8px; margin-bottom:15px; box-shadow: 0 4px 6px rgba(0,0,0,0.1);"><div id="storyText" class="markdown-body"></div>`;
+            } else if (data.type === 'queue') {
+                const textDiv = document.getElementById('storyText');
+                if (textDiv) textDiv.textContent = queueStatusText(data);
+            } else if (data.type === 'chunk') {
+                fullText += data.text;
+                const textDiv = document.getElementById('storyText');
+                if (textDiv) {
+                    textDiv.innerHTML = marked.parse(fullText);
+                } else {
+                    storyDiv.innerHTML = marked.parse(fullText);
                 }
+            } else if (data.type === 'done') {
+                finished = true;
+                currentStoryId = data.story_id;
+                generatedStory = fullText;
+                showMessage(`Story generated! (${data.word_count} words)`, 'success');
+            } else if (data.type === 'error') {
+                finished = true;
+                showMessage(data.error, 'error');
             }
+        };
+
+        // If the connection drops, pick the same generation up where it left off
+        let stream = response;
+        for (let attempt = 0; ; attempt++) {
+            try {
+                await readEventStream(stream, onEvent, position);
+            } catch (error) {
+                if (!streamId || attempt >= 3) throw error;
+            }
+            if (finished || !streamId || attempt >= 3) break;
+            await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+            stream = await fetch(`/generate/${streamId}`, {
+                headers: { 'Last-Event-ID': String(position.lastEventId) }
+            });
+            if (!stream.ok) throw new Error('Stream expired');
         }
     } catch (error) {
         showMessage('Connection error while generating story', 'error');
@@ -280,10 +286,12 @@ async function enhanceStory() {
     const enhanceBtn = document.getElementById('enhanceBtn');
     const loading = document.getElementById('enhanceLoading');
     const result = document.getElementById('enhanceResult');
+    const enhancedDiv = document.getElementById('enhancedStory');
 
     enhanceBtn.disabled = true;
     loading.style.display = 'block';
     result.style.display = 'none';
+    enhancedDiv.innerHTML = '';
 
     try {
         const response = await fetch('/enhance', {
@@ -291,19 +299,33 @@ async function enhanceStory() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 story: story,
-                type: document.getElementById('enhancementType').value
+                type: document.getElementById('enhancementType').value,
+                stream: true
             })
         });
 
-        const data = await response.json();
-
-        if (response.ok) {
-            document.getElementById('enhancedStory').innerHTML = marked.parse(data.enhanced_story);
-            result.style.display = 'block';
-            showMessage(`Story enhanced! (${data.word_count} words)`, 'success');
-        } else {
-            showMessage(data.error, 'error');
+        if (!response.ok) {
+            const errData = await response.json().catch(() => ({}));
+            showMessage(errData.error || 'Failed to enhance story', 'error');
+            return;
         }
+
+        let enhancedText = '';
+        await readEventStream(response, data => {
+            if (data.type === 'queue') {
+                enhancedDiv.textContent = queueStatusText(data);
+                result.style.display = 'block';
+            } else if (data.type === 'chunk') {
+                loading.style.display = 'none';
+                result.style.display = 'block';
+                enhancedText += data.text;
+                enhancedDiv.innerHTML = marked.parse(enhancedText);
+            } else if (data.type === 'done') {
+                showMessage(`Story enhanced! (${data.word_count} words)`, 'success');
+            } else if (data.type === 'error') {
+                showMessage(data.error, 'error');
+            }
+        });
     } catch (error) {
         showMessage('Failed to enhance story', 'error');
     } finally {
@@ -312,6 +334,47 @@ async function enhanceStory() {
     }
 }
 
+// Describe a queued request while it waits for a rate limit slot
+function queueStatusText(data) {
+    return data.position > 0
+        ? `Waiting in queue (position ${data.position}, about ${Math.ceil(data.eta)}s)...`
+        : `Waiting for an available slot (about ${Math.ceil(data.eta)}s)...`;
+}
+
+// Read a Server-Sent Events response, calling onEvent for every parsed data frame.
+// If position is given, position.lastEventId tracks the id of the last frame read.
+async function readEventStream(response, onEvent, position) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+
+        for (const frame of frames) {
+            for (const line of frame.split('\n')) {
+                if (position && line.startsWith('id: ')) {
+                    position.lastEventId = parseInt(line.substring(4));
+                    continue;
+                }
+                if (!line.startsWith('data: ')) continue;
+                const dataStr = line.substring(6).trim();
+                if (!dataStr) continue;
+                try {
+                    onEvent(JSON.parse(dataStr));
+                } catch (e) {
+                    console.error('Error parsing stream data:', e, dataStr);
+                }
+            }
+        }
+    }
+}
+
 // Multiple endings
 async function generateMultipleEndings() {
     const story = document.getElementById('storyForEndings').value.trim();
@@ -334,19 +397,34 @@ async function generateMultipleEndings() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 story: story,
-                num_endings: parseInt(document.getElementById('numEndings').value)
+                num_endings: parseInt(document.getElementById('numEndings').value),
+                stream: true
             })
         });
 
-        const data = await response.json();
-
-        if (response.ok) {
-            displayEndings(data.endings);
-            result.style.display = 'block';
-            showMessage(`Generated ${data.num_endings} different endings!`, 'success');
-        } else {
-            showMessage(data.error, 'error');
+        if (!response.ok) {
+            const errData = await response.json().catch(() => ({}));
+            showMessage(errData.error || 'Failed to generate endings', 'error');
+            return;
         }
+
+        await readEventStream(response, data => {
+            if (data.type === 'init') {
+                prepareEndingSlots(data.num_endings);
+                result.style.display = 'block';
+            } else if (data.type === 'ending') {
+                loading.style.display = 'none';
+                fillEndingSlot(data.index, data.text);
+            } else if (data.type === 'ending_error') {
+                failEndingSlot(data.index, data.error);
+            } else if (data.type === 'done') {
+                if (data.failed > 0) {
+                    showMessage(`Generated ${data.num_endings} endings (${data.failed} failed)`, 'warning');
+                } else {
+                    showMessage(`Generated ${data.num_endings} different endings!`, 'success');
+                }
+            }
+        });
     } catch (error) {
         showMessage('Failed to generate endings', 'error');
     } finally {
@@ -355,33 +433,54 @@ async function generateMultipleEndings() {
     }
 }
 
-function displayEndings(endings) {
+function prepareEndingSlots(count) {
     const container = document.getElementById('endingsContainer');
     container.innerHTML = ''; // Clear container first
-    
-    endings.forEach((ending, index) => {
+
+    for (let index = 0; index < count; index++) {
         const endingCard = document.createElement('div');
         endingCard.className = 'ending-card';
-        
+        endingCard.id = `endingCard${index}`;
+
         const title = document.createElement('h4');
         title.textContent = `Ending ${index + 1}`;
-        
+
         const content = document.createElement('div');
         content.className = 'markdown-body';
         content.style.lineHeight = '1.6';
-        content.innerHTML = marked.parse(ending);
-        
-        const copyBtn = document.createElement('button');
-        copyBtn.className = 'btn btn-secondary btn-small';
-        copyBtn.textContent = 'Copy';
-        copyBtn.onclick = () => copyText(ending);
-        
+        content.textContent = 'Writing...';
+
         endingCard.appendChild(title);
         endingCard.appendChild(content);
-        endingCard.appendChild(copyBtn);
-        
         container.appendChild(endingCard);
-    });
+    }
+}
+
+function fillEndingSlot(index, ending) {
+    const endingCard = document.getElementById(`endingCard${index}`);
+    if (!endingCard) return;
+
+    endingCard.querySelector('.markdown-body').innerHTML = marked.parse(ending);
+
+    const copyBtn = document.createElement('button');
+    copyBtn.className = 'btn btn-secondary btn-small';
+    copyBtn.textContent = 'Copy';
+    copyBtn.onclick = () => copyText(ending);
+    endingCard.appendChild(copyBtn);
+}
+
+function failEndingSlot(index, error) {
+    const endingCard = document.getElementById(`endingCard${index}`);
+    if (!endingCard) return;
+
+    const content = endingCard.querySelector('.markdown-body');
+    content.textContent = error;
+    content.style.color = 'var(--error)';
+}
+
+function displayEndings(endings) {
+    prepareEndingSlots(endings.length);
+    endings.forEach((ending, index) => fillEndingSlot(index, ending));
 }
 
 // Random prompt
@@ -396,15 +495,19 @@ async function getRandomPrompt() {
 }
 
 // Load user stories
-async function loadMyStories() {
+let myStoriesCursor = null;
+
+async function loadMyStories(append = false) {
     if (!currentUser) return;
 
     try {
-        const response = await fetch('/my-stories');
+        const url = append && myStoriesCursor ? `/my-stories?cursor=${encodeURIComponent(myStoriesCursor)}` : '/my-stories';
+        const response = await fetch(url);
         const data = await response.json();
 
         if (response.ok) {
-            displayMyStories(data.stories);
+            myStoriesCursor = data.next_cursor;
+            displayMyStories(data.stories, append);
         } else {
             showMessage(data.error, 'error');
         }
@@ -413,15 +516,15 @@ async function loadMyStories() {
     }
 }
 
-function displayMyStories(stories) {
+function displayMyStories(stories, append = false) {
     const container = document.getElementById('myStoriesContainer');
     
-    if (stories.length === 0) {
+    if (stories.length === 0 && !append) {
         container.innerHTML = '<p>No stories yet. Create your first story!</p>';
         return;
     }
 
-    container.innerHTML = stories.map(story => 
+    const cards = stories.map(story => 
         `<div class="story-card">
             <div class="story-meta">
                 <div>
@@ -431,7 +534,7 @@ function displayMyStories(stories) {
                 <div class="word-count">${story.word_count} words</div>
             </div>
             <div style="margin: 10px 0; color: #666; font-size: 14px;">
-                ${story.prompt.substring(0, 100)}${story.prompt.length > 100 ? '...' : ''}
+                ${formatExcerpt(story.excerpt)}
             </div>
             <div style="margin: 10px 0; font-size: 14px;">
                 Created: ${new Date(story.created_at).toLocaleDateString()}
@@ -442,12 +545,37 @@ function displayMyStories(stories) {
             </div>
         </div>`
     ).join('');
+
+    renderPage(container, cards, append, myStoriesCursor, 'loadMyStories(true)');
+}
+
+// Shorten a list excerpt for display on a card
+function formatExcerpt(excerpt) {
+    if (!excerpt) return '';
+    return excerpt.length > 100 ? excerpt.substring(0, 100) + '...' : excerpt;
+}
+
+// Render a page of cards, replacing or appending, with a "Load more" button when more pages exist
+function renderPage(container, cardsHTML, append, nextCursor, loadMoreCall) {
+    const existing = container.querySelector('.load-more');
+    if (existing) existing.remove();
+
+    if (append) {
+        container.insertAdjacentHTML('beforeend', cardsHTML);
+    } else {
+        container.innerHTML = cardsHTML;
+    }
+
+    if (nextCursor) {
+        container.insertAdjacentHTML('beforeend',
+            `<button class="btn btn-secondary load-more" onclick="${loadMoreCall}">Load more</button>`);
+    }
 }
 
 // Load public stories
 async function loadPublicStories() {
     try {
-        const response = await fetch('/public-stories');
+        const response = await fetch('/public-stories?limit=5');
         const data = await response.json();
 
         if (response.ok) {
@@ -581,30 +709,46 @@ async function continueStory() {
     btn.textContent = '⏳ Continuing...';
     btn.disabled = true;
 
+    const renderStory = text => {
+        const textDiv = document.getElementById('storyText');
+        if (textDiv) {
+            textDiv.innerHTML = marked.parse(text);
+        } else {
+            document.getElementById('generatedStory').innerHTML = marked.parse(text);
+        }
+    };
+
     try {
         const response = await fetch('/continue', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 story: generatedStory,
-                temperature: parseFloat(document.getElementById('temperature').value) || 0.8
+                story_id: currentStoryId,
+                temperature: parseFloat(document.getElementById('temperature').value) || 0.8,
+                stream: true
             })
         });
 
-        const data = await response.json();
+        if (!response.ok) {
+            const errData = await response.json().catch(() => ({}));
+            showMessage(errData.error || 'Failed to continue story', 'error');
+            return;
+        }
 
-        if (response.ok) {
-            generatedStory += '\n\n' + data.continuation;
-            const textDiv = document.getElementById('storyText');
-            if (textDiv) {
-                textDiv.innerHTML = marked.parse(generatedStory);
-            } else {
-                document.getElementById('generatedStory').innerHTML = marked.parse(generatedStory);
+        const baseStory = generatedStory + '\n\n';
+        let continuation = '';
+        await readEventStream(response, data => {
+            if (data.type === 'chunk') {
+                continuation += data.text;
+                renderStory(baseStory + continuation);
+            } else if (data.type === 'done') {
+                generatedStory = baseStory + continuation;
+                showMessage('Story continued!', 'success');
+            } else if (data.type === 'error') {
+                showMessage(data.error, 'error');
             }
-            showMessage('Story continued!', 'success');
-        } else {
-            showMessage(data.error, 'error');
-        }
+        });
     } catch (error) {
         showMessage('Failed to continue story', 'error');
     } finally {
@@ -639,26 +783,30 @@ async function toggleFavorite(storyId, btnElement) {
     }
 }
 
-async function loadFavoriteStories() {
+let favoritesCursor = null;
+
+async function loadFavoriteStories(append = false) {
     if (!currentUser) return;
     try {
-        const response = await fetch('/favorites');
+        const url = append && favoritesCursor ? `/favorites?cursor=${encodeURIComponent(favoritesCursor)}` : '/favorites';
+        const response = await fetch(url);
         const data = await response.json();
         if (response.ok) {
-            displayFavoriteStories(data.stories);
+            favoritesCursor = data.next_cursor;
+            displayFavoriteStories(data.stories, append);
         }
     } catch (error) {
         showMessage('Failed to load favorites', 'error');
     }
 }
 
-function displayFavoriteStories(stories) {
+function displayFavoriteStories(stories, append = false) {
     const container = document.getElementById('favoritesContainer');
-    if (stories.length === 0) {
+    if (stories.length === 0 && !append) {
         container.innerHTML = '<p>No favorite stories yet.</p>';
         return;
     }
-    container.innerHTML = stories.map(story => 
+    const cards = stories.map(story => 
         `<div class="story-card">
             <div class="story-meta">
                 <div>
@@ -666,13 +814,15 @@ function displayFavoriteStories(stories) {
                 </div>
             </div>
             <div style="margin: 10px 0; color: #666; font-size: 14px;">
-                ${story.prompt.substring(0, 100)}...
+                ${formatExcerpt(story.excerpt)}
             </div>
             <div class="story-actions">
                 <button class="btn btn-secondary btn-small" onclick="toggleFavorite('${story.id}', this)"><i class="fa-solid fa-heart"></i> Favorited</button>
             </div>
         </div>`
     ).join('');
+
+    renderPage(container, cards, append, favoritesCursor, 'loadFavoriteStories(true)');
 }
 
 function copyToClipboard() {
@@ -0,0 +1,181 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask --app app build-assets` copies every file under static/ to
+static/dist/ with a hash of its content in the name, writes gzip (and, if
+the optional ``brotli`` package is installed, brotli) variants next to it,
+and records the mapping in static/dist/manifest.json. A changed file gets
+a new name, so the built files can be cached forever; templates look the
+current name up through the manifest.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+# Best first; identity is always available
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Images and fonts are already compressed
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.html', '.txt', '.map', '.xml')
+
+HASH_LENGTH = 12
+
+
+def fingerprint(path, data):
+    """styles.css -> styles.<hash>.css"""
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def compress(encoding, data):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical between builds
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def build_assets(source_dir, output_dir, prune=False):
+    """Fingerprint and precompress every file in source_dir; returns the manifest.
+
+    The manifest is written last, so a running server never points at a
+    file that is not there yet. Files from earlier builds are kept for
+    pages that still reference them unless prune is set.
+    """
+    source_dir = os.path.abspath(source_dir)
+    output_dir = os.path.abspath(output_dir)
+    encodings = [(name, suffix) for name, suffix in ENCODINGS if name != 'br' or brotli is not None]
+    assets = {}
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != output_dir)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, source_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            built = fingerprint(logical, data)
+            target = os.path.join(output_dir, built)
+            _write(target, data)
+            entry = {'path': built, 'size': len(data), 'encodings': {}}
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                for encoding, suffix in encodings:
+                    compressed = compress(encoding, data)
+                    # Not worth a variant unless it actually saves bytes
+                    if len(compressed) < len(data):
+                        _write(target + suffix, compressed)
+                        entry['encodings'][encoding] = len(compressed)
+            assets[logical] = entry
+
+    manifest = {'assets': assets}
+    _write(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    if prune:
+        keep = {MANIFEST_NAME}
+        for entry in assets.values():
+            keep.add(entry['path'])
+            keep.update(entry['path'] + suffix for encoding, suffix in ENCODINGS if encoding in entry['encodings'])
+        for root, _, files in os.walk(output_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, output_dir).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+    return manifest
+
+
+class AssetManifest:
+    """Runtime view of a built manifest, reloaded when the file changes.
+
+    With no manifest (assets never built) lookups return None, so callers
+    can fall back to the plain static files.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._assets = {}
+        self._built = {}
+
+    def _current(self):
+        try:
+            mtime = os.stat(os.path.join(self.directory, MANIFEST_NAME)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._load(mtime)
+            return self._assets, self._built
+
+    def _load(self, mtime):
+        self._mtime = mtime
+        self._assets, self._built = {}, {}
+        if mtime is None:
+            return
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), encoding='utf-8') as f:
+                assets = json.load(f)['assets']
+        except Exception as e:
+            logger.error(f"Error loading asset manifest: {str(e)}")
+            return
+        self._assets = assets
+        self._built = {entry['path']: entry for entry in assets.values()}
+
+    def lookup(self, logical):
+        """Fingerprinted path for a source path like 'css/styles.css', or None"""
+        entry = self._current()[0].get(logical)
+        return entry['path'] if entry else None
+
+    def select(self, built, accepted):
+        """Pick the file to send for a fingerprinted path.
+
+        accepted(encoding) says whether the client takes an encoding.
+        Returns (file path, content encoding or None), or None if there
+        is no such built file.
+        """
+        entry = self._current()[1].get(built)
+        path = os.path.normpath(os.path.join(self.directory, *built.split('/')))
+        if entry is not None:
+            available = entry['encodings']
+        else:
+            # Files of earlier builds stay servable for pages that still reference them
+            if (not path.startswith(self.directory + os.sep) or os.path.basename(path) == MANIFEST_NAME
+                    or not os.path.isfile(path)):
+                return None
+            available = [encoding for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+        for encoding, suffix in ENCODINGS:
+            if encoding in available and accepted(encoding):
+                return path + suffix, encoding
+        return path, None
+
+    def stats(self):
+        """Total bytes of the current build, as-is and as sent with each encoding it has"""
+        assets = self._current()[0]
+        built = {encoding for entry in assets.values() for encoding in entry['encodings']}
+        return {
+            'assets': len(assets),
+            'bytes': sum(entry['size'] for entry in assets.values()),
+            'compressed_bytes': {
+                encoding: sum(entry['encodings'].get(encoding, entry['size']) for entry in assets.values())
+                for encoding, _ in ENCODINGS if encoding in built
+            }
+        }
@@ -0,0 +1,150 @@
+"""Storage encoding of story bodies.
+
+Bodies are stored as plain text (format 0) or compressed with a shared
+dictionary trained on existing stories: zlib with a preset dictionary
+(format 1) or zstd (format 2, needs the optional ``zstandard`` package).
+Each row records its format and dictionary id, so rows written with
+different settings can live side by side and are decoded only when the
+full body is read.
+"""
+import threading
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_PLAIN = 0
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+
+ALGORITHMS = {'none': FORMAT_PLAIN, 'zlib': FORMAT_ZLIB, 'zstd': FORMAT_ZSTD}
+
+# zlib only looks back 32 KB, so a bigger preset dictionary would be wasted
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 64 * 1024
+
+
+def train_zlib_dictionary(samples, size=ZLIB_DICT_SIZE):
+    """Build a preset dictionary from the three-word phrases shared by the most samples"""
+    counts = Counter()
+    for text in samples:
+        words = text.split()
+        counts.update({' '.join(words[i:i + 3]) for i in range(len(words) - 2)})
+    phrases = []
+    total = 0
+    for phrase, count in counts.most_common():
+        if count < 2:
+            break
+        encoded = (phrase + ' ').encode('utf-8')
+        if total + len(encoded) > size:
+            break
+        phrases.append(encoded)
+        total += len(encoded)
+    # Matches near the end of the dictionary are cheapest, so the most common phrases go last
+    return b''.join(reversed(phrases))
+
+
+def train_dictionary(algorithm, samples):
+    if algorithm == 'zlib':
+        return train_zlib_dictionary(samples)
+    if algorithm == 'zstd':
+        _require_zstd()
+        encoded = [text.encode('utf-8') for text in samples]
+        return zstandard.train_dictionary(ZSTD_DICT_SIZE, encoded).as_bytes()
+    raise ValueError(f"Unknown compression algorithm: {algorithm}")
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd story compression needs the zstandard package (pip install zstandard)")
+
+
+class StoryCodec:
+    """Encodes story bodies for storage and decodes them when they are read.
+
+    Dictionaries live in the compression_dicts table and never change once
+    written; they are loaded on first use and kept for the process lifetime.
+    """
+
+    def __init__(self, algorithm='none', level=6):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown compression algorithm: {algorithm}")
+        if algorithm == 'zstd':
+            _require_zstd()
+        self.algorithm = algorithm
+        self.format = ALGORITHMS[algorithm]
+        self.level = level
+        self._dicts = {}
+        self._active = None
+        self._lock = threading.Lock()
+
+    def _dictionary(self, conn, dict_id):
+        with self._lock:
+            data = self._dicts.get(dict_id)
+        if data is None:
+            row = conn.execute('SELECT data FROM compression_dicts WHERE id = ?', (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Missing compression dictionary {dict_id}")
+            data = bytes(row[0])
+            with self._lock:
+                self._dicts[dict_id] = data
+        return data
+
+    def active_dictionary(self, conn):
+        """Newest dictionary for this codec's algorithm as (id, data), or (None, None)"""
+        if self.format == FORMAT_PLAIN:
+            return None, None
+        with self._lock:
+            active = self._active
+        if active is None:
+            row = conn.execute(
+                'SELECT id FROM compression_dicts WHERE algorithm = ? ORDER BY id DESC LIMIT 1', (self.algorithm,)
+            ).fetchone()
+            active = (row[0], self._dictionary(conn, row[0])) if row else (None, None)
+            with self._lock:
+                self._active = active
+        return active
+
+    def reset(self):
+        """Forget the cached active dictionary, e.g. after training a new one"""
+        with self._lock:
+            self._active = None
+
+    def encode(self, conn, text):
+        """Return (value, format, dict_id) to store for a story body"""
+        if self.format == FORMAT_PLAIN:
+            return text, FORMAT_PLAIN, None
+        dict_id, dictionary = self.active_dictionary(conn)
+        data = text.encode('utf-8')
+        if self.format == FORMAT_ZLIB:
+            if dictionary:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=dictionary)
+            else:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            blob = compressor.compress(data) + compressor.flush()
+        else:
+            params = {'dict_data': zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+            blob = zstandard.ZstdCompressor(level=self.level, **params).compress(data)
+        return blob, self.format, dict_id
+
+    def decode(self, conn, value, story_format, dict_id):
+        """Return the text of a stored story body"""
+        if not story_format:
+            return value
+        dictionary = self._dictionary(conn, dict_id) if dict_id is not None else None
+        if story_format == FORMAT_ZLIB:
+            if dictionary:
+                decompressor = zlib.decompressobj(-15, zdict=dictionary)
+            else:
+                decompressor = zlib.decompressobj(-15)
+            data = decompressor.decompress(value) + decompressor.flush()
+        elif story_format == FORMAT_ZSTD:
+            _require_zstd()
+            params = {'dict_data': zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+            data = zstandard.ZstdDecompressor(**params).decompress(value)
+        else:
+            raise ValueError(f"Unknown story format {story_format}")
+        return data.decode('utf-8')
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import threading
+import time
+
+from scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# estimate_tokens counts about four characters per token
+CHARS_PER_TOKEN = 4
+
+
+def prefix_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class StoryMemory:
+    """Bounded context for continuing a story: a rolling summary plus the latest text.
+
+    Text older than the recent window is folded into a summary that is
+    stored per story and only ever extended with the new text since the last
+    fold, so the prompt stays within budget however long the story gets.
+    The stored summary records a hash of the text it covers and is ignored
+    if the client's copy of that text has changed. Summaries untouched for
+    max_age_days are deleted at most once every purge_interval seconds.
+    """
+
+    def __init__(self, pool, summarize, budget_tokens=1500, chunk_tokens=4000, max_age_days=30,
+                 purge_interval=3600):
+        self.pool = pool
+        # summarize(previous_summary, passage, max_words, user_key) -> updated summary text
+        self.summarize = summarize
+        self.summary_tokens = budget_tokens // 5
+        self.recent_tokens = budget_tokens // 2
+        # The window may grow by this much before it is folded, so most continuations need no summary call
+        self.slack_tokens = budget_tokens - self.summary_tokens - self.recent_tokens
+        self.chunk_tokens = chunk_tokens
+        self.max_age_days = max_age_days
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        self.folds = 0
+        self.summary_calls = 0
+
+    @staticmethod
+    def memory_key(story_id, text):
+        """Saved stories use their id; unsaved ones are keyed on their opening text"""
+        if story_id:
+            return f'story:{story_id}'
+        return 'text:' + hashlib.sha256(text[:256].encode('utf-8')).hexdigest()[:32]
+
+    def build_context(self, key, text, user_key=None):
+        """Return (summary, recent) covering text within the token budget"""
+        summary, covered = self._load(key, text)
+        if estimate_tokens(text[covered:]) <= self.recent_tokens + self.slack_tokens:
+            return summary, text[covered:]
+
+        cut = self._window_start(text, covered)
+        previous = summary
+        try:
+            for passage in self._passages(text[covered:cut]):
+                summary = self.summarize(summary, passage, self.summary_tokens * 3 // 4, user_key)
+                summary = self._clip(summary.strip(), self.summary_tokens * CHARS_PER_TOKEN)
+                with self._lock:
+                    self.summary_calls += 1
+        except Exception as e:
+            # Continue from the old summary and the window rather than fail the request
+            logger.error(f"Error updating story summary: {str(e)}")
+            return previous, text[cut:]
+        with self._lock:
+            self.folds += 1
+        self._save(key, summary, text[:cut])
+        return summary, text[cut:]
+
+    def forget(self, conn, story_id):
+        """Drop a saved story's summary, on the caller's connection"""
+        conn.execute('DELETE FROM story_memory WHERE key = ?', (self.memory_key(story_id, ''),))
+
+    def _load(self, key, text):
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute('SELECT summary, covered_chars, covered_hash FROM story_memory WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            self.pool.release(conn)
+        if row is None or row['covered_chars'] > len(text):
+            return '', 0
+        if prefix_hash(text[:row['covered_chars']]) != row['covered_hash']:
+            # The earlier text was edited, so the summary no longer describes it
+            return '', 0
+        return row['summary'], row['covered_chars']
+
+    def _save(self, key, summary, covered_text):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO story_memory (key, summary, covered_chars, covered_hash, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (key) DO UPDATE SET
+                        summary = excluded.summary,
+                        covered_chars = excluded.covered_chars,
+                        covered_hash = excluded.covered_hash,
+                        updated_at = excluded.updated_at
+                ''', (key, summary, len(covered_text), prefix_hash(covered_text)))
+        except Exception as e:
+            # The summary is only a cache; the next fold will rebuild it
+            logger.error(f"Error saving story memory: {str(e)}")
+        finally:
+            self.pool.release(conn)
+        self._maybe_purge()
+
+    def purge(self):
+        """Delete summaries not updated for max_age_days; unsaved stories are never forgotten explicitly"""
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM story_memory WHERE updated_at < datetime('now', ?)",
+                                    (f'-{self.max_age_days} days',)).rowcount
+        finally:
+            self.pool.release(conn)
+
+    def _maybe_purge(self):
+        with self._lock:
+            if time.monotonic() < self._next_purge:
+                return
+            self._next_purge = time.monotonic() + self.purge_interval
+        try:
+            self.purge()
+        except Exception as e:
+            logger.error(f"Error purging story memory: {str(e)}")
+
+    def _window_start(self, text, covered):
+        """Start of the recent window, moved forward to a paragraph or word boundary"""
+        start = max(covered, len(text) - self.recent_tokens * CHARS_PER_TOKEN)
+        paragraph = text.find('\n\n', start, start + self.recent_tokens * CHARS_PER_TOKEN // 4)
+        if paragraph != -1:
+            return paragraph + 2
+        space = text.find(' ', start)
+        return space + 1 if space != -1 else start
+
+    def _passages(self, text):
+        """Split text into pieces small enough for one summary call"""
+        size = self.chunk_tokens * CHARS_PER_TOKEN
+        while text:
+            if len(text) <= size:
+                yield text
+                return
+            end = text.rfind(' ', 0, size)
+            end = end + 1 if end > 0 else size
+            yield text[:end]
+            text = text[end:]
+
+    @staticmethod
+    def _clip(text, max_chars):
+        if len(text) <= max_chars:
+            return text
+        clipped = text[:max_chars]
+        return clipped[:clipped.rfind(' ')] if ' ' in clipped else clipped
+
+    def stats(self):
+        with self._lock:
+            return {
+                'folds': self.folds,
+                'summary_calls': self.summary_calls,
+                'budget_tokens': self.summary_tokens + self.recent_tokens + self.slack_tokens
+            }
@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+
+from database import connect, insert_story
+from metrics import DB_QUERY_SECONDS, DB_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PendingWrite:
+    """A queued story insert; wait() blocks until its batch has committed"""
+
+    def __init__(self, story_id, user_id, story_data):
+        self.story_id = story_id
+        self.user_id = user_id
+        self.story_data = story_data
+        self.error = None
+        self._committed = threading.Event()
+
+    def wait(self, timeout=None):
+        """Wait for the commit; raises the write error, or TimeoutError if it took too long"""
+        if not self._committed.wait(timeout):
+            raise TimeoutError(f"Story {self.story_id} was not written within {timeout}s")
+        if self.error is not None:
+            raise self.error
+
+    def resolve(self, error=None):
+        self.error = error
+        self._committed.set()
+
+
+class StoryWriter:
+    """Write-behind queue that commits story inserts in batches on one thread.
+
+    Callers get the story id back immediately. The writer takes everything
+    queued (up to batch_size) and commits it in a single transaction, waiting
+    at most interval seconds for a batch to fill, so the number of commits
+    grows with time rather than with the number of stories saved.
+    """
+
+    def __init__(self, path=None, batch_size=100, interval=0.05, max_queue=10000, on_commit=None):
+        self.path = path
+        # Called with each committed batch of PendingWrites, from the writer thread
+        self.on_commit = on_commit
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name='story-writer')
+        self._thread.start()
+
+    def submit(self, story_id, user_id, story_data):
+        """Queue a story for insertion and return its PendingWrite"""
+        write = PendingWrite(story_id, user_id, story_data)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Story writer is shut down")
+            self._pending[story_id] = write
+        # Blocks when the writer is far behind, which pushes back on new saves
+        self._queue.put(write)
+        return write
+
+    def wait(self, story_id, timeout=None):
+        """Block until story_id is committed if it is still queued (read-your-writes)"""
+        with self._lock:
+            write = self._pending.get(story_id)
+        if write is not None:
+            write.wait(timeout)
+
+    def close(self, timeout=30):
+        """Commit everything still queued and stop the writer thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        """Block for the first item, then collect more until the batch is full or interval passes"""
+        batch = [self._queue.get()]
+        if batch[0] is _STOP:
+            return [], True
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = None
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                conn = self._commit(conn, batch)
+
+        # Saves that raced with close() were queued behind the stop marker
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        if leftovers:
+            conn = self._commit(conn, leftovers)
+        if conn is not None:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        """Write one batch and resolve its waiters; returns the connection to reuse"""
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = connect(self.path)
+        except Exception as e:
+            logger.error(f"Error opening database for story writes: {str(e)}")
+            self._resolve(batch, {write.story_id: e for write in batch})
+            return None
+        try:
+            with conn:
+                for write in batch:
+                    insert_story(conn, write.story_id, write.user_id, write.story_data)
+            errors = {}
+        except Exception as e:
+            # One bad row shouldn't lose the rest of the batch; retry them one at a time
+            logger.error(f"Error writing story batch, retrying individually: {str(e)}")
+            errors = {}
+            for write in batch:
+                try:
+                    with conn:
+                        insert_story(conn, write.story_id, write.user_id, write.story_data)
+                except Exception as row_error:
+                    logger.error(f"Error saving story {write.story_id}: {str(row_error)}")
+                    errors[write.story_id] = row_error
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, helper='write_batch')
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        if self.on_commit is not None and len(errors) < len(batch):
+            try:
+                self.on_commit(batch)
+            except Exception as e:
+                logger.error(f"Error in story writer commit hook: {str(e)}")
+        self._resolve(batch, errors)
+        return conn
+
+    def _resolve(self, batch, errors):
+        with self._lock:
+            for write in batch:
+                self._pending.pop(write.story_id, None)
+            self.batches += 1
+            self.failed += len(errors)
+            self.written += len(batch) - len(errors)
+        for write in batch:
+            write.resolve(errors.get(write.story_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._pending),
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches
+            }
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from sse import END, IDLE
+
+logger = logging.getLogger(__name__)
+
+
+class StreamNotFound(KeyError):
+    pass
+
+
+class BufferedStream:
+    """Numbered events of one generation, readable by any number of subscribers.
+
+    Event n (counting from 1) is events[n - 1]. Sync readers wait on a
+    condition; async readers register a future that append() resolves on
+    their own event loop, so a stream produced on a thread can be read from
+    a coroutine and the other way round.
+    """
+
+    def __init__(self, stream_id, user_id):
+        self.id = stream_id
+        self.user_id = user_id
+        self.events = []
+        self.finished = False
+        self.finished_at = None
+        self.subscribers = 0
+        self.readers = 0
+        self.detached_since = time.monotonic()
+        # Set once a reader has seen the whole stream, or once it has been spilled to SQLite
+        self.delivered = False
+        self.spilled = False
+        # Set when the stream is abandoned; the producer passes it upstream to stop the call
+        self.cancelled = threading.Event()
+        self._cond = threading.Condition()
+        self._waiters = set()
+        # Keeps the producer task referenced while it runs, and the loop it runs on
+        self.task = None
+        self.loop = None
+
+    def append(self, event):
+        with self._cond:
+            if self.finished:
+                return
+            self.events.append(event)
+            self._wake()
+
+    def finish(self):
+        with self._cond:
+            if self.finished:
+                return False
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._wake()
+            return True
+
+    def _wake(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._waiters.clear()
+
+    def attach(self):
+        with self._cond:
+            self.subscribers += 1
+            self.readers += 1
+            self.detached_since = None
+
+    def detach(self):
+        with self._cond:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self.detached_since = time.monotonic()
+
+    def abandoned(self, grace):
+        """True once nobody has been reading for longer than grace seconds"""
+        with self._cond:
+            return self.detached_since is not None and time.monotonic() - self.detached_since > grace
+
+    def read(self, after, timeout):
+        """Events after number `after`, waiting up to timeout for one; returns (events, finished)"""
+        with self._cond:
+            if len(self.events) <= after and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[after:], self.finished
+
+    async def aread(self, after):
+        """Async read(): waits without a timeout, since the caller can cancel it"""
+        while True:
+            with self._cond:
+                if len(self.events) > after or self.finished:
+                    return self.events[after:], self.finished
+                future = asyncio.get_running_loop().create_future()
+                self._waiters.add((asyncio.get_running_loop(), future))
+            await future
+
+    def replay(self, after=0):
+        """Reader for events after number `after` (with their number as 'id'), then the live tail"""
+        return StreamReader(self, after)
+
+    async def areplay(self, after=0):
+        self.attach()
+        try:
+            while True:
+                events, finished = await self.aread(after)
+                for event in events:
+                    after += 1
+                    yield dict(event, id=after)
+                if finished and not events:
+                    self.delivered = True
+                    return
+        finally:
+            self.detach()
+
+
+class StreamReader:
+    """One subscriber's position in a BufferedStream.
+
+    get(timeout) waits up to timeout for the next event and returns IDLE if
+    none came, or END once the stream is over, so sse.iter_frames can send
+    heartbeats from the request thread. Iterating it yields events until the
+    stream ends. close() detaches the subscriber.
+    """
+
+    def __init__(self, stream, after):
+        self.stream = stream
+        self.after = after
+        self.pending = deque()
+        self.closed = False
+        stream.attach()
+
+    def get(self, timeout=None):
+        if not self.pending:
+            events, finished = self.stream.read(self.after, timeout)
+            for event in events:
+                self.after += 1
+                self.pending.append(dict(event, id=self.after))
+            if not self.pending:
+                if finished:
+                    self.stream.delivered = True
+                    return END
+                return IDLE
+        return self.pending.popleft()
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.get()
+                if item is END:
+                    return
+                if item is not IDLE:
+                    yield item
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stream.detach()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class StreamBuffer:
+    """Keeps generation streams running and replayable across client reconnects.
+
+    Each stream's producer runs on its own thread (or task) rather than in
+    the response, so a dropped connection does not stop the upstream call.
+    A sweeper thread stops it once nobody has been attached for
+    detach_grace seconds, and drops finished streams from memory ttl
+    seconds after they end. A stream that no reader has seen to the end is
+    written to SQLite, so a reconnect that lands after the memory copy
+    expired, or on another worker, can still replay it for retention
+    seconds; the sweeper deletes older copies every purge_interval seconds.
+    """
+
+    def __init__(self, pool, ttl=120, detach_grace=60, retention=3600, sweep_interval=1.0, purge_interval=300):
+        self.pool = pool
+        self.ttl = ttl
+        self.detach_grace = detach_grace
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self.purge_interval = purge_interval
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.started = 0
+        self.resumed = 0
+        self.abandoned = 0
+
+    def create(self, user_id):
+        self._start_sweeper()
+        stream = BufferedStream(str(uuid.uuid4()), user_id)
+        with self._lock:
+            self._streams[stream.id] = stream
+            self.started += 1
+        return stream
+
+    def run(self, stream, events, context=None):
+        """Produce a blocking event iterator into stream on a background thread.
+
+        context, if given, is entered on that thread (e.g. a Flask app context).
+        """
+        def produce():
+            if context is None:
+                self._produce(stream, events)
+            else:
+                with context:
+                    self._produce(stream, events)
+        threading.Thread(target=produce, daemon=True, name=f'stream-{stream.id[:8]}').start()
+
+    def _produce(self, stream, events):
+        try:
+            for event in events:
+                # Once the sweeper has abandoned the stream, whatever the upstream still sends is dropped
+                if stream.cancelled.is_set():
+                    break
+                stream.append(event)
+        except Exception as e:
+            logger.error(f"Error producing stream {stream.id}: {str(e)}")
+        finally:
+            if hasattr(events, 'close'):
+                events.close()
+            self._finish(stream)
+
+    def arun(self, stream, events):
+        """Produce an async generator of events into stream as a task on the running loop"""
+        stream.loop = asyncio.get_running_loop()
+        stream.task = stream.loop.create_task(self._aproduce(stream, events))
+
+    async def _aproduce(self, stream, events):
+        try:
+            async for event in events:
+                stream.append(event)
+        except Exception as e:
+            logger.error(f"Error producing stream {stream.id}: {str(e)}")
+        finally:
+            await events.aclose()
+            await asyncio.to_thread(self._finish, stream)
+
+    def _abandon(self, stream):
+        """Stop a stream nobody is reading; its producer may still be waiting on the upstream"""
+        logger.info(f"Nobody reconnected to stream {stream.id}, stopping upstream")
+        stream.cancelled.set()
+        stream.append({'type': 'error', 'error': 'Generation stopped after the connection was lost'})
+        with self._lock:
+            self.abandoned += 1
+        self._finish(stream)
+        if stream.task is not None:
+            stream.loop.call_soon_threadsafe(stream.task.cancel)
+
+    def _finish(self, stream):
+        if not stream.finish():
+            return
+        # A reader that left before the end may reconnect to another worker. One still
+        # attached (or not attached yet) is spilled by the sweeper only if it never gets there
+        if stream.readers and not stream.subscribers:
+            self._spill(stream)
+
+    def _spill(self, stream):
+        with self._lock:
+            if stream.spilled:
+                return
+            stream.spilled = True
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO streams (id, user_id) VALUES (?, ?)',
+                             (stream.id, stream.user_id))
+                conn.executemany(
+                    'INSERT OR REPLACE INTO stream_events (stream_id, seq, event) VALUES (?, ?, ?)',
+                    [(stream.id, seq, json.dumps(event)) for seq, event in enumerate(stream.events, 1)]
+                )
+        except Exception as e:
+            # Only reconnects after the memory copy expires need the spilled copy
+            logger.error(f"Error saving stream {stream.id}: {str(e)}")
+        finally:
+            self.pool.release(conn)
+
+    def purge(self):
+        """Delete spilled streams older than retention"""
+        cutoff = f'-{int(self.retention)} seconds'
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                expired = "SELECT id FROM streams WHERE finished_at < datetime('now', ?)"
+                conn.execute(f'DELETE FROM stream_events WHERE stream_id IN ({expired})', (cutoff,))
+                return conn.execute("DELETE FROM streams WHERE finished_at < datetime('now', ?)",
+                                    (cutoff,)).rowcount
+        finally:
+            self.pool.release(conn)
+
+    def get(self, stream_id, user_id):
+        """Find a stream by id, in memory or spilled.
+
+        Raises StreamNotFound if it is unknown or expired and PermissionError
+        if it belongs to another user. Streams of anonymous users are only
+        protected by their unguessable id.
+        """
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None:
+            stream = self._load(stream_id)
+        if stream.user_id is not None and stream.user_id != user_id:
+            raise PermissionError('Unauthorized to access this stream')
+        with self._lock:
+            self.resumed += 1
+        return stream
+
+    def _load(self, stream_id):
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute('SELECT user_id FROM streams WHERE id = ?', (stream_id,)).fetchone()
+            if row is None:
+                raise StreamNotFound(stream_id)
+            events = conn.execute('SELECT event FROM stream_events WHERE stream_id = ? ORDER BY seq',
+                                  (stream_id,)).fetchall()
+        finally:
+            self.pool.release(conn)
+        stream = BufferedStream(stream_id, row['user_id'])
+        stream.events = [json.loads(event['event']) for event in events]
+        stream.spilled = True
+        stream.finish()
+        return stream
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True, name='stream-sweeper')
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        last_purge = time.monotonic()
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self._sweep()
+                if time.monotonic() - last_purge >= self.purge_interval:
+                    last_purge = time.monotonic()
+                    self.purge()
+            except Exception as e:
+                logger.error(f"Error sweeping streams: {str(e)}")
+
+    def _sweep(self):
+        """Abandon live streams nobody is reading and drop finished ones from memory after ttl"""
+        now = time.monotonic()
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            if not stream.finished and stream.abandoned(self.detach_grace):
+                self._abandon(stream)
+            elif stream.finished and now - stream.finished_at > self.ttl:
+                # Spill anything no reader saw to the end before it leaves memory
+                if not stream.delivered:
+                    self._spill(stream)
+                with self._lock:
+                    self._streams.pop(stream.id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._streams),
+                'live': sum(1 for stream in self._streams.values() if not stream.finished),
+                'started': self.started,
+                'resumed': self.resumed,
+                'abandoned': self.abandoned
+            }
@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Settings are read when the modules are imported, so they are fixed before any test imports them.
+# Every test runs offline against the fake Gemini backend, with no latency and no rate limit.
+WORKDIR = tempfile.mkdtemp(prefix='storygen-tests-')
+os.environ.update({
+    'DATABASE_PATH': os.path.join(WORKDIR, 'stories.db'),
+    'PDF_CACHE_DIR': os.path.join(WORKDIR, 'pdf_cache'),
+    'COVER_CACHE_DIR': os.path.join(WORKDIR, 'cover_cache'),
+    'MIGRATE_ON_START': '1',
+    'GEMINI_BACKEND': 'fake',
+    'GEMINI_RPM': '0',
+    'GEMINI_TPM': '0',
+    'COVER_FETCHER': 'stub',
+    'FAKE_GEMINI_TTFT': '0',
+    'FAKE_GEMINI_CHUNK_LATENCY': '0',
+    'FAKE_GEMINI_WORDS': '40',
+    'SECRET_KEY': 'test-secret',
+    'OPS_TOKEN': 'test-ops-token',
+})
+
+OPS_HEADERS = {'Authorization': 'Bearer test-ops-token'}
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """Connection pool on a fresh, fully migrated database"""
+    import database
+    path = str(tmp_path / 'test.db')
+    database.init_db(path)
+    pool = database.ConnectionPool(path)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app as storygen
+    return storygen.create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """Register a user and return a test client logged in as them"""
+    def make_user(name=None):
+        name = name or f'user_{os.urandom(4).hex()}'
+        user_client = app.test_client()
+        response = user_client.post('/register', json={
+            'username': name, 'email': f'{name}@example.com', 'password': 'correct horse battery'
+        })
+        assert response.status_code in (200, 201), response.get_json()
+        return user_client
+    return make_user
+
+
+def parse_sse(text):
+    """Events of an SSE body as dicts, each with its frame's 'id' when it has one"""
+    events = []
+    for frame in text.split('\n\n'):
+        event_id = None
+        for line in frame.split('\n'):
+            if line.startswith('id: '):
+                event_id = int(line[4:])
+            elif line.startswith('data: '):
+                event = json.loads(line[6:])
+                if event_id is not None:
+                    event['id'] = event_id
+                events.append(event)
+    return events
+
+
+@pytest.fixture
+def sse():
+    """Parse a streamed test response into its events"""
+    def read(response):
+        return parse_sse(response.get_data(as_text=True))
+    return read
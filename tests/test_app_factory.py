@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import app as storygen
+import database
+from conftest import ROOT
+
+
+def test_create_app_is_idempotent(app):
+    assert storygen.create_app() is app
+    assert storygen.app is app
+    assert storygen.story_gen is not None and storygen.pdf_cache is not None
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = dict(os.environ, DATABASE_PATH=str(tmp_path / 'db' / 'stories.db'),
+               PDF_CACHE_DIR=str(tmp_path / 'pdf'), COVER_CACHE_DIR=str(tmp_path / 'covers'))
+    (tmp_path / 'db').mkdir()
+    script = (
+        'import threading, app\n'
+        'assert app.story_gen is None and app.pdf_cache is None\n'
+        'assert threading.active_count() == 1, threading.enumerate()\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True)
+    assert sorted(os.listdir(tmp_path)) == ['db']
+    assert os.listdir(tmp_path / 'db') == []
+
+
+def test_migrate_command_brings_the_schema_up_to_date(app, tmp_path, monkeypatch):
+    path = str(tmp_path / 'deploy.db')
+    monkeypatch.setattr(database, 'DATABASE', path)
+    result = app.test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+    assert f'Applied {len(database.MIGRATIONS)} migration(s)' in result.output
+    assert database.pending_migrations(path) == 0
+    assert 'Applied 0 migration(s)' in app.test_cli_runner().invoke(args=['migrate']).output
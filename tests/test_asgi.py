@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from conftest import parse_sse
+
+httpx = pytest.importorskip('httpx')
+asgi = pytest.importorskip('asgi')
+
+
+def run(scenario):
+    """Run scenario(client) against the ASGI app on a fresh event loop"""
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def text_of(events):
+    return ''.join(event['text'] for event in events if event['type'] == 'chunk')
+
+
+def test_generate_streams_on_the_event_loop():
+    async def scenario(client):
+        return await client.post('/generate', json={'prompt': 'a clockwork owl', 'genre': 'fantasy'})
+    response = run(scenario)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = parse_sse(response.text)
+    assert events[0]['type'] == 'init'
+    assert events[0]['stream_id'] == response.headers['x-stream-id']
+    assert any(event['type'] == 'chunk' for event in events)
+    assert events[-1]['type'] == 'done'
+    # Coalesced frames carry the id of their last event, so ids only increase
+    ids = [event['id'] for event in events]
+    assert ids == sorted(set(ids))
+
+
+def test_generate_resumes_after_last_event_id():
+    async def scenario(client):
+        first = await client.post('/generate', json={'prompt': 'a clockwork owl'})
+        events = parse_sse(first.text)
+        # A frame carries the id of the last event in it, so this resumes right after the second frame
+        seen = events[1]['id']
+        resumed = await client.get(f'/generate/{first.headers["x-stream-id"]}', headers={'Last-Event-ID': str(seen)})
+        return events, seen, resumed
+    events, seen, resumed = run(scenario)
+    assert resumed.status_code == 200
+    replayed = parse_sse(resumed.text)
+    assert replayed[0]['id'] > seen
+    assert replayed[-1] == events[-1]
+    # Frames may be coalesced differently on replay, but the text is the same
+    assert text_of(replayed) == text_of(event for event in events if event['id'] > seen)
+
+
+@pytest.mark.parametrize('path,body', [
+    ('/enhance', {'story': 'A fox met a crow.', 'stream': True}),
+    ('/continue', {'story': 'A fox met a crow.', 'stream': True}),
+])
+def test_enhance_and_continue_stream(path, body):
+    async def scenario(client):
+        return await client.post(path, json=body)
+    response = run(scenario)
+    events = parse_sse(response.text)
+    assert events[0]['type'] == 'init'
+    assert events[-1]['type'] == 'done'
+
+
+def test_json_requests_fall_through_to_flask():
+    async def scenario(client):
+        return await client.post('/enhance', json={'story': 'A fox met a crow.'})
+    response = run(scenario)
+    assert response.status_code == 200
+    assert response.json()['enhanced_story']
+
+
+@pytest.mark.parametrize('path,body', [
+    ('/generate', {}),
+    ('/generate', {'prompt': 'x', 'temperature': 'hot'}),
+    ('/enhance', {'stream': True}),
+    ('/continue', {'stream': True}),
+])
+def test_invalid_requests_are_rejected_before_streaming(path, body):
+    async def scenario(client):
+        return await client.post(path, json=body)
+    response = run(scenario)
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
+
+def test_resume_errors():
+    async def scenario(client):
+        missing = await client.get('/generate/no-such-stream')
+        bad_id = await client.get('/generate/no-such-stream', headers={'Last-Event-ID': 'x'})
+        return missing, bad_id
+    missing, bad_id = run(scenario)
+    assert missing.status_code == 404
+    assert bad_id.status_code == 400
+
+
+def test_other_routes_are_served_by_flask():
+    async def scenario(client):
+        return await client.get('/model-info')
+    assert run(scenario).status_code == 200
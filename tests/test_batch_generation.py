@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+import pytest
+
+from batch_generation import BatchRunner
+
+
+class Generator:
+    """Story generator that fails specs marked 'fail' and tracks its concurrency"""
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.fail = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, spec, user_id):
+        with self._lock:
+            self.calls.append(spec['prompt'])
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.02)
+            if spec['prompt'] in self.fail:
+                raise ValueError(f"bad spec {spec['prompt']}")
+            return {'title': spec['prompt'].title(), 'prompt': spec['prompt'], 'story': f"A story about {spec['prompt']}"}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def user_id(pool):
+    conn = pool.acquire()
+    try:
+        with conn:
+            return conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('b', 'b@x', 'x')").lastrowid
+    finally:
+        pool.release(conn)
+
+
+def specs(*prompts):
+    return [{'prompt': prompt} for prompt in prompts]
+
+
+def saved_prompts(pool, user_id):
+    conn = pool.acquire()
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT prompt FROM stories WHERE user_id = ?', (user_id,)))
+    finally:
+        pool.release(conn)
+
+
+def test_batch_runs_with_bounded_concurrency(pool, user_id):
+    generate = Generator()
+    inserted = []
+    runner = BatchRunner(pool, generate, max_concurrency=3, on_insert=inserted.append)
+    batch_id = runner.create(user_id, specs(*'abcdefgh'))
+    events = list(runner.run(batch_id, user_id, concurrency=10))
+
+    assert events[0] == {'type': 'batch', 'batch_id': batch_id, 'total': 8, 'finished': 0, 'pending': 8,
+                         'concurrency': 3}
+    assert sorted(event['index'] for event in events[1:-1]) == list(range(8))
+    assert events[-1] == {'type': 'done', 'batch_id': batch_id, 'succeeded': 8, 'failed': 0, 'inserted': 8}
+    assert generate.peak <= 3
+    # Every story is inserted in one go at the end
+    assert len(inserted) == 1 and len(inserted[0]) == 8
+    assert saved_prompts(pool, user_id) == list('abcdefgh')
+
+
+def test_resume_only_generates_unfinished_items(pool, user_id):
+    generate = Generator()
+    generate.fail = {'b'}
+    runner = BatchRunner(pool, generate)
+    batch_id = runner.create(user_id, specs('a', 'b', 'c'))
+    first = list(runner.run(batch_id, user_id))
+    assert first[-1]['succeeded'] == 2
+    assert [event['error'] for event in first if event.get('status') == 'error'] == ['bad spec b']
+
+    generate.fail = set()
+    generate.calls = []
+    second = list(runner.run(batch_id, user_id))
+    assert generate.calls == ['b']
+    assert sum(1 for event in second if event.get('resumed')) == 2
+    assert second[-1] == {'type': 'done', 'batch_id': batch_id, 'succeeded': 3, 'failed': 0, 'inserted': 1}
+    assert saved_prompts(pool, user_id) == ['a', 'b', 'c']
+
+
+def test_a_batch_runs_once_at_a_time(pool, user_id):
+    runner = BatchRunner(pool, Generator())
+    batch_id = runner.create(user_id, specs('a'))
+    running = runner.run(batch_id, user_id)
+    next(running)
+    with pytest.raises(RuntimeError):
+        next(runner.run(batch_id, user_id))
+    list(running)
+    assert next(runner.run(batch_id, user_id))['finished'] == 1
+
+
+def test_batches_belong_to_their_owner(pool, user_id):
+    runner = BatchRunner(pool, Generator())
+    batch_id = runner.create(user_id, specs('a'))
+    assert runner.exists(batch_id, user_id)
+    assert not runner.exists('missing', user_id)
+    with pytest.raises(PermissionError):
+        runner.exists(batch_id, user_id + 1)
+
+
+@pytest.mark.parametrize('items', [[], 'abc', [1, 2], [{'prompt': 'x'}] * 4])
+def test_invalid_batches_are_rejected(pool, user_id, items):
+    with pytest.raises(ValueError):
+        BatchRunner(pool, Generator(), max_items=3).create(user_id, items)
+
+
+def test_generate_batch_streams_ndjson(make_user, client):
+    user_client = make_user()
+    response = user_client.post('/generate-batch', json={
+        'items': [{'prompt': 'a tin soldier'}, {'prompt': 'a paper boat', 'is_public': True}, {}],
+        'concurrency': 2
+    })
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]['batch_id'] == response.headers['X-Batch-Id']
+    statuses = sorted(line['status'] for line in lines[1:-1])
+    assert statuses == ['error', 'ok', 'ok']
+    assert lines[-1]['inserted'] == 2
+    assert len(user_client.get('/my-stories').get_json()['stories']) == 2
+
+    assert client.post('/generate-batch', json={'items': [{'prompt': 'x'}]}).status_code == 401
+    assert user_client.post('/generate-batch', json={'items': []}).status_code == 400
+    assert user_client.post('/generate-batch', json=[{'prompt': 'x'}]).status_code == 400
+    other = make_user()
+    assert other.post('/generate-batch', json={'batch_id': lines[0]['batch_id']}).status_code == 403
@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+
+import pytest
+
+from cover_cache import CoverCache, HttpCoverFetcher, StubCoverFetcher, sniff_content_type
+
+
+class FakeFetcher:
+    """Returns canned bytes per URL and counts downloads"""
+
+    def __init__(self, images=None):
+        self.images = images or {}
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def fetch(self, url):
+        self.gate.wait(5)
+        self.calls += 1
+        if url not in self.images:
+            return StubCoverFetcher().fetch(url)
+        return self.images[url]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CoverCache(FakeFetcher(), directory=str(tmp_path), max_bytes=10 * 1024 * 1024)
+
+
+def test_sniffs_only_raster_formats():
+    assert sniff_content_type(b'\xff\xd8\xff\xe0') == 'image/jpeg'
+    assert sniff_content_type(b'\x89PNG\r\n\x1a\n') == 'image/png'
+    assert sniff_content_type(b'GIF89a') == 'image/gif'
+    assert sniff_content_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert sniff_content_type(b'<svg xmlns="http://www.w3.org/2000/svg">') == 'application/octet-stream'
+
+
+def test_stub_fetcher_draws_a_png():
+    data = StubCoverFetcher().fetch('https://example.com/a')
+    assert sniff_content_type(data[:16]) == 'image/png'
+    assert data == StubCoverFetcher().fetch('https://example.com/a')
+    assert data != StubCoverFetcher().fetch('https://example.com/b')
+
+
+def test_cover_is_downloaded_once(cache):
+    url = 'https://example.com/cover.png'
+    key = CoverCache.make_key(url)
+    path, content_type = cache.get_or_fetch(key, lambda: url)
+    assert content_type == 'image/png'
+    assert cache.get_or_fetch(key, lambda: pytest.fail('hit must not look up the source')) == (path, content_type)
+    assert cache.fetcher.calls == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_concurrent_requests_share_one_download(cache):
+    url = 'https://example.com/slow.png'
+    key = CoverCache.make_key(url)
+    cache.fetcher.gate.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch(key, lambda: url, timeout=5)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    cache.prefetch(key, url)
+    cache.fetcher.gate.set()
+    for thread in threads:
+        thread.join()
+    assert cache.fetcher.calls == 1
+    assert len(set(results)) == 1
+    assert cache.stats()['fetching'] == 0
+
+
+def test_unknown_cover_is_none(cache):
+    assert cache.get_or_fetch('0' * 40, lambda: None) is None
+
+
+def test_svg_and_other_non_images_are_refused(cache):
+    url = 'https://example.com/evil.svg'
+    cache.fetcher.images[url] = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    key = CoverCache.make_key(url)
+    with pytest.raises(ValueError):
+        cache.get_or_fetch(key, lambda: url)
+    assert not os.path.exists(cache.path_for(key))
+    assert cache.stats()['errors'] == 1
+
+
+class FakeResponse:
+    """Streamed HTTP response; counts how many blocks were read"""
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+        self.blocks_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        for start in range(0, len(self.body), size):
+            self.blocks_read += 1
+            yield self.body[start:start + size]
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.kwargs = None
+
+    def get(self, url, **kwargs):
+        self.kwargs = kwargs
+        return self.response
+
+
+def http_fetcher(body, headers, max_bytes=1000):
+    fetcher = HttpCoverFetcher(max_bytes=max_bytes)
+    fetcher._session = FakeSession(FakeResponse(body, headers))
+    return fetcher
+
+
+def test_http_fetcher_streams_images_under_the_cap():
+    fetcher = http_fetcher(b'GIF89a' + bytes(500), {'Content-Type': 'image/gif'})
+    assert fetcher.fetch('https://example.com/a') == b'GIF89a' + bytes(500)
+    assert fetcher.session.kwargs['stream'] is True
+
+
+@pytest.mark.parametrize('headers', [
+    {'Content-Type': 'text/html'},
+    {'Content-Type': 'image/svg+xml'},
+    {},
+    {'Content-Type': 'image/png', 'Content-Length': '5000'},
+])
+def test_http_fetcher_refuses_non_images_and_declared_oversize(headers):
+    fetcher = http_fetcher(b'\x89PNG\r\n\x1a\n', headers)
+    with pytest.raises(ValueError):
+        fetcher.fetch('https://example.com/a')
+    assert fetcher.session.response.blocks_read == 0
+
+
+def test_http_fetcher_stops_reading_past_the_cap():
+    fetcher = http_fetcher(b'GIF89a' + bytes(10 * 64 * 1024), {'Content-Type': 'image/gif'}, max_bytes=100 * 1024)
+    with pytest.raises(ValueError):
+        fetcher.fetch('https://example.com/a')
+    assert fetcher.session.response.blocks_read == 2
+
+
+def test_cover_evicted_before_it_is_opened_is_fetched_again(cache, monkeypatch):
+    url = 'https://example.com/evicted.png'
+    key = CoverCache.make_key(url)
+    cache.get_or_fetch(key, lambda: url)
+    lookup = cache._lookup
+
+    def evicting_lookup(key):
+        path = lookup(key)
+        if path is not None and cache.fetcher.calls == 1:
+            os.remove(path)
+        return path
+    monkeypatch.setattr(cache, '_lookup', evicting_lookup)
+    path, content_type = cache.get_or_fetch(key, lambda: url)
+    assert content_type == 'image/png'
+    assert os.path.exists(path)
+    assert cache.fetcher.calls == 2
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    images = {f'https://example.com/{i}': b'GIF89a' + bytes(1000) for i in range(5)}
+    cache = CoverCache(FakeFetcher(images), directory=str(tmp_path), max_bytes=3500)
+    keys = [CoverCache.make_key(url) for url in images]
+    for i, (key, url) in enumerate(zip(keys, images)):
+        cache.get_or_fetch(key, lambda: url)
+        # mtimes order the eviction, so give every file a distinct one
+        os.utime(cache.path_for(key), (i, i))
+    assert cache.stats()['size_bytes'] <= 3500
+    assert cache.stats()['evictions'] >= 2
+    assert not os.path.exists(cache.path_for(keys[0]))
+    assert os.path.exists(cache.path_for(keys[-1]))
+
+
+def test_generate_proxies_the_cover(client, sse):
+    response = client.post('/generate', json={'prompt': 'a lighthouse keeper', 'genre': 'fantasy'})
+    events = sse(response)
+    image = events[0]['image']
+    assert re.fullmatch(r'/cover/[0-9a-f]{40}', image)
+
+    cover = client.get(image)
+    assert cover.status_code == 200
+    assert cover.mimetype == 'image/png'
+    assert 'immutable' in cover.headers['Cache-Control']
+    assert client.get(image, headers={'If-None-Match': cover.headers['ETag']}).status_code == 304
+
+
+def test_unregistered_covers_are_not_found(client):
+    assert client.get(f'/cover/{"0" * 40}').status_code == 404
+    assert client.get('/cover/not-a-key').status_code == 404
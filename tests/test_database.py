@@ -0,0 +1,84 @@
+import threading
+
+import database
+from database import MIGRATIONS, ConnectionPool, connect, init_db, pending_migrations
+
+
+def test_connections_are_tuned(tmp_path):
+    conn = connect(str(tmp_path / 'tuned.db'))
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    finally:
+        conn.close()
+
+
+def test_migrations_apply_once(tmp_path):
+    path = str(tmp_path / 'migrated.db')
+    assert pending_migrations(path) == len(MIGRATIONS)
+    assert init_db(path) == len(MIGRATIONS)
+    assert init_db(path) == 0
+    assert pending_migrations(path) == 0
+
+
+def test_concurrent_startups_apply_each_migration_once(tmp_path):
+    path = str(tmp_path / 'race.db')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(init_db(path))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(results) == len(MIGRATIONS)
+
+
+def test_pool_reuses_connections_and_rolls_back_open_transactions(tmp_path):
+    path = str(tmp_path / 'pool.db')
+    init_db(path)
+    pool = ConnectionPool(path, size=2)
+    conn = pool.acquire()
+    conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('u', 'e', 'x')")
+    assert conn.in_transaction
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0
+    other = pool.acquire()
+    assert other is not conn
+    assert pool.created == 2
+    pool.release(conn)
+    pool.release(other)
+    pool.close_all()
+
+
+def test_list_queries_use_the_keyset_indexes(pool):
+    conn = pool.acquire()
+    try:
+        plans = {
+            'user': conn.execute('''
+                EXPLAIN QUERY PLAN SELECT id FROM stories WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC LIMIT 20
+            ''', (1,)).fetchall(),
+            'public': conn.execute('''
+                EXPLAIN QUERY PLAN SELECT id FROM stories WHERE is_public = 1
+                ORDER BY created_at DESC, id DESC LIMIT 20
+            ''').fetchall(),
+        }
+    finally:
+        pool.release(conn)
+    assert 'idx_stories_user_created_id' in str([tuple(row) for row in plans['user']])
+    assert 'idx_stories_public_created_id' in str([tuple(row) for row in plans['public']])
+    for plan in plans.values():
+        assert 'TEMP B-TREE' not in str([tuple(row) for row in plan])
+
+
+def test_insert_story_stores_a_list_excerpt(pool):
+    conn = pool.acquire()
+    try:
+        with conn:
+            database.insert_story(conn, 's1', None, {'title': 'T', 'prompt': 'p', 'story': 'x' * 500})
+        row = conn.execute('SELECT excerpt, word_count FROM stories WHERE id = ?', ('s1',)).fetchone()
+    finally:
+        pool.release(conn)
+    assert row['excerpt'] == 'x' * database.EXCERPT_LENGTH
+    assert row['word_count'] == 1
@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from fake_gemini import FakeGeminiClient
+
+CONFIG = SimpleNamespace(temperature=0.8, top_p=0.9)
+
+
+def client(**kwargs):
+    kwargs.setdefault('ttft', 0)
+    kwargs.setdefault('chunk_latency', 0)
+    return FakeGeminiClient(**kwargs)
+
+
+def test_text_depends_only_on_inputs_and_seed():
+    text = client().models.generate_content('m', 'a story', CONFIG).text
+    assert text == client().models.generate_content('other-model', 'a story', CONFIG).text
+    assert text != client(seed=1).models.generate_content('m', 'a story', CONFIG).text
+    assert text != client().models.generate_content('m', 'a different story', CONFIG).text
+    assert text != client().models.generate_content('m', 'a story', SimpleNamespace(temperature=0.2, top_p=0.9)).text
+
+
+def test_length_follows_the_prompt():
+    text = client().models.generate_content('m', 'Write roughly 25 words about owls', CONFIG).text
+    assert len(text.split()) == 25
+    assert text[0].isupper() and text.endswith('.')
+    assert len(client(default_words=12).models.generate_content('m', 'owls', CONFIG).text.split()) == 12
+
+
+def test_stream_yields_the_same_text_in_chunks():
+    fake = client(chunk_words=5)
+    whole = fake.models.generate_content('m', 'Write roughly 23 words', CONFIG).text
+    chunks = [chunk.text for chunk in fake.models.generate_content_stream('m', 'Write roughly 23 words', CONFIG)]
+    assert len(chunks) == 5
+    assert ''.join(chunks) == whole
+    assert fake.calls == 2
+
+
+def test_async_stream_matches_the_sync_stream():
+    fake = client()
+
+    async def collect():
+        stream = await fake.aio.models.generate_content_stream('m', 'owls', CONFIG)
+        return [chunk.text async for chunk in stream]
+    sync = [chunk.text for chunk in fake.models.generate_content_stream('m', 'owls', CONFIG)]
+    assert asyncio.run(collect()) == sync
+
+
+def test_faults_are_seeded_and_independent_of_the_prompt():
+    def outcomes(seed):
+        fake = client(seed=seed, error_rate=0.3, rate_limit_rate=0.3)
+        results = []
+        for _ in range(40):
+            try:
+                fake.models.generate_content('m', 'same prompt', CONFIG)
+                results.append('ok')
+            except Exception as e:
+                results.append(str(e)[:3])
+        return results
+    first = outcomes(7)
+    assert first == outcomes(7)
+    assert {'ok', '429', '500'} <= set(first)
+    assert first != outcomes(8)
+
+
+def test_rate_limit_error_looks_like_the_real_one():
+    with pytest.raises(Exception, match='429 RESOURCE_EXHAUSTED'):
+        client(rate_limit_rate=1.0).models.generate_content('m', 'owls', CONFIG)
+
+
+def test_from_env_reads_the_settings(monkeypatch):
+    monkeypatch.setenv('FAKE_GEMINI_SEED', '3')
+    monkeypatch.setenv('FAKE_GEMINI_CHUNK_WORDS', '2')
+    monkeypatch.setenv('FAKE_GEMINI_STALL_RATE', '0.5')
+    fake = FakeGeminiClient.from_env()
+    assert (fake.seed, fake.chunk_words, fake.stall_rate) == (3, 2, 0.5)
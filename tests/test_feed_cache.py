@@ -0,0 +1,127 @@
+import pytest
+
+import app as storygen
+import database
+import feed_cache
+from feed_cache import FeedCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(feed_cache, 'time', clock)
+    return clock
+
+
+class Feed:
+    """Versioned feed whose pages count how often they are built"""
+
+    def __init__(self):
+        self.version = 1
+        self.version_reads = 0
+        self.builds = 0
+
+    def load_version(self):
+        self.version_reads += 1
+        return self.version
+
+    def build(self):
+        self.builds += 1
+        return f'v{self.version} build {self.builds}'.encode()
+
+
+def test_pages_are_reused_until_the_version_changes(clock):
+    cache, feed = FeedCache(ttl=1.0), Feed()
+    body, etag = cache.get('page1', feed.load_version, feed.build)
+    assert cache.get('page1', feed.load_version, feed.build) == (body, etag)
+    assert etag == FeedCache.make_etag(body)
+    assert feed.builds == 1
+
+    clock.now += 5
+    assert cache.get('page1', feed.load_version, feed.build) == (body, etag)
+    feed.version = 2
+    clock.now += 5
+    new_body, new_etag = cache.get('page1', feed.load_version, feed.build)
+    assert new_etag != etag
+    assert feed.builds == 2
+
+
+def test_version_is_read_at_most_once_per_ttl(clock):
+    cache, feed = FeedCache(ttl=1.0), Feed()
+    for _ in range(10):
+        cache.get('page1', feed.load_version, feed.build)
+        clock.now += 0.05
+    assert feed.version_reads == 1
+    # A change elsewhere is only noticed after ttl, unless this worker invalidates
+    feed.version = 2
+    assert cache.get('page1', feed.load_version, feed.build)[0].startswith(b'v1')
+    cache.invalidate()
+    assert cache.get('page1', feed.load_version, feed.build)[0].startswith(b'v2')
+    assert feed.version_reads == 2
+
+
+def test_least_recently_used_pages_are_dropped(clock):
+    cache, feed = FeedCache(max_pages=2), Feed()
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get(key, feed.load_version, feed.build)
+    assert cache.stats()['pages'] == 2
+    builds = feed.builds
+    cache.get('a', feed.load_version, feed.build)
+    cache.get('b', feed.load_version, feed.build)
+    assert feed.builds == builds + 1
+
+
+def test_pages_built_against_a_replaced_version_are_not_stored(clock):
+    cache, feed = FeedCache(ttl=1.0), Feed()
+
+    def build_while_feed_changes():
+        feed.version = 2
+        cache.invalidate()
+        cache.get('other', feed.load_version, feed.build)
+        return feed.build()
+    cache.get('page1', feed.load_version, build_while_feed_changes)
+    assert 'page1' not in cache._pages
+    assert cache.stats()['version'] == 2
+
+
+def test_feed_version_bumps_only_for_public_feed_changes(pool):
+    conn = pool.acquire()
+    try:
+        with conn:
+            version = database.get_feed_version(conn)
+            database.insert_story(conn, 'private', None, {'prompt': 'p', 'story': 'text'})
+            assert database.get_feed_version(conn) == version
+            database.insert_story(conn, 'public', None, {'prompt': 'p', 'story': 'text', 'is_public': True})
+            assert database.get_feed_version(conn) == version + 1
+            # Re-encoding a body doesn't change what the feed shows
+            conn.execute("UPDATE stories SET story_format = story_format WHERE id = 'public'")
+            assert database.get_feed_version(conn) == version + 1
+            conn.execute("UPDATE stories SET title = 'New' WHERE id = 'public'")
+            assert database.get_feed_version(conn) == version + 2
+    finally:
+        pool.release(conn)
+
+
+def test_public_stories_support_conditional_requests(app, client, make_user):
+    response = client.get('/public-stories')
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+    assert client.get('/public-stories', headers={'If-None-Match': etag}).status_code == 304
+
+    user_client = make_user()
+    with user_client.session_transaction() as sess:
+        user_id = sess['user_id']
+    with app.app_context():
+        storygen.save_story(user_id, {'title': 'New', 'prompt': 'p', 'story': 'fresh', 'is_public': True},
+                            durable=True)
+    changed = client.get('/public-stories', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
@@ -0,0 +1,186 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app as storygen
+import job_queue
+from job_queue import JobNotFound, JobQueue, JobWorker
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, 'time', clock)
+    # Retries wait the full backoff, without jitter
+    monkeypatch.setattr(job_queue, 'random', SimpleNamespace(uniform=lambda low, high: high))
+    return clock
+
+
+@pytest.fixture
+def jobs(pool, clock):
+    return JobQueue(pool, visibility_timeout=30, result_ttl=60, max_attempts=3, backoff=5, max_backoff=8,
+                    max_pending=3)
+
+
+def test_claims_follow_priority_then_age(jobs, clock):
+    low = jobs.submit('enhance', {'n': 1}, priority=0)
+    clock.now += 1
+    high = jobs.submit('enhance', {'n': 2}, priority=5)
+    clock.now += 1
+    other = jobs.submit('continue', {'n': 3}, priority=9)
+
+    assert jobs.claim('w1', kinds=['enhance'])['id'] == high
+    job = jobs.claim('w1', kinds=['enhance'])
+    assert (job['id'], job['payload'], job['attempts']) == (low, {'n': 1}, 1)
+    assert jobs.claim('w1', kinds=['enhance']) is None
+    assert jobs.claim('w1')['id'] == other
+
+
+def test_expired_leases_are_reclaimed_and_the_stale_worker_cannot_finish(jobs, clock):
+    job_id = jobs.submit('enhance', {})
+    stale = jobs.claim('w1')
+    clock.now += 20
+    assert jobs.claim('w2') is None
+    clock.now += 11
+
+    fresh = jobs.claim('w2')
+    assert fresh['id'] == job_id
+    assert fresh['attempts'] == 2
+    assert not jobs.extend(stale)
+    assert not jobs.complete(stale, {'from': 'w1'})
+    assert jobs.complete(fresh, {'from': 'w2'})
+    assert jobs.get(job_id)['result'] == {'from': 'w2'}
+
+
+def test_extend_keeps_a_long_job_leased(jobs, clock):
+    jobs.submit('enhance', {})
+    job = jobs.claim('w1')
+    for _ in range(4):
+        clock.now += 20
+        assert jobs.extend(job)
+        assert jobs.claim('w2') is None
+    assert jobs.complete(job, {'ok': True})
+
+
+def test_jobs_that_keep_losing_their_worker_fail(jobs, clock):
+    job_id = jobs.submit('enhance', {})
+    for _ in range(3):
+        assert jobs.claim('w') is not None
+        clock.now += 31
+    assert jobs.claim('w') is None
+    job = jobs.get(job_id)
+    assert job['status'] == 'failed'
+    assert 'stopped responding' in job['error']
+
+
+def test_rate_limited_jobs_retry_with_capped_exponential_backoff(jobs, clock):
+    job_id = jobs.submit('enhance', {})
+    delays = []
+    for _ in range(2):
+        job = jobs.claim('w')
+        assert jobs.fail(job, 'RATE_LIMIT', retry=True)
+        queued = jobs.get(job_id)
+        assert queued['status'] == 'queued'
+        delays.append(queued['run_at'] - clock.now)
+        assert jobs.claim('w') is None
+        clock.now = queued['run_at']
+    assert delays == [5, 8]
+
+    job = jobs.claim('w')
+    assert job['attempts'] == 3
+    jobs.fail(job, 'RATE_LIMIT', retry=True)
+    assert jobs.get(job_id)['status'] == 'failed'
+
+
+def test_other_errors_fail_at_once(jobs):
+    job_id = jobs.submit('enhance', {})
+    jobs.fail(jobs.claim('w'), 'bad input')
+    assert (jobs.get(job_id)['status'], jobs.get(job_id)['error']) == ('failed', 'bad input')
+
+
+def test_each_client_has_a_pending_limit(jobs):
+    for _ in range(3):
+        jobs.submit('enhance', {}, client_key='alice')
+    with pytest.raises(OverflowError):
+        jobs.submit('enhance', {}, client_key='alice')
+    jobs.submit('enhance', {}, client_key='bob')
+    jobs.complete(jobs.claim('w'), {})
+    jobs.submit('enhance', {}, client_key='alice')
+
+
+def test_jobs_are_private_and_expire(jobs, clock):
+    job_id = jobs.submit('enhance', {}, user_id=1)
+    with pytest.raises(PermissionError):
+        jobs.get(job_id, user_id=2)
+    jobs.complete(jobs.claim('w'), {'done': True})
+    assert jobs.get(job_id, user_id=1)['status'] == 'done'
+    clock.now += 61
+    with pytest.raises(JobNotFound):
+        jobs.get(job_id, user_id=1)
+    assert jobs.purge() == 1
+
+
+def test_worker_runs_retries_and_fails_jobs(pool):
+    jobs = JobQueue(pool, visibility_timeout=30, backoff=0.01, max_backoff=0.01, max_attempts=3)
+    calls = {'flaky': 0}
+
+    def flaky(payload, user_key):
+        calls['flaky'] += 1
+        if calls['flaky'] == 1:
+            raise Exception('RATE_LIMIT')
+        return {'echo': payload['text']}
+
+    def broken(payload, user_key):
+        raise ValueError('no good')
+
+    ok_id = jobs.submit('flaky', {'text': 'hi'})
+    bad_id = jobs.submit('broken', {})
+    worker = JobWorker(jobs, {'flaky': flaky, 'broken': broken}, threads=2, poll_interval=0.01)
+    stop = threading.Event()
+    runner = threading.Thread(target=worker.run, args=(stop,))
+    runner.start()
+    try:
+        for _ in range(500):
+            if jobs.stats()['done'] + jobs.stats()['failed'] == 2:
+                break
+            stop.wait(0.01)
+    finally:
+        stop.set()
+        runner.join(10)
+    assert jobs.get(ok_id)['result'] == {'echo': 'hi'}
+    assert jobs.get(bad_id)['error'] == 'no good'
+    assert (worker.completed, worker.retried, worker.failed) == (1, 1, 1)
+    assert worker._running == {}
+
+
+def test_jobs_api(app, make_user, client):
+    user_client = make_user()
+    response = user_client.post('/jobs', json={'type': 'enhance', 'params': {'story': 'A fox met a crow.'}})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert response.headers['Location'].endswith(body['status_url'])
+    assert user_client.get(body['status_url']).get_json()['status'] == 'queued'
+    pending = user_client.get(body['result_url'])
+    assert pending.status_code == 202
+    assert int(pending.headers['Retry-After']) >= 1
+    assert client.get(body['status_url']).status_code == 403
+
+    job = storygen.job_queue.claim('test-worker', kinds=['enhance'])
+    handler = storygen.JOB_TYPES['enhance'][1]
+    with app.app_context():
+        storygen.job_queue.complete(job, handler(job['payload'], job['client_key']))
+    assert user_client.get(body['result_url']).get_json()['enhanced_story']
+
+    assert user_client.post('/jobs', json={'type': 'nope'}).status_code == 400
+    assert user_client.post('/jobs', json=['enhance']).status_code == 400
+    assert user_client.post('/jobs', json={'type': 'enhance', 'params': {}}).status_code == 400
+    assert user_client.get('/jobs/missing').status_code == 404
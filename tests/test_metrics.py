@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+import app as storygen
+from conftest import OPS_HEADERS
+from metrics import Counter, GeminiCall, Histogram, Registry, GEMINI_LATENCY
+
+
+def test_counter_renders_labelled_series():
+    counter = Counter('jobs_total', 'Jobs run', labels=('kind',))
+    counter.inc(kind='enhance')
+    counter.inc(2, kind='enhance')
+    counter.inc(kind='say "hi"\n')
+    assert counter.render() == [
+        '# HELP jobs_total Jobs run',
+        '# TYPE jobs_total counter',
+        'jobs_total{kind="enhance"} 3',
+        'jobs_total{kind="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('wait_seconds', 'Wait', buckets=(1, 0.1, 10))
+    for value in (0.05, 0.5, 0.7, 20):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'wait_seconds_bucket{le="0.1"} 1' in lines
+    assert 'wait_seconds_bucket{le="1"} 3' in lines
+    assert 'wait_seconds_bucket{le="10"} 3' in lines
+    assert 'wait_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'wait_seconds_sum 21.25' in lines
+    assert 'wait_seconds_count 4' in lines
+
+
+def test_timer_observes_elapsed_time():
+    histogram = Histogram('op_seconds', 'Op', labels=('op',))
+    with histogram.time(op='read') as timer:
+        pass
+    assert timer.elapsed >= 0
+    assert 'op_seconds_count{op="read"} 1' in histogram.render()
+
+
+def test_collectors_are_called_at_scrape_time():
+    registry = Registry()
+    state = {'depth': 1}
+    registry.add_collector(lambda: [('queue_depth', 'gauge', 'Queued items', [({'queue': 'jobs'}, state['depth'])])])
+    state['depth'] = 4
+    assert 'queue_depth{queue="jobs"} 4\n' in registry.render()
+
+
+def test_gemini_call_counts_chunks_once_finished():
+    call = GeminiCall('unit-test', 'fake-model')
+    call.chunk('')
+    call.chunk('héllo')
+    call.chunk(' world')
+    call.finish('ok')
+    call.finish('error')
+    assert (call.chunks, call.bytes) == (2, 12)
+    rendered = '\n'.join(GEMINI_LATENCY.render())
+    assert 'endpoint="unit-test",model="fake-model",outcome="ok"} 1' in rendered
+    assert 'endpoint="unit-test",model="fake-model",outcome="error"' not in rendered
+
+
+def test_metrics_endpoint_reports_requests_and_gemini_calls(client):
+    client.post('/enhance', json={'story': 'A fox met a crow.'})
+    response = client.get('/metrics', headers=OPS_HEADERS)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert re.search(r'storygen_http_request_seconds_count\{endpoint="enhance",method="POST",status="200"\} \d+', body)
+    assert re.search(r'storygen_gemini_call_seconds_count\{endpoint="enhance",[^}]*outcome="ok"\} \d+', body)
+    for line in body.splitlines():
+        assert line.startswith('#') or re.fullmatch(r'[a-z_]+(\{.*\})? [-+0-9.eInf]+', line), line
+
+
+@pytest.mark.parametrize('url', ['/metrics', '/cache-stats', '/rate-limit-stats', '/job-stats'])
+def test_ops_endpoints_need_the_token(client, url, monkeypatch):
+    assert client.get(url, headers=OPS_HEADERS).status_code == 200
+    assert client.get(url).status_code == 401
+    assert client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    monkeypatch.setattr(storygen, 'OPS_TOKEN', '')
+    assert client.get(url, headers=OPS_HEADERS).status_code == 404
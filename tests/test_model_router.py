@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import model_router
+from fake_gemini import FakeGeminiClient
+from model_router import (
+    CircuitBreaker, ModelRouter, ModelUnavailable, StreamCancelled, parse_model_chain
+)
+
+PROMPT = 'Write roughly 30 words about a lighthouse'
+
+
+@pytest.fixture(autouse=True)
+def fast_hedging(monkeypatch):
+    monkeypatch.setattr(model_router, 'HEDGE_MIN_DELAY', 0.05)
+    monkeypatch.setattr(model_router, 'CANCEL_CHECK_INTERVAL', 0.05)
+
+
+def is_rate_limit(error):
+    return '429' in str(error)
+
+
+class Backends:
+    """One fake Gemini client per model name, opened the way StoryGenerator opens streams"""
+
+    def __init__(self, **clients):
+        self.clients = clients
+        self.opened = []
+
+    def open_stream(self, model, timeout):
+        self.opened.append(model)
+        return (chunk.text for chunk in self.clients[model].models.generate_content_stream(model, PROMPT))
+
+    async def open_async_stream(self, model, timeout):
+        self.opened.append(model)
+        stream = await self.clients[model].aio.models.generate_content_stream(model, PROMPT)
+
+        async def texts():
+            async for chunk in stream:
+                yield chunk.text
+        return texts()
+
+    def send(self, model, timeout):
+        self.opened.append(model)
+        return self.clients[model].models.generate_content(model, PROMPT).text
+
+
+def fake(**kwargs):
+    kwargs.setdefault('ttft', 0)
+    kwargs.setdefault('chunk_latency', 0)
+    return FakeGeminiClient(**kwargs)
+
+
+def expected_text():
+    return fake().models.generate_content('m', PROMPT).text
+
+
+def read(router, backends, **kwargs):
+    return ''.join(router.stream(backends.open_stream, 'test', is_rate_limit, **kwargs))
+
+
+def test_parse_model_chain():
+    assert parse_model_chain('a:5, b ,c:2.5', 'd', 60) == [('a', 5.0), ('b', 60), ('c', 2.5)]
+    assert parse_model_chain('', 'd', 60) == [('d', 60)]
+
+
+def test_call_falls_back_on_errors_but_not_rate_limits():
+    backends = Backends(primary=fake(error_rate=1.0), backup=fake())
+    router = ModelRouter([('primary', 5), ('backup', 5)])
+    assert router.call(backends.send, 'test', is_rate_limit) == expected_text()
+    assert backends.opened == ['primary', 'backup']
+    assert router.stats()['fallbacks'] == 1
+
+    limited = Backends(primary=fake(rate_limit_rate=1.0), backup=fake())
+    with pytest.raises(Exception, match='429'):
+        ModelRouter([('primary', 5), ('backup', 5)]).call(limited.send, 'test', is_rate_limit)
+    assert limited.opened == ['primary']
+
+
+def test_stream_falls_back_when_the_first_model_fails():
+    backends = Backends(primary=fake(error_rate=1.0), backup=fake())
+    router = ModelRouter([('primary', 5), ('backup', 5)], hedge='off')
+    assert read(router, backends) == expected_text()
+    assert backends.opened == ['primary', 'backup']
+    assert router.stats()['fallbacks'] == 1
+
+
+def test_stream_falls_back_when_the_first_model_is_silent():
+    backends = Backends(primary=fake(ttft=5), backup=fake())
+    router = ModelRouter([('primary', 0.2), ('backup', 5)], hedge='off')
+    started = time.monotonic()
+    assert read(router, backends) == expected_text()
+    assert time.monotonic() - started < 2
+    assert router.stats()['fallbacks'] == 1
+
+
+def test_slow_first_chunk_is_hedged_and_the_backup_wins():
+    backends = Backends(primary=fake(ttft=3), backup=fake())
+    router = ModelRouter([('primary', 10), ('backup', 10)], hedge='0.1')
+    started = time.monotonic()
+    assert read(router, backends) == expected_text()
+    assert time.monotonic() - started < 2
+    stats = router.stats()
+    assert (stats['hedges'], stats['hedges_won'], stats['fallbacks']) == (1, 1, 0)
+
+
+def test_hedging_can_be_refused_and_waits_for_enough_samples():
+    backends = Backends(primary=fake(ttft=0.3), backup=fake())
+    router = ModelRouter([('primary', 10), ('backup', 10)], hedge='0.1')
+    read(router, backends, can_hedge=lambda: False)
+    assert backends.opened == ['primary']
+    assert router.stats()['hedges'] == 0
+
+    percentile = ModelRouter([('primary', 10)], hedge='p95')
+    assert percentile.hedge_delay(percentile.routes[0]) is None
+    for _ in range(model_router.HEDGE_MIN_SAMPLES):
+        percentile.routes[0].observe_ttft(0.5)
+    assert percentile.hedge_delay(percentile.routes[0]) == 0.5
+
+
+def test_errors_after_text_are_not_retried():
+    def open_stream(model, timeout):
+        yield 'Once upon'
+        raise RuntimeError('connection reset')
+    router = ModelRouter([('primary', 5), ('backup', 5)], hedge='off')
+    stream = router.stream(open_stream, 'test', is_rate_limit)
+    assert next(stream) == 'Once upon'
+    with pytest.raises(RuntimeError, match='connection reset'):
+        next(stream)
+    assert router.stats()['fallbacks'] == 0
+
+
+def test_a_stall_mid_stream_times_out():
+    release = threading.Event()
+
+    def open_stream(model, timeout):
+        yield 'Once upon'
+        release.wait(5)
+        yield ' a time'
+    router = ModelRouter([('primary', 0.2)], hedge='off')
+    stream = router.stream(open_stream, 'test', is_rate_limit)
+    assert next(stream) == 'Once upon'
+    with pytest.raises(TimeoutError):
+        next(stream)
+    release.set()
+
+
+def test_cancelled_streams_stop_while_the_model_is_silent():
+    backends = Backends(primary=fake(ttft=5))
+    cancelled = threading.Event()
+    router = ModelRouter([('primary', 10)], hedge='off')
+    threading.Timer(0.1, cancelled.set).start()
+    started = time.monotonic()
+    with pytest.raises(StreamCancelled):
+        read(router, backends, cancelled=cancelled)
+    assert time.monotonic() - started < 1
+
+
+def test_rate_limited_stream_is_raised_for_the_caller_to_retry():
+    backends = Backends(primary=fake(rate_limit_rate=1.0), backup=fake())
+    router = ModelRouter([('primary', 5), ('backup', 5)], hedge='off')
+    with pytest.raises(Exception, match='429'):
+        read(router, backends)
+    assert backends.opened == ['primary']
+    # A 429 says nothing about the model's health
+    assert router.routes[0].breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_skips_a_failing_model_until_its_reset_timeout():
+    backends = Backends(primary=fake(error_rate=1.0), backup=fake())
+    router = ModelRouter([('primary', 5), ('backup', 5)], hedge='off', failure_threshold=2, reset_timeout=0.2)
+    read(router, backends)
+    read(router, backends)
+    assert router.stats()['models'][0]['breaker'] == 'open'
+    backends.opened = []
+    read(router, backends)
+    assert backends.opened == ['backup']
+
+    time.sleep(0.25)
+    backends.clients['primary'] = fake()
+    backends.opened = []
+    read(router, backends)
+    # The half-open trial succeeded, so the model is back in the chain
+    assert backends.opened == ['primary']
+    assert router.routes[0].breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.opened == 2
+
+
+def test_no_healthy_model_is_unavailable():
+    router = ModelRouter([('primary', 5)], failure_threshold=1, reset_timeout=60)
+    router.routes[0].breaker.record_failure()
+    with pytest.raises(ModelUnavailable):
+        read(router, Backends(primary=fake()))
+
+
+def test_async_stream_falls_back_and_hedges():
+    async def collect(router, backends):
+        return ''.join([text async for text in router.astream(backends.open_async_stream, 'test', is_rate_limit)])
+
+    failing = Backends(primary=fake(error_rate=1.0), backup=fake())
+    router = ModelRouter([('primary', 5), ('backup', 5)], hedge='off')
+    assert asyncio.run(collect(router, failing)) == expected_text()
+    assert router.stats()['fallbacks'] == 1
+
+    slow = Backends(primary=fake(ttft=3), backup=fake())
+    router = ModelRouter([('primary', 10), ('backup', 10)], hedge='0.1')
+    assert asyncio.run(collect(router, slow)) == expected_text()
+    assert router.stats()['hedges_won'] == 1
+
+
+def test_async_hedging_awaits_can_hedge():
+    asked = []
+
+    async def refuse():
+        asked.append(True)
+        return False
+
+    async def collect(router, backends):
+        stream = router.astream(backends.open_async_stream, 'test', is_rate_limit, can_hedge=refuse)
+        return ''.join([text async for text in stream])
+
+    backends = Backends(primary=fake(ttft=0.3), backup=fake())
+    router = ModelRouter([('primary', 10), ('backup', 10)], hedge='0.1')
+    assert asyncio.run(collect(router, backends)) == expected_text()
+    assert asked == [True]
+    assert backends.opened == ['primary']
+    assert router.stats()['hedges'] == 0
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def story_gen(app):
+    import app as storygen
+    return storygen.story_gen
+
+
+def test_endings_are_returned_as_json_by_default(client):
+    response = client.post('/multiple-endings', json={'story': 'A fox found a key.', 'num_endings': 3})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['num_endings'] == 3
+    assert len(set(body['endings'])) == 3
+
+
+def test_endings_stream_as_each_one_finishes(client, sse):
+    response = client.post('/multiple-endings', json={'story': 'A fox found a key.', 'num_endings': 3, 'stream': True})
+    assert response.mimetype == 'text/event-stream'
+    events = sse(response)
+    assert events[0]['type'] == 'init'
+    assert sorted(event['index'] for event in events if event['type'] == 'ending') == [0, 1, 2]
+    assert events[-1]['type'] == 'done'
+    assert (events[-1]['num_endings'], events[-1]['failed']) == (3, 0)
+
+
+def test_invalid_ending_count_is_rejected(client):
+    response = client.post('/multiple-endings', json={'story': 'A fox.', 'num_endings': 'many'})
+    assert response.status_code == 400
+
+
+def test_one_failed_ending_does_not_fail_the_others(story_gen, monkeypatch):
+    def call(prompt, temperature, *args, **kwargs):
+        if round(temperature, 1) == 0.8:
+            raise Exception('upstream broke')
+        return f'ending at {temperature:.1f}'
+    monkeypatch.setattr(story_gen, '_call_gemini', call)
+    results = sorted(story_gen.iter_multiple_endings('story', 3), key=lambda result: result['index'])
+    assert results[0] == {'index': 0, 'ending': 'ending at 0.7'}
+    assert results[1] == {'index': 1, 'error': 'upstream broke'}
+    assert results[2] == {'index': 2, 'ending': 'ending at 0.9'}
+    assert story_gen.generate_multiple_endings('story', 3) == ['ending at 0.7', 'ending at 0.9']
+
+
+def test_slow_endings_time_out_individually(story_gen, monkeypatch):
+    release = threading.Event()
+
+    def call(prompt, temperature, *args, **kwargs):
+        if round(temperature, 1) == 0.7:
+            release.wait(5)
+        return 'done'
+    monkeypatch.setattr(story_gen, '_call_gemini', call)
+    try:
+        results = {result['index']: result for result in story_gen.iter_multiple_endings('story', 2, timeout=0.3)}
+    finally:
+        release.set()
+    assert results[0] == {'index': 0, 'error': 'TIMEOUT'}
+    assert results[1] == {'index': 1, 'ending': 'done'}
@@ -0,0 +1,94 @@
+import pytest
+
+import app as storygen
+
+
+@pytest.fixture
+def author(app, make_user):
+    """A logged-in user with a dozen stories, half of them public"""
+    user_client = make_user()
+    with user_client.session_transaction() as sess:
+        user_id = sess['user_id']
+    story_ids = []
+    with app.app_context():
+        for i in range(12):
+            story_ids.append(storygen.save_story(user_id, {
+                'title': f'Story {i}', 'prompt': 'p', 'story': f'Once upon a time {i}',
+                'genre': 'fantasy', 'is_public': i % 2 == 0
+            }, durable=True))
+    user_client.story_ids = story_ids
+    return user_client
+
+
+def read_all(client, url, limit):
+    """Follow next_cursor until the last page, returning every story id in order"""
+    ids, cursor = [], None
+    while True:
+        query = {'limit': limit}
+        if cursor:
+            query['cursor'] = cursor
+        response = client.get(url, query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body['stories']) <= limit
+        ids += [story['id'] for story in body['stories']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_cursor_round_trip():
+    cursor = storygen.encode_cursor('2024-01-01 00:00:00', 'abc')
+    assert storygen.decode_cursor(cursor) == ('2024-01-01 00:00:00', 'abc')
+
+
+@pytest.mark.parametrize('cursor', ['not-base64!', 'e30=', storygen.encode_cursor('a', 'b')[:-4]])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        storygen.decode_cursor(cursor)
+
+
+def test_my_stories_pages_without_gaps_or_overlap(author):
+    ids = read_all(author, '/my-stories', limit=5)
+    assert len(ids) == len(set(ids)) == 12
+    assert set(ids) == set(author.story_ids)
+    # Stories saved within the same second are ordered by id
+    stories = author.get('/my-stories', query_string={'limit': 100}).get_json()['stories']
+    assert [story['id'] for story in stories] == ids
+    keys = [(story['created_at'], story['id']) for story in stories]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_public_stories_pages_only_public_rows(author, client):
+    ids = read_all(client, '/public-stories', limit=4)
+    assert len(ids) == len(set(ids))
+    public = {story_id for i, story_id in enumerate(author.story_ids) if i % 2 == 0}
+    assert public <= set(ids)
+    assert not set(author.story_ids[1::2]) & set(ids)
+
+
+def test_favorites_page_in_favorite_order(author, make_user):
+    reader = make_user()
+    favorited = author.story_ids[::2]
+    for story_id in favorited:
+        assert reader.post(f'/favorite/{story_id}').get_json() == {'is_favorite': True}
+    ids = read_all(reader, '/favorites', limit=2)
+    assert sorted(ids) == sorted(favorited)
+    assert len(ids) == len(set(ids))
+
+
+def test_list_endpoints_return_excerpts_not_bodies(author):
+    story = author.get('/my-stories').get_json()['stories'][0]
+    assert 'story' not in story
+    assert story['excerpt'].startswith('Once upon a time')
+
+
+def test_bad_cursor_is_a_client_error(author, client):
+    assert author.get('/my-stories?cursor=garbage').status_code == 400
+    assert client.get('/public-stories?cursor=garbage').status_code == 400
+    assert author.get('/favorites?cursor=garbage').status_code == 400
+
+
+def test_list_endpoints_require_login(client):
+    assert client.get('/my-stories').status_code == 401
+    assert client.get('/favorites').status_code == 401
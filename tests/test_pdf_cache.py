@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+import app as storygen
+from pdf_export import PDFCache
+
+
+class CountingPDFCache(PDFCache):
+    """PDFCache whose renders are counted and can be held at a gate"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.renders = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _produce(self, title, story_text):
+        self.gate.wait(5)
+        self.renders += 1
+        return super()._produce(title, story_text)
+
+
+def test_key_depends_on_title_and_text():
+    key = PDFCache.make_key('Title', 'Once upon a time')
+    assert key == PDFCache.make_key('Title', 'Once upon a time')
+    assert key != PDFCache.make_key('Title', 'Once upon a time.')
+    assert key != PDFCache.make_key('Title2', 'Once upon a time')
+    # The separator keeps the title/text boundary from being ambiguous
+    assert PDFCache.make_key('ab', 'c') != PDFCache.make_key('a', 'bc')
+
+
+def test_second_export_is_a_hit(tmp_path):
+    cache = CountingPDFCache(directory=str(tmp_path))
+    key, path = cache.get_or_render('Title', 'Once upon a time')
+    assert open(path, 'rb').read(5) == b'%PDF-'
+    assert cache.get_or_render('Title', 'Once upon a time') == (key, path)
+    assert cache.renders == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_concurrent_exports_share_one_render(tmp_path):
+    cache = CountingPDFCache(directory=str(tmp_path))
+    cache.gate.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_render('T', 'text')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    cache.prerender('T', 'text')
+    cache.gate.set()
+    for thread in threads:
+        thread.join()
+    assert cache.renders == 1
+    assert len(set(results)) == 1
+    assert cache.stats()['rendering'] == 0
+
+
+def test_prerender_warms_the_cache(tmp_path):
+    cache = CountingPDFCache(directory=str(tmp_path))
+    key = cache.prerender('T', 'text')
+    deadline = time.monotonic() + 5
+    while not os.path.exists(cache.path_for(key)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.exists(cache.path_for(key))
+    cache.get_or_render('T', 'text')
+    assert cache.renders == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_export_route_serves_a_revalidatable_pdf(app, make_user, client):
+    user_client = make_user()
+    with user_client.session_transaction() as sess:
+        user_id = sess['user_id']
+    with app.app_context():
+        private_id = storygen.save_story(user_id, {'title': 'Mine', 'prompt': 'p', 'story': 'secret'}, durable=True)
+
+    response = user_client.get(f'/export-pdf/{private_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.get_data().startswith(b'%PDF-')
+    assert response.headers['ETag'] == f'"{PDFCache.make_key("Mine", "secret")}"'
+    assert 'private' in response.headers['Cache-Control']
+
+    revalidated = user_client.get(f'/export-pdf/{private_id}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get(f'/export-pdf/{private_id}').status_code == 403
+    assert client.get('/export-pdf/missing').status_code == 404
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, replay_chunks
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, 'time', clock)
+    return clock
+
+
+def test_key_covers_every_sampling_input():
+    key = ResponseCache.make_key('prompt', 'model', 0.8, 0.9)
+    assert key == ResponseCache.make_key('prompt', 'model', 0.8, 0.9)
+    assert key != ResponseCache.make_key('prompt', 'model', 0.7, 0.9)
+    assert key != ResponseCache.make_key('prompt', 'model', 0.8, 0.95)
+    assert key != ResponseCache.make_key('prompt', 'other-model', 0.8, 0.9)
+    assert key != ResponseCache.make_key('other prompt', 'model', 0.8, 0.9)
+
+
+def test_memory_tier_evicts_least_recently_used(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl=60)
+    cache.set('a', 'A')
+    clock.now += 60
+    assert cache.get('a') == 'A'
+    clock.now += 1
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['memory_entries']) == (1, 1, 0)
+
+
+def test_persistent_tier_is_shared_between_instances(clock, tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(db_path=path).set('a', 'A')
+    other = ResponseCache(db_path=path)
+    assert other.get('a') == 'A'
+    assert other.stats()['memory_entries'] == 1
+
+
+def test_async_access_reaches_sqlite_off_the_event_loop(clock, tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.db')
+    writer, reader = ResponseCache(db_path=path), ResponseCache(db_path=path)
+    threads = set()
+    connect = ResponseCache._connect
+
+    def tracking_connect(self):
+        threads.add(threading.get_ident())
+        return connect(self)
+    monkeypatch.setattr(ResponseCache, '_connect', tracking_connect)
+
+    async def main():
+        await writer.set_async('a', 'A')
+        return await reader.get_async('a'), threading.get_ident()
+
+    value, loop_thread = asyncio.run(main())
+    assert value == 'A'
+    assert threads and loop_thread not in threads
+
+
+def test_promoted_entry_keeps_its_creation_time(clock, tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(ttl=60, db_path=path).set('a', 'A')
+    clock.now += 50
+    other = ResponseCache(ttl=60, db_path=path)
+    assert other.get('a') == 'A'
+    # Promotion to memory must not restart the TTL
+    clock.now += 20
+    assert other.get('a') is None
+
+
+def test_persistent_tier_is_capped(clock, tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = ResponseCache(db_path=path, db_max_entries=2)
+    for key in 'abc':
+        clock.now += 1
+        cache.set(key, key.upper())
+    fresh = ResponseCache(db_path=path)
+    assert fresh.get('a') is None
+    assert fresh.get('b') == 'B'
+    assert fresh.get('c') == 'C'
+
+
+def test_replay_chunks_splits_on_whitespace():
+    text = ' '.join(['word'] * 50)
+    chunks = list(replay_chunks(text, chunk_size=16))
+    assert ''.join(chunks) == text
+    assert all(len(chunk) <= 16 for chunk in chunks)
+    assert all(chunk.endswith(' ') for chunk in chunks[:-1])
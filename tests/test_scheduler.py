@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import MemoryBuckets, QueueStatus, RateLimitScheduler, SQLiteBuckets, estimate_tokens
+
+
+class ManualBuckets:
+    """Buckets that grant exactly as many slots as the test releases"""
+
+    blocking = False
+
+    def __init__(self):
+        self.available = 0
+        self._lock = threading.Lock()
+
+    def try_consume(self, tokens):
+        with self._lock:
+            if self.available > 0:
+                self.available -= 1
+                return 0.0
+            return 0.05
+
+    def release(self):
+        with self._lock:
+            self.available += 1
+
+    def block(self, seconds):
+        pass
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.01)
+
+
+def test_request_bucket_refills_at_the_configured_rate():
+    buckets = MemoryBuckets(rpm=2, tpm=0)
+    assert buckets.try_consume(1) == 0
+    assert buckets.try_consume(1) == 0
+    wait = buckets.try_consume(1)
+    assert 29 < wait <= 30
+
+
+def test_token_bucket_limits_large_calls():
+    buckets = MemoryBuckets(rpm=0, tpm=600)
+    assert buckets.try_consume(500) == 0
+    # 400 more tokens need 300 of refill at 10 tokens per second
+    assert buckets.try_consume(400) == pytest.approx(30, abs=0.1)
+    # A call bigger than the whole budget waits for a full bucket rather than forever
+    assert buckets.try_consume(10 ** 6) <= 60
+
+
+def test_block_pauses_every_caller():
+    buckets = MemoryBuckets(rpm=100, tpm=0)
+    buckets.block(5)
+    assert 4 < buckets.try_consume(1) <= 5
+
+
+def test_sqlite_buckets_are_shared_between_schedulers(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    first = SQLiteBuckets(rpm=2, tpm=0, db_path=path)
+    second = SQLiteBuckets(rpm=2, tpm=0, db_path=path)
+    assert first.try_consume(1) == 0
+    assert second.try_consume(1) == 0
+    assert first.try_consume(1) > 0
+    second.block(30)
+    assert first.try_consume(1) > 29
+
+
+def test_disabled_scheduler_never_waits():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    assert list(scheduler.wait('user', 100)) == []
+    assert scheduler.try_acquire(100)
+
+
+def test_queued_callers_get_their_position_and_eta():
+    scheduler = RateLimitScheduler(rpm=1, tpm=0, max_wait=300)
+    scheduler.acquire('a', 1)
+    status = next(scheduler.wait('b', 1))
+    assert isinstance(status, QueueStatus)
+    assert status.position == 0
+    assert 55 < status.eta <= 60
+
+
+def test_callers_are_rejected_when_the_wait_is_too_long():
+    scheduler = RateLimitScheduler(rpm=1, tpm=0, max_wait=10)
+    scheduler.acquire('a', 1)
+    with pytest.raises(Exception, match='RATE_LIMIT'):
+        scheduler.acquire('b', 1)
+    assert scheduler.stats()['rejected'] == 1
+    assert scheduler.stats()['queued'] == 0
+
+
+def test_queue_is_served_round_robin_across_users():
+    scheduler = RateLimitScheduler(rpm=60, tpm=0)
+    scheduler.buckets = ManualBuckets()
+    granted = []
+    threads = []
+    for user in ('a', 'a', 'a', 'b'):
+        queued = scheduler.stats()['queued']
+        thread = threading.Thread(target=lambda user=user: (scheduler.acquire(user, 1), granted.append(user)))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.stats()['queued'] == queued + 1)
+    for count in range(1, 5):
+        scheduler.buckets.release()
+        wait_until(lambda: len(granted) == count)
+    for thread in threads:
+        thread.join()
+    # After a grant the served user moves to the back, so b does not wait behind all of a's calls
+    assert granted == ['a', 'b', 'a', 'a']
+
+
+def test_try_acquire_never_jumps_the_queue():
+    scheduler = RateLimitScheduler(rpm=60, tpm=0)
+    scheduler.buckets = ManualBuckets()
+    waiter = threading.Thread(target=scheduler.acquire, args=('a', 1))
+    waiter.start()
+    wait_until(lambda: scheduler.stats()['queued'] == 1)
+    scheduler.buckets.release()
+    scheduler.buckets.release()
+    waiter.join()
+    assert scheduler.try_acquire(1)
+    assert not scheduler.try_acquire(1)
+
+
+class SlowSharedBuckets(ManualBuckets):
+    """Stands in for SQLiteBuckets: every call may wait on another process"""
+
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def try_consume(self, tokens):
+        self.threads.add(threading.get_ident())
+        time.sleep(0.05)
+        return super().try_consume(tokens)
+
+
+def test_async_try_acquire_keeps_blocking_buckets_off_the_event_loop():
+    scheduler = RateLimitScheduler(rpm=60, tpm=0)
+    scheduler.buckets = SlowSharedBuckets()
+    scheduler.buckets.release()
+
+    async def main():
+        return await scheduler.try_acquire_async(1), await scheduler.try_acquire_async(1), threading.get_ident()
+
+    granted, refused, loop_thread = asyncio.run(main())
+    assert granted and not refused
+    assert loop_thread not in scheduler.buckets.threads
+
+
+def test_rate_limit_backoff_grows_and_resets():
+    scheduler = RateLimitScheduler(rpm=60, tpm=0, backoff_base=2.0, backoff_max=60.0)
+    delays = [scheduler.report_rate_limit() for _ in range(4)]
+    for attempt, delay in enumerate(delays):
+        assert 2.0 * 2 ** attempt / 2 <= delay <= 2.0 * 2 ** attempt
+    scheduler.report_success()
+    assert scheduler.report_rate_limit() <= 2.0
+    assert scheduler.buckets.try_consume(1) > 0
+
+
+@pytest.mark.parametrize('use_sqlite', [False, True])
+def test_async_waiters_do_not_block_the_event_loop(tmp_path, use_sqlite):
+    scheduler = RateLimitScheduler(rpm=600, tpm=0, db_path=str(tmp_path / 'limits.db') if use_sqlite else None)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.ensure_future(ticker())
+        statuses = [status async for status in scheduler.wait_async('user', 1)]
+        # 600 rpm is one call every 0.1s once the initial burst is used up
+        scheduler.buckets.block(0.3)
+        statuses += [status async for status in scheduler.wait_async('user', 1)]
+        ticking.cancel()
+        return statuses, ticks
+
+    statuses, ticks = asyncio.run(main())
+    assert statuses and all(isinstance(status, QueueStatus) for status in statuses)
+    assert ticks >= 10
+    assert scheduler.stats()['granted'] == 2
+
+
+def test_estimate_tokens_is_about_four_characters_each():
+    assert estimate_tokens('') == 1
+    assert estimate_tokens('x' * 400) == 100
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+import app as storygen
+
+
+def unique_word():
+    """A word no other test's stories contain"""
+    return 'zq' + os.urandom(4).hex()
+
+
+@pytest.fixture
+def save(app):
+    def save(user_client, story, **fields):
+        with user_client.session_transaction() as sess:
+            user_id = sess['user_id']
+        with app.app_context():
+            return storygen.save_story(user_id, dict({'title': 'Untitled', 'prompt': 'p', 'story': story}, **fields),
+                                       durable=True)
+    return save
+
+
+def search(client, **query):
+    response = client.get('/search', query_string=query)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_search_covers_public_stories_and_your_own(make_user, client, save):
+    word = unique_word()
+    author, reader = make_user(), make_user()
+    public = save(author, f'A public tale of the {word}.', is_public=True)
+    private = save(author, f'A private tale of the {word}.')
+    own = save(reader, f'The reader wrote about a {word} too.')
+
+    assert {s['id'] for s in search(reader, q=word)['stories']} == {public, own}
+    assert {s['id'] for s in search(author, q=word)['stories']} == {public, private}
+    assert {s['id'] for s in search(client, q=word)['stories']} == {public}
+
+
+def test_snippets_are_escaped_and_highlighted(make_user, save):
+    word = unique_word()
+    author = make_user()
+    save(author, f'The <b>bold</b> {word} crossed the river.')
+    story = search(author, q=word)['stories'][0]
+    assert f'<mark>{word}</mark>' in story['snippet']
+    assert '&lt;b&gt;bold&lt;/b&gt;' in story['snippet']
+    assert 'story' not in story
+    assert story['score'] > 0
+
+
+def test_prefix_queries_and_filters(make_user, save):
+    word = unique_word()
+    author = make_user()
+    mystery = save(author, f'{word}lighthouse keeper', genre='mystery', is_public=True)
+    fantasy = save(author, f'{word}lantern bearer', genre='fantasy')
+
+    assert search(author, q=word)['stories'] == []
+    assert {s['id'] for s in search(author, q=f'{word}*')['stories']} == {mystery, fantasy}
+    assert [s['id'] for s in search(author, q=f'{word}*', genre='fantasy')['stories']] == [fantasy]
+    assert [s['id'] for s in search(author, q=f'{word}*', visibility='public')['stories']] == [mystery]
+    assert [s['id'] for s in search(author, q=f'{word}*', visibility='private')['stories']] == [fantasy]
+    assert len(search(author, q=f'{word}*', owner='me')['stories']) == 2
+
+
+def test_search_results_page_by_rank(make_user, save):
+    word = unique_word()
+    author = make_user()
+    ids = {save(author, f'{word} ' * (i + 1) + 'and some other words') for i in range(7)}
+    seen, cursor = [], None
+    while True:
+        query = {'q': word, 'limit': 3}
+        if cursor:
+            query['cursor'] = cursor
+        page = search(author, **query)
+        seen += page['stories']
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert {s['id'] for s in seen} == ids
+    assert len(seen) == 7
+    scores = [s['score'] for s in seen]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_deleted_stories_leave_the_index(make_user, save):
+    word = unique_word()
+    author = make_user()
+    story_id = save(author, f'Soon to be gone: {word}.', title=f'Title {word}')
+    assert len(search(author, q=word)['stories']) == 1
+    assert author.delete(f'/story/{story_id}').status_code == 200
+    assert search(author, q=word)['stories'] == []
+
+
+@pytest.mark.parametrize('query', [
+    {'q': ''}, {'q': '***'}, {'q': 'fox', 'visibility': 'secret'}, {'q': 'fox', 'owner': 'me'}
+])
+def test_bad_searches_are_client_errors(client, query):
+    assert client.get('/search', query_string=query).status_code == 400
+
+
+def test_match_queries_quote_every_term():
+    assert storygen.build_match_query('fox "AND" crow*') == '"fox" """AND""" "crow"*'
+    with pytest.raises(ValueError):
+        storygen.build_match_query('   ')
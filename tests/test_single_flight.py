@@ -0,0 +1,145 @@
+import asyncio
+import queue
+import threading
+
+import pytest
+
+from single_flight import SingleFlight
+
+# join() is a generator, so a request subscribes when its first item is read
+
+
+class Upstream:
+    """Upstream stream fed item by item from the test"""
+
+    def __init__(self):
+        self.items = queue.Queue()
+        self.starts = 0
+        self.closed = threading.Event()
+
+    def start(self):
+        self.starts += 1
+        return self.stream()
+
+    def stream(self):
+        try:
+            while True:
+                item = self.items.get(timeout=5)
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.closed.set()
+
+
+def test_identical_requests_share_one_upstream():
+    flights = SingleFlight()
+    upstream = Upstream()
+    first = flights.join('k', upstream.start)
+    upstream.items.put('Once')
+    assert next(first) == 'Once'
+
+    # A late joiner still reads the whole response from the start
+    second = flights.join('k', upstream.start)
+    assert next(second) == 'Once'
+    upstream.items.put(' upon a time')
+    upstream.items.put(None)
+    assert ''.join(second) == ' upon a time'
+    assert ''.join(first) == ' upon a time'
+    assert upstream.starts == 1
+    assert flights.stats() == {'in_flight': 0, 'subscribers': 0, 'leaders': 1, 'followers': 1}
+
+
+def test_finished_flights_are_not_reused():
+    flights = SingleFlight()
+    upstream = Upstream()
+    upstream.items.put('a')
+    upstream.items.put(None)
+    assert list(flights.join('k', upstream.start)) == ['a']
+    upstream.items.put('b')
+    upstream.items.put(None)
+    assert list(flights.join('k', upstream.start)) == ['b']
+    assert upstream.starts == 2
+
+
+def test_errors_reach_every_subscriber_after_the_text():
+    flights = SingleFlight()
+    upstream = Upstream()
+    first = flights.join('k', upstream.start)
+    upstream.items.put('partial')
+    assert next(first) == 'partial'
+    second = flights.join('k', upstream.start)
+    assert next(second) == 'partial'
+    upstream.items.put(RuntimeError('RATE_LIMIT'))
+    with pytest.raises(RuntimeError, match='RATE_LIMIT'):
+        next(first)
+    with pytest.raises(RuntimeError, match='RATE_LIMIT'):
+        next(second)
+
+
+def test_status_is_only_sent_before_text():
+    flights = SingleFlight()
+    upstream = Upstream()
+    first = flights.join('k', upstream.start)
+    upstream.items.put(('queued', 2))
+    assert next(first) == ('queued', 2)
+    upstream.items.put('text')
+    assert next(first) == 'text'
+    upstream.items.put(('queued', 1))
+    upstream.items.put(None)
+    assert list(first) == []
+
+
+def test_upstream_is_closed_once_every_subscriber_leaves():
+    flights = SingleFlight()
+    upstream = Upstream()
+    stream = flights.join('k', upstream.start)
+    upstream.items.put('a')
+    assert next(stream) == 'a'
+    stream.close()
+    assert flights.stats()['in_flight'] == 0
+    upstream.items.put('b')
+    assert upstream.closed.wait(5)
+
+    # The next identical request starts its own upstream
+    fresh = Upstream()
+    fresh.items.put('c')
+    fresh.items.put(None)
+    assert list(flights.join('k', fresh.start)) == ['c']
+
+
+def test_cancelled_subscriber_leaves_while_the_upstream_is_silent():
+    flights = SingleFlight()
+    upstream = Upstream()
+    cancelled = threading.Event()
+    stream = flights.join('k', upstream.start, cancelled)
+    upstream.items.put('a')
+    assert next(stream) == 'a'
+    threading.Timer(0.1, cancelled.set).start()
+    assert list(stream) == []
+    assert flights.stats()['in_flight'] == 0
+    upstream.items.put('b')
+    assert upstream.closed.wait(5)
+
+
+def test_async_subscribers_share_with_sync_ones():
+    flights = SingleFlight()
+    upstream = Upstream()
+    sync_stream = flights.join('k', upstream.start)
+    upstream.items.put('Once')
+    assert next(sync_stream) == 'Once'
+
+    async def read():
+        return [item async for item in flights.join_async('k', upstream.start)]
+
+    async def main():
+        reader = asyncio.ensure_future(read())
+        await asyncio.sleep(0.05)
+        upstream.items.put(' more')
+        upstream.items.put(None)
+        return await reader
+    assert ''.join(asyncio.run(main())) == 'Once more'
+    assert list(sync_stream) == [' more']
+    assert upstream.starts == 1
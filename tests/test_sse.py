@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import threading
+import time
+import zlib
+
+import pytest
+
+from conftest import parse_sse
+from sse import (
+    END, HEARTBEAT, IDLE, FrameAssembler, SSEPolicy, ThreadedSource, aiter_frames, iter_frames, sse_event
+)
+
+# Nothing is flushed by time unless a test asks for it
+SLOW = SSEPolicy(max_bytes=64, max_delay=60, heartbeat=0)
+
+
+def chunks(*texts):
+    return [{'type': 'chunk', 'text': text} for text in texts]
+
+
+def test_event_framing():
+    assert sse_event({'type': 'done'}) == 'data: {"type": "done"}\n\n'
+    assert sse_event({'type': 'done'}, 7) == 'id: 7\ndata: {"type": "done"}\n\n'
+
+
+def test_first_chunk_is_sent_immediately_and_later_ones_are_merged():
+    events = [{'type': 'init'}] + chunks('Once', ' upon', ' a', ' time') + [{'type': 'done'}]
+    body = b''.join(iter_frames(events, SLOW)).decode()
+    assert parse_sse(body) == [
+        {'type': 'init'},
+        {'type': 'chunk', 'text': 'Once'},
+        {'type': 'chunk', 'text': ' upon a time'},
+        {'type': 'done'},
+    ]
+
+
+def test_merged_frames_are_capped_and_keep_the_last_id():
+    assembler = FrameAssembler(SSEPolicy(max_bytes=10, max_delay=60))
+    assert assembler.push({'type': 'chunk', 'text': 'first', 'id': 1})
+    assert assembler.push({'type': 'chunk', 'text': 'abcd', 'id': 2}) == ''
+    assert assembler.push({'type': 'chunk', 'text': 'efgh', 'id': 3}) == ''
+    frame = assembler.push({'type': 'chunk', 'text': 'ijkl', 'id': 4})
+    assert frame == sse_event({'type': 'chunk', 'text': 'abcdefghijkl'}, 4)
+    assert assembler.flush() == ''
+
+
+def test_coalescing_can_be_turned_off():
+    body = b''.join(iter_frames(chunks('a', 'b', 'c'), SSEPolicy(max_bytes=0))).decode()
+    assert [event['text'] for event in parse_sse(body)] == ['a', 'b', 'c']
+
+
+def test_gzip_is_one_continuous_stream():
+    events = [{'type': 'init'}] + chunks('Once', ' upon', ' a time') + [{'type': 'done'}]
+    frames = list(iter_frames(events, SLOW, compress=True))
+    decompressor = zlib.decompressobj(31)
+    # Each frame decodes on arrival, before the stream is finished
+    first = decompressor.decompress(frames[0]).decode()
+    assert first == sse_event({'type': 'init'})
+    rest = b''.join(decompressor.decompress(frame) for frame in frames[1:]).decode()
+    assert parse_sse(first + rest)[-1] == {'type': 'done'}
+    assert decompressor.eof
+
+
+def test_gzip_needs_policy_and_client_support():
+    assert SSEPolicy(gzip=True).accepts_gzip('br, GZIP')
+    assert not SSEPolicy(gzip=True).accepts_gzip(None)
+    assert not SSEPolicy(gzip=False).accepts_gzip('gzip')
+
+
+class TimedSource:
+    """Timed-read source backed by a queue, as stream_buffer.StreamReader is"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.closed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return IDLE
+
+    def close(self):
+        self.closed = True
+
+
+def test_timed_source_gets_heartbeats_and_timed_flushes():
+    source = TimedSource()
+    frames = iter_frames(source, SSEPolicy(max_bytes=1000, max_delay=0.05, heartbeat=0.1))
+    for event in chunks('Once', ' upon'):
+        source.queue.put(event)
+    assert parse_sse(next(frames).decode()) == chunks('Once')
+    started = time.monotonic()
+    # The second chunk is held back, then flushed once max_delay passes with nothing new
+    assert parse_sse(next(frames).decode()) == chunks(' upon')
+    assert time.monotonic() - started < 0.5
+    assert next(frames).decode() == HEARTBEAT
+    source.queue.put(END)
+    assert list(frames) == []
+    assert source.closed
+
+
+def test_async_streams_get_heartbeats():
+    async def events():
+        yield {'type': 'init'}
+        await asyncio.sleep(0.25)
+        yield {'type': 'done'}
+
+    async def collect():
+        return [frame.decode() async for frame in aiter_frames(events(), SSEPolicy(heartbeat=0.1))]
+    frames = asyncio.run(collect())
+    assert frames[0] == sse_event({'type': 'init'})
+    assert frames[-1] == sse_event({'type': 'done'})
+    assert HEARTBEAT in frames[1:-1]
+
+
+def test_threaded_source_gives_plain_generators_heartbeats():
+    def events():
+        yield {'type': 'init'}
+        time.sleep(0.25)
+        yield {'type': 'done'}
+
+    frames = [frame.decode() for frame in iter_frames(ThreadedSource(events()), SSEPolicy(heartbeat=0.1))]
+    assert frames[0] == sse_event({'type': 'init'})
+    assert frames[-1] == sse_event({'type': 'done'})
+    assert HEARTBEAT in frames[1:-1]
+
+
+def test_threaded_source_reraises_errors_and_closes_on_stop():
+    def failing():
+        yield {'type': 'init'}
+        raise RuntimeError('upstream failed')
+
+    frames = iter_frames(ThreadedSource(failing()), SLOW)
+    assert parse_sse(next(frames).decode()) == [{'type': 'init'}]
+    with pytest.raises(RuntimeError, match='upstream failed'):
+        next(frames)
+
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                yield {'type': 'chunk', 'text': 'x'}
+        finally:
+            closed.set()
+
+    source = ThreadedSource(endless())
+    assert source.get(1) == {'type': 'chunk', 'text': 'x'}
+    source.close()
+    assert closed.wait(2)
@@ -0,0 +1,106 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import app as storygen
+import static_assets
+from static_assets import MANIFEST_NAME, AssetManifest, build_assets, fingerprint
+
+CSS = b'body { color: #333; }\n' * 50
+
+
+@pytest.fixture
+def static(tmp_path):
+    source = tmp_path / 'static'
+    (source / 'css').mkdir(parents=True)
+    (source / 'css' / 'styles.css').write_bytes(CSS)
+    (source / 'js').mkdir()
+    (source / 'js' / 'tiny.js').write_bytes(b'x')
+    (source / 'logo.png').write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(500))
+    return source
+
+
+def accepts(*encodings):
+    return lambda encoding: encoding in encodings
+
+
+def test_build_fingerprints_and_precompresses(static, tmp_path):
+    out = tmp_path / 'dist'
+    manifest = build_assets(str(static), str(out))
+    css = manifest['assets']['css/styles.css']
+    assert css['path'] == fingerprint('css/styles.css', CSS)
+    assert (out / css['path']).read_bytes() == CSS
+    assert gzip.decompress((out / (css['path'] + '.gz')).read_bytes()) == CSS
+    assert css['encodings']['gzip'] < css['size']
+    # Images are already compressed, and tiny files don't shrink
+    assert manifest['assets']['logo.png']['encodings'] == {}
+    assert manifest['assets']['js/tiny.js']['encodings'] == {}
+    assert json.loads((out / MANIFEST_NAME).read_text()) == manifest
+
+
+def test_changed_content_gets_a_new_name(static, tmp_path):
+    out = tmp_path / 'dist'
+    first = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    (static / 'css' / 'styles.css').write_bytes(CSS + b'a { }')
+    second = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    assert first != second
+    assert (out / first).exists()
+    build_assets(str(static), str(out), prune=True)
+    assert not (out / first).exists()
+    assert not (out / (first + '.gz')).exists()
+    assert (out / second).exists()
+
+
+def test_select_prefers_the_best_accepted_encoding(static, tmp_path, monkeypatch):
+    out = tmp_path / 'dist'
+    monkeypatch.setattr(static_assets, 'brotli', None)
+    built = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    manifest = AssetManifest(str(out))
+    path = os.path.join(str(out), *built.split('/'))
+    assert manifest.select(built, accepts('gzip', 'br')) == (path + '.gz', 'gzip')
+    assert manifest.select(built, accepts()) == (path, None)
+    assert manifest.lookup('css/styles.css') == built
+    assert manifest.lookup('css/missing.css') is None
+
+
+def test_select_serves_earlier_builds_but_nothing_else(static, tmp_path):
+    out = tmp_path / 'dist'
+    old = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    manifest = AssetManifest(str(out))
+    assert manifest.lookup('css/styles.css') == old
+    (static / 'css' / 'styles.css').write_bytes(CSS + b'a { }')
+    new = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    # The manifest is reloaded when its file changes
+    os.utime(out / MANIFEST_NAME, ns=(1, 1))
+    assert manifest.lookup('css/styles.css') == new
+    assert manifest.select(old, accepts('gzip'))[1] == 'gzip'
+    assert manifest.select('css/missing.css', accepts()) is None
+    assert manifest.select(MANIFEST_NAME, accepts()) is None
+    assert manifest.select('../static/css/styles.css', accepts()) is None
+
+
+def test_without_a_build_lookups_fall_back(tmp_path):
+    manifest = AssetManifest(str(tmp_path / 'never-built'))
+    assert manifest.lookup('css/styles.css') is None
+    assert manifest.stats() == {'assets': 0, 'bytes': 0, 'compressed_bytes': {}}
+
+
+def test_asset_route_sends_immutable_precompressed_files(static, tmp_path, monkeypatch, client):
+    out = tmp_path / 'dist'
+    built = build_assets(str(static), str(out))['assets']['css/styles.css']['path']
+    monkeypatch.setattr(storygen, 'asset_manifest', AssetManifest(str(out)))
+
+    response = client.get(f'/assets/{built}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == CSS
+
+    plain = client.get(f'/assets/{built}', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.get_data() == CSS
+    assert client.get('/assets/css/styles.css').status_code == 404
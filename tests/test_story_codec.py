@@ -0,0 +1,97 @@
+import pytest
+
+import database
+import story_codec
+from story_codec import FORMAT_PLAIN, FORMAT_ZLIB, FORMAT_ZSTD, StoryCodec, train_dictionary
+
+SAMPLES = [
+    f'Once upon a time in a quiet village by the river, a young {name} found a silver key. '
+    f'The old lantern flickered as the wind whispered about forgotten kingdoms beyond the hills.'
+    for name in ('fox', 'girl', 'baker', 'knight', 'owl', 'sailor')
+]
+TEXT = ('Once upon a time in a quiet village by the river, a young miller found a silver key. '
+        'The old lantern flickered as the wind whispered about forgotten kingdoms. Ünïcödé ✓')
+
+
+def store_dictionary(conn, algorithm):
+    with conn:
+        cursor = conn.execute('INSERT INTO compression_dicts (algorithm, data) VALUES (?, ?)',
+                              (algorithm, train_dictionary(algorithm, SAMPLES)))
+    return cursor.lastrowid
+
+
+@pytest.fixture
+def conn(pool):
+    conn = pool.acquire()
+    yield conn
+    pool.release(conn)
+
+
+def algorithms():
+    params = ['zlib']
+    params.append(pytest.param('zstd', marks=pytest.mark.skipif(
+        story_codec.zstandard is None, reason='zstandard is not installed')))
+    return params
+
+
+def test_plain_bodies_are_stored_as_text(conn):
+    codec = StoryCodec('none')
+    assert codec.encode(conn, TEXT) == (TEXT, FORMAT_PLAIN, None)
+    assert codec.decode(conn, TEXT, FORMAT_PLAIN, None) == TEXT
+
+
+@pytest.mark.parametrize('algorithm', algorithms())
+def test_round_trip_without_a_dictionary(conn, algorithm):
+    codec = StoryCodec(algorithm)
+    blob, story_format, dict_id = codec.encode(conn, TEXT)
+    assert story_format == {'zlib': FORMAT_ZLIB, 'zstd': FORMAT_ZSTD}[algorithm]
+    assert dict_id is None
+    assert StoryCodec('none').decode(conn, blob, story_format, dict_id) == TEXT
+
+
+@pytest.mark.parametrize('algorithm', algorithms())
+def test_round_trip_with_a_trained_dictionary(conn, algorithm):
+    codec = StoryCodec(algorithm)
+    plain_size = len(codec.encode(conn, TEXT)[0])
+    dict_id = store_dictionary(conn, algorithm)
+    codec.reset()
+    blob, story_format, used_dict = codec.encode(conn, TEXT)
+    assert used_dict == dict_id
+    assert len(blob) < plain_size
+    # A fresh codec (another worker) loads the dictionary from the table to decode
+    assert StoryCodec('none').decode(conn, blob, story_format, used_dict) == TEXT
+
+
+def test_zlib_dictionary_keeps_shared_phrases():
+    dictionary = train_dictionary('zlib', SAMPLES)
+    assert b'a silver key.' in dictionary
+    assert b'fox' not in dictionary
+    assert len(train_dictionary('zlib', SAMPLES * 1000)) <= story_codec.ZLIB_DICT_SIZE
+
+
+def test_missing_dictionary_is_an_error(conn):
+    with pytest.raises(ValueError):
+        StoryCodec('zlib').decode(conn, b'', FORMAT_ZLIB, 999)
+
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        StoryCodec('lz4')
+    with pytest.raises(ValueError):
+        train_dictionary('lz4', SAMPLES)
+
+
+def test_recompress_converts_mixed_rows_and_can_be_rerun(conn):
+    with conn:
+        for i, text in enumerate(SAMPLES):
+            database.insert_story(conn, f's{i}', None, {'prompt': 'p', 'story': text})
+    store_dictionary(conn, 'zlib')
+    codec = StoryCodec('zlib')
+    assert database.recompress_stories(conn, codec, batch_size=4) == len(SAMPLES)
+    assert database.recompress_stories(conn, codec, batch_size=4) == 0
+
+    rows = conn.execute('SELECT id, story, story_format, story_dict FROM stories ORDER BY rowid').fetchall()
+    assert {row['story_format'] for row in rows} == {FORMAT_ZLIB}
+    assert [database.read_story_body(conn, row) for row in rows] == SAMPLES
+    # Full-text search still finds recompressed stories
+    assert conn.execute("SELECT COUNT(*) FROM stories_fts WHERE stories_fts MATCH 'baker'").fetchone()[0] == 1
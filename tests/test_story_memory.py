@@ -0,0 +1,109 @@
+import pytest
+
+from scheduler import estimate_tokens
+from story_memory import StoryMemory
+
+
+class Summarizer:
+    """Records each passage and returns a short summary naming how many it has seen"""
+
+    def __init__(self):
+        self.passages = []
+        self.fail = False
+
+    def __call__(self, previous, passage, max_words, user_key):
+        if self.fail:
+            raise RuntimeError('RATE_LIMIT')
+        self.passages.append(passage)
+        return f'summary of {len(self.passages)} passages'
+
+
+@pytest.fixture
+def summarizer():
+    return Summarizer()
+
+
+@pytest.fixture
+def memory(pool, summarizer):
+    # 20 summary tokens, a 50 token window and 30 tokens of slack
+    return StoryMemory(pool, summarizer, budget_tokens=100, chunk_tokens=100)
+
+
+def words(start, count):
+    return ' '.join(f'w{i}' for i in range(start, start + count)) + ' '
+
+
+def test_short_stories_need_no_summary(memory, summarizer):
+    text = words(0, 20)
+    assert memory.build_context('k', text) == ('', text)
+    assert summarizer.passages == []
+
+
+def test_long_stories_fold_into_a_summary_within_budget(memory, summarizer):
+    text = words(0, 400)
+    summary, recent = memory.build_context('k', text)
+    assert summary == f'summary of {len(summarizer.passages)} passages'
+    assert text.endswith(recent)
+    assert estimate_tokens(recent) <= 50
+    # Everything before the window was summarized, in passages of at most chunk_tokens
+    assert ''.join(summarizer.passages) + recent == text
+    assert all(estimate_tokens(passage) <= 100 for passage in summarizer.passages)
+    assert recent.startswith('w')
+
+
+def test_continuing_only_summarizes_the_new_text(memory, summarizer):
+    text = words(0, 400)
+    memory.build_context('k', text)
+    folded = ''.join(summarizer.passages)
+    calls = len(summarizer.passages)
+
+    # A small addition stays within the slack: no summary call at all
+    text += words(400, 5)
+    assert memory.build_context('k', text)[0] == f'summary of {calls} passages'
+    assert len(summarizer.passages) == calls
+
+    text += words(405, 200)
+    summary, recent = memory.build_context('k', text)
+    new_passages = ''.join(summarizer.passages[calls:])
+    assert folded + new_passages + recent == text
+    assert memory.stats()['folds'] == 2
+
+
+def test_edited_text_is_summarized_again(memory, summarizer):
+    text = words(0, 400)
+    memory.build_context('k', text)
+    calls = len(summarizer.passages)
+    edited = 'Changed opening. ' + text
+    summary, recent = memory.build_context('k', edited)
+    assert summarizer.passages[calls].startswith('Changed opening.')
+
+
+def test_summary_failures_fall_back_to_the_window(memory, summarizer):
+    summarizer.fail = True
+    text = words(0, 400)
+    summary, recent = memory.build_context('k', text)
+    assert summary == ''
+    assert text.endswith(recent)
+    assert estimate_tokens(recent) <= 50
+
+
+def test_memory_keys():
+    assert StoryMemory.memory_key('abc', 'text') == 'story:abc'
+    key = StoryMemory.memory_key(None, 'x' * 256 + 'tail')
+    assert key == StoryMemory.memory_key(None, 'x' * 256 + 'different tail')
+    assert key.startswith('text:')
+
+
+def test_forget_and_purge(pool, memory):
+    memory.build_context(StoryMemory.memory_key('s1', ''), words(0, 400))
+    memory.build_context('old', words(0, 400))
+    conn = pool.acquire()
+    try:
+        with conn:
+            conn.execute("UPDATE story_memory SET updated_at = datetime('now', '-40 days') WHERE key = 'old'")
+        assert memory.purge() == 1
+        with conn:
+            memory.forget(conn, 's1')
+        assert conn.execute('SELECT COUNT(*) FROM story_memory').fetchone()[0] == 0
+    finally:
+        pool.release(conn)
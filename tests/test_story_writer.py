@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+
+import database
+from story_writer import PendingWrite, StoryWriter
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'writer.db')
+    database.init_db(path)
+    return path
+
+
+def story(text='Once upon a time', **extra):
+    return dict({'title': 'T', 'prompt': 'p', 'story': text}, **extra)
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_queued_stories_are_committed_in_batches(db_path):
+    committed = []
+    writer = StoryWriter(db_path, batch_size=50, interval=0.2, on_commit=committed.append)
+    writes = [writer.submit(f's{i}', None, story()) for i in range(20)]
+    for write in writes:
+        write.wait(5)
+    writer.close()
+    assert count(db_path) == 20
+    # One writer thread batching for 200ms commits the burst in very few transactions
+    assert writer.stats()['batches'] < 5
+    assert sum(len(batch) for batch in committed) == 20
+    assert writer.stats()['queued'] == 0
+    assert writer.stats()['written'] == 20
+
+
+def test_wait_gives_read_your_writes(db_path):
+    writer = StoryWriter(db_path, interval=0.05)
+    writer.submit('mine', None, story())
+    writer.wait('mine', timeout=5)
+    assert count(db_path) == 1
+    # Already committed (or never queued) ids return at once
+    writer.wait('mine', timeout=0)
+    writer.wait('unknown', timeout=0)
+    writer.close()
+
+
+def test_a_bad_row_fails_alone(db_path):
+    writer = StoryWriter(db_path, batch_size=10, interval=0.2)
+    good = writer.submit('good', None, story())
+    bad = writer.submit('bad', None, {'title': 'No prompt', 'story': 'text'})
+    other = writer.submit('other', None, story())
+    good.wait(5)
+    other.wait(5)
+    with pytest.raises(KeyError):
+        bad.wait(5)
+    writer.close()
+    assert count(db_path) == 2
+    assert writer.stats()['failed'] == 1
+
+
+def test_close_flushes_the_queue_and_refuses_new_saves(db_path):
+    writer = StoryWriter(db_path, batch_size=1000, interval=10)
+    writes = [writer.submit(f's{i}', None, story()) for i in range(5)]
+    writer.close()
+    for write in writes:
+        write.wait(0)
+    assert count(db_path) == 5
+    with pytest.raises(RuntimeError):
+        writer.submit('late', None, story())
+
+
+def test_connection_errors_reach_the_waiters(tmp_path):
+    # The directory doesn't exist, so the writer can't open the database
+    writer = StoryWriter(str(tmp_path / 'missing' / 'x.db'), interval=0)
+    write = writer.submit('s', None, story())
+    with pytest.raises(sqlite3.OperationalError):
+        write.wait(5)
+    writer.close()
+    assert writer.stats()['failed'] == 1
+
+
+def test_pending_write_times_out():
+    with pytest.raises(TimeoutError):
+        PendingWrite('s', None, story()).wait(0.01)
@@ -0,0 +1,201 @@
+import asyncio
+import queue
+import time
+
+import pytest
+
+from sse import END, IDLE
+from stream_buffer import BufferedStream, StreamBuffer, StreamNotFound
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+class Producer:
+    """Upstream event source the test feeds one event at a time"""
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            event = self.events.get(timeout=10)
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+
+    def send(self, *texts, done=False):
+        for text in texts:
+            self.events.put({'type': 'chunk', 'text': text})
+        if done:
+            self.events.put({'type': 'done'})
+            self.events.put(None)
+
+
+@pytest.fixture
+def buffer(pool):
+    # No sweeping unless a test asks for it
+    return StreamBuffer(pool, ttl=60, detach_grace=60, sweep_interval=60)
+
+
+def read_all(reader):
+    return [event for event in reader]
+
+
+def test_readers_replay_after_last_event_id_then_follow_the_tail(buffer):
+    stream = buffer.create(user_id=1)
+    producer = Producer()
+    first = stream.replay()
+    buffer.run(stream, producer)
+    producer.send('a', 'b', 'c')
+    wait_until(lambda: len(stream.events) == 3)
+
+    resumed = buffer.get(stream.id, 1).replay(after=2)
+    assert resumed.get(1) == {'type': 'chunk', 'text': 'c', 'id': 3}
+    assert resumed.get(0.01) is IDLE
+    producer.send('d', done=True)
+    assert read_all(resumed) == [{'type': 'chunk', 'text': 'd', 'id': 4}, {'type': 'done', 'id': 5}]
+    assert [event['id'] for event in read_all(first)] == [1, 2, 3, 4, 5]
+    assert producer.closed
+    assert stream.delivered
+    assert buffer.stats()['resumed'] == 1
+
+
+def test_streams_belong_to_their_user(buffer):
+    stream = buffer.create(user_id=1)
+    with pytest.raises(PermissionError):
+        buffer.get(stream.id, 2)
+    anonymous = buffer.create(user_id=None)
+    assert buffer.get(anonymous.id, 2) is anonymous
+    with pytest.raises(StreamNotFound):
+        buffer.get('missing', 1)
+
+
+def test_a_stream_left_before_the_end_is_spilled_for_other_workers(pool, buffer):
+    stream = buffer.create(user_id=1)
+    producer = Producer()
+    reader = stream.replay()
+    buffer.run(stream, producer)
+    producer.send('a')
+    assert reader.get(1)['text'] == 'a'
+    # The client disconnects, then the generation finishes
+    reader.close()
+    producer.send('b', done=True)
+    wait_until(lambda: stream.finished)
+    assert stream.spilled
+
+    other_worker = StreamBuffer(pool)
+    loaded = other_worker.get(stream.id, 1)
+    assert loaded is not stream
+    assert read_all(loaded.replay(after=1)) == [
+        {'type': 'chunk', 'text': 'b', 'id': 2}, {'type': 'done', 'id': 3}
+    ]
+    with pytest.raises(PermissionError):
+        other_worker.get(stream.id, 2)
+
+
+def test_delivered_streams_are_dropped_without_spilling(pool):
+    buffer = StreamBuffer(pool, ttl=0, sweep_interval=0.02)
+    delivered = buffer.create(user_id=1)
+    reader = delivered.replay()
+    buffer.run(delivered, iter([{'type': 'done'}]))
+    assert read_all(reader) == [{'type': 'done', 'id': 1}]
+
+    # Nobody ever read this one, so it is spilled on its way out of memory
+    unread = buffer.create(user_id=1)
+    buffer.run(unread, iter([{'type': 'done'}]))
+    wait_until(lambda: buffer.stats()['buffered'] == 0)
+    assert not delivered.spilled
+    assert unread.spilled
+    with pytest.raises(StreamNotFound):
+        buffer.get(delivered.id, 1)
+    assert buffer.get(unread.id, 1).events == [{'type': 'done'}]
+
+
+def test_streams_nobody_reads_are_abandoned(pool):
+    buffer = StreamBuffer(pool, detach_grace=0.05, sweep_interval=0.02)
+    stream = buffer.create(user_id=1)
+    reader = stream.replay()
+    producer = Producer()
+    buffer.run(stream, producer)
+    producer.send('a')
+    assert reader.get(1)['text'] == 'a'
+    reader.close()
+
+    wait_until(lambda: stream.finished)
+    assert stream.cancelled.is_set()
+    assert stream.events[-1]['type'] == 'error'
+    assert buffer.stats()['abandoned'] == 1
+    # Whatever the upstream still sends is dropped
+    producer.send('late', done=True)
+    time.sleep(0.05)
+    assert [event.get('text') for event in stream.events if event['type'] == 'chunk'] == ['a']
+
+
+def test_purge_deletes_old_spilled_streams(pool):
+    buffer = StreamBuffer(pool, retention=60)
+    stream = buffer.create(user_id=1)
+    buffer._finish(stream)
+    buffer._spill(stream)
+    conn = pool.acquire()
+    try:
+        assert buffer.purge() == 0
+        with conn:
+            conn.execute("UPDATE streams SET finished_at = datetime('now', '-2 minutes')")
+        assert buffer.purge() == 1
+        assert conn.execute('SELECT COUNT(*) FROM stream_events').fetchone()[0] == 0
+    finally:
+        pool.release(conn)
+
+
+def test_async_producer_and_reader(buffer):
+    async def events():
+        for text in ('a', 'b'):
+            await asyncio.sleep(0.01)
+            yield {'type': 'chunk', 'text': text}
+        yield {'type': 'done'}
+
+    async def main():
+        stream = buffer.create(user_id=None)
+        buffer.arun(stream, events())
+        return [event async for event in stream.areplay(after=1)]
+    assert asyncio.run(main()) == [{'type': 'chunk', 'text': 'b', 'id': 2}, {'type': 'done', 'id': 3}]
+
+
+def test_reader_reports_the_end():
+    stream = BufferedStream('s', None)
+    reader = stream.replay()
+    stream.append({'type': 'done'})
+    stream.finish()
+    assert reader.get(0)['id'] == 1
+    assert reader.get(0) is END
+    stream.append({'type': 'late'})
+    assert stream.events == [{'type': 'done'}]
+
+
+def test_generate_can_be_resumed_over_http(make_user, sse):
+    user_client = make_user()
+    response = user_client.post('/generate', json={'prompt': 'a clockwork owl'})
+    events = sse(response)
+    stream_id = response.headers['X-Stream-Id']
+    seen = events[1]['id']
+
+    resumed = user_client.get(f'/generate/{stream_id}', headers={'Last-Event-ID': str(seen)})
+    replayed = sse(resumed)
+    assert replayed[0]['id'] > seen
+    assert replayed[-1] == events[-1]
+    text = ''.join(event.get('text', '') for event in replayed)
+    assert text == ''.join(event.get('text', '') for event in events if event['id'] > seen)
+
+    assert user_client.get(f'/generate/{stream_id}?last_event_id=x').status_code == 400
+    assert make_user().get(f'/generate/{stream_id}').status_code == 403
+    assert user_client.get('/generate/missing').status_code == 404
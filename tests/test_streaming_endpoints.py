@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+import app as storygen
+from app import PrefixStripper
+from sse import HEARTBEAT, SSEPolicy
+
+STORY = 'The lighthouse keeper counted the ships every night until one did not come back.'
+
+
+def test_enhance_streams_the_event_protocol(client, sse):
+    response = client.post('/enhance', json={'story': STORY, 'type': 'dialogue', 'stream': True})
+    assert response.mimetype == 'text/event-stream'
+    events = sse(response)
+    assert events[0] == {'type': 'init', 'enhancement_type': 'dialogue'}
+    chunks = [event['text'] for event in events if event['type'] == 'chunk']
+    assert chunks
+    assert events[-1] == {'type': 'done', 'word_count': len(''.join(chunks).split())}
+
+
+def test_enhance_json_mode_is_unchanged(client):
+    body = client.post('/enhance', json={'story': STORY}).get_json()
+    assert body['enhanced_story']
+
+
+def test_continue_streams_the_event_protocol(client, sse):
+    events = sse(client.post('/continue', json={'story': STORY, 'max_length': 60, 'stream': True}))
+    assert events[0] == {'type': 'init'}
+    assert [event['type'] for event in events[1:-1]] == ['chunk'] * (len(events) - 2)
+    text = ''.join(event['text'] for event in events[1:-1])
+    assert events[-1] == {'type': 'done', 'word_count': len(text.split())}
+    assert not text.startswith(STORY)
+
+
+def test_slow_enhance_stream_gets_heartbeats(client, sse, monkeypatch):
+    monkeypatch.setattr(storygen, 'SSE_POLICY', SSEPolicy(heartbeat=0.05))
+    monkeypatch.setattr(storygen.story_gen.client, 'ttft', 0.3)
+    response = client.post('/enhance', json={'story': STORY, 'type': 'detail', 'stream': True})
+    body = response.get_data(as_text=True)
+    assert HEARTBEAT in body
+    assert sse(response)[-1]['type'] == 'done'
+
+
+def test_identical_streams_share_one_call_without_use_cache(app, sse, monkeypatch):
+    monkeypatch.setattr(storygen.story_gen.client, 'ttft', 0.3)
+    before = storygen.story_gen.single_flight.stats()['followers']
+    body = {'story': STORY + ' (shared)', 'type': 'detail', 'stream': True}
+    results = []
+
+    def request():
+        results.append(sse(app.test_client().post('/enhance', json=body)))
+    threads = [threading.Thread(target=request) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    texts = [''.join(event['text'] for event in events if event['type'] == 'chunk') for events in results]
+    assert texts[0] and texts[0] == texts[1]
+    assert storygen.story_gen.single_flight.stats()['followers'] == before + 1
+
+
+@pytest.mark.parametrize('url', ['/enhance', '/continue'])
+def test_streaming_modes_validate_before_streaming(client, url):
+    response = client.post(url, json={'stream': True})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_prefix_stripper_drops_an_echoed_prompt_split_across_chunks():
+    stripper = PrefixStripper('Once upon a time')
+    out = [stripper.feed(chunk) for chunk in [' Once up', 'on a ti', 'me there was', ' a fox']]
+    assert ''.join(out) + stripper.flush() == 'there was a fox'
+
+
+def test_prefix_stripper_passes_other_text_through():
+    stripper = PrefixStripper('Once upon a time')
+    out = [stripper.feed(chunk) for chunk in ['Once', ' more the', ' fox ran']]
+    assert ''.join(out) + stripper.flush() == 'Once more the fox ran'
+    short = PrefixStripper('Once upon a time')
+    assert short.feed('Once') == ''
+    assert short.flush() == 'Once'
@@ -0,0 +1,69 @@
+import app as storygen
+import database
+
+
+def snapshot(conn):
+    """Non-empty stats rows; a user whose last story is deleted keeps a zeroed total"""
+    return (
+        sorted(tuple(row) for row in conn.execute('SELECT * FROM user_stats WHERE total_stories > 0')),
+        sorted(tuple(row) for row in conn.execute('SELECT * FROM user_genre_stats WHERE story_count > 0')),
+    )
+
+
+def test_incremental_stats_match_a_rebuild(pool):
+    conn = pool.acquire()
+    try:
+        with conn:
+            for name in ('ann', 'bob'):
+                conn.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                             (name, f'{name}@example.com', 'x'))
+            stories = [
+                ('s1', 1, 'fantasy', 'one two three'),
+                ('s2', 1, 'fantasy', 'one two'),
+                ('s3', 1, None, 'one'),
+                ('s4', 2, 'horror', 'one two three four'),
+                ('s5', None, 'horror', 'anonymous stories are not counted'),
+            ]
+            for story_id, user_id, genre, text in stories:
+                database.insert_story(conn, story_id, user_id, {'prompt': 'p', 'story': text, 'genre': genre})
+            conn.execute('DELETE FROM stories WHERE id = ?', ('s2',))
+            database.update_user_stats(conn, 1, 'fantasy', 2, sign=-1)
+            conn.execute('DELETE FROM stories WHERE id = ?', ('s4',))
+            database.update_user_stats(conn, 2, 'horror', 4, sign=-1)
+        incremental = snapshot(conn)
+        with conn:
+            database.rebuild_user_stats(conn)
+        assert incremental == snapshot(conn)
+        assert incremental[0] == [(1, 2, 4)]
+        # A genre whose last story is deleted disappears rather than lingering at zero
+        assert conn.execute('SELECT COUNT(*) FROM user_genre_stats WHERE user_id = 2').fetchone()[0] == 0
+    finally:
+        pool.release(conn)
+
+
+def test_story_stats_follow_saves_and_deletes(app, make_user):
+    user_client = make_user()
+    with user_client.session_transaction() as sess:
+        user_id = sess['user_id']
+    assert user_client.get('/story-stats').get_json() == {
+        'total_stats': {'total_stories': 0, 'total_words': 0, 'avg_words': None},
+        'genre_stats': []
+    }
+    with app.app_context():
+        first = storygen.save_story(user_id, {'prompt': 'p', 'story': 'a b c d', 'genre': 'mystery'}, durable=True)
+        storygen.save_story(user_id, {'prompt': 'p', 'story': 'a b', 'genre': 'mystery'}, durable=True)
+        storygen.save_story(user_id, {'prompt': 'p', 'story': 'a b c'}, durable=True)
+
+    stats = user_client.get('/story-stats').get_json()
+    assert stats['total_stats'] == {'total_stories': 3, 'total_words': 9, 'avg_words': 3.0}
+    genres = {row['genre']: row for row in stats['genre_stats']}
+    assert genres['mystery'] == {'genre': 'mystery', 'genre_count': 2, 'total_words': 6, 'avg_words': 3.0}
+    assert genres[None]['genre_count'] == 1
+
+    assert user_client.delete(f'/story/{first}').status_code == 200
+    stats = user_client.get('/story-stats').get_json()
+    assert stats['total_stats'] == {'total_stories': 2, 'total_words': 5, 'avg_words': 2.5}
+
+
+def test_story_stats_require_login(client):
+    assert client.get('/story-stats').status_code == 401